@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# End-to-end benchmark for the analysis path: database load, detection SQL,
+# get_sp_by_id enrichment, GraphDiff.compare and ScreenRender. Every tenant
+# size runs in a fresh process so peak RSS is not inherited between sizes.
+#
+#   python benchmarks/bench_analysis.py --sizes 1000 10000 --output bench.json
+#   python benchmarks/bench_analysis.py --sizes 1000 --compare bench.json
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "src"))
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as fp:
+        pages = int(fp.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PhaseTimer():
+    def __init__(self):
+        self.phases = {}
+
+    def __call__(self, name, **extra):
+        return _Phase(self, name, extra)
+
+
+class _Phase():
+    def __init__(self, timer, name, extra):
+        self._timer = timer
+        self._name  = name
+        self.extra  = extra
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._rss   = _rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._timer.phases[self._name] = dict(
+            seconds=round(time.perf_counter() - self._start, 4),
+            rss_start_mb=round(self._rss, 1),
+            rss_end_mb=round(_rss_mb(), 1),
+            peak_rss_mb=round(_peak_rss_mb(), 1),
+            **self.extra
+        )
+
+
+def run_size(sp_count, seed, dt_path, enrich_limit, render_limit, work_dir):
+    from rich.console import Console
+    from synth_tenant import SyntheticTenant, write_database
+    from GraphAudit import GraphData, GraphDiff, DetectionFactory
+
+    os.chdir(REPO_ROOT)
+    timer = PhaseTimer()
+    db_path = Path(work_dir) / f"graph_data_{sp_count}.db"
+
+    with timer("generate") as phase:
+        tenant = SyntheticTenant(sp_count, seed).build()
+        write_database(db_path, tenant)
+        phase.extra["rows"] = {name: len(rows) for name, rows in tenant.tables.items()}
+        phase.extra["db_bytes"] = db_path.stat().st_size
+    next_sp_df = tenant.mutate()
+    del tenant
+
+    with timer("load"):
+        graph_data = GraphData(str(db_path))
+
+    with timer("compile_templates") as phase:
+        detections = list(DetectionFactory(graph_data, dt_path, template_cache=None))
+        phase.extra["templates"] = len(detections)
+
+    matched = {}
+    with timer("detection_sql") as phase:
+        for detection in detections:
+            ids = set()
+            for rows in graph_data.query_stream(detection.query, output_format='list'):
+                ids.update(row[0] for row in rows)
+            matched[detection.name] = ids
+        phase.extra["matched"] = {name: len(ids) for name, ids in matched.items()}
+
+    enriched = {}
+    with timer("enrichment") as phase:
+        all_ids = set()
+        for ids in matched.values():
+            all_ids.update(ids)
+        sample = sorted(all_ids)[:enrich_limit]
+        for sp in graph_data.iter_sp_by_id(tuple(sample)):
+            enriched[sp["id"]] = sp
+        phase.extra["sps"] = len(enriched)
+
+    with timer("render") as phase:
+        rendered = 0
+        for detection in detections:
+            detection.console = Console(file=io.StringIO(), width=200)
+            results = [enriched[sp_id] for sp_id in sorted(matched[detection.name]) if sp_id in enriched]
+            detection.set_results(results[:render_limit])
+            detection.print()
+            rendered += len(results[:render_limit])
+        phase.extra["sps"] = rendered
+
+    with timer("diff") as phase:
+        graph_diff = GraphDiff()
+        graph_diff.make_hash('service_principals', ["passwordCredentials", "keyCredentials"])
+        cache_df = graph_data.tables['service_principals'].to_df()
+        result = graph_diff.compare('service_principals', cache_df, next_sp_df)
+        phase.extra["changes"] = {kind: len(df) for kind, df in result.items()}
+
+    db_path.unlink()
+    return dict(sp_count=sp_count, seed=seed, phases=timer.phases)
+
+
+def _run_in_child(queue, *args):
+    try:
+        queue.put(run_size(*args))
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def run_isolated(*args):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_in_child, args=(queue, *args))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def environment():
+    import duckdb
+    import pandas
+    try:
+        from importlib.metadata import version
+        graphaudit_version = version("graphaudit")
+    except Exception:
+        graphaudit_version = None
+    return dict(
+        graphaudit=graphaudit_version,
+        python=platform.python_version(),
+        duckdb=duckdb.__version__,
+        pandas=pandas.__version__,
+        platform=platform.platform(),
+        cpu_count=os.cpu_count()
+    )
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+    previous = {entry["sp_count"]: entry for entry in baseline.get("results", [])}
+    print(f"{'size':>8} {'phase':<18} {'before':>10} {'after':>10} {'ratio':>7}")
+    for entry in current["results"]:
+        old = previous.get(entry["sp_count"])
+        if not old or "phases" not in entry or "phases" not in old:
+            continue
+        for name, phase in entry["phases"].items():
+            before = old["phases"].get(name, {}).get("seconds")
+            after  = phase["seconds"]
+            if before:
+                print(f"{entry['sp_count']:>8} {name:<18} {before:>10.3f} {after:>10.3f} {after / before:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GraphAudit analysis path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dt-path", type=str, default="detections")
+    parser.add_argument("--enrich-limit", type=int, default=2000, help="Max SPs passed to get_sp_by_id")
+    parser.add_argument("--render-limit", type=int, default=200, help="Max SPs rendered per detection")
+    parser.add_argument("--work-dir", type=str, default=None, help="Directory for generated databases")
+    parser.add_argument("--output", type=str, default="bench_results.json")
+    parser.add_argument("--compare", type=str, help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="graphaudit_bench_")
+    report = dict(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        environment=environment(),
+        parameters=dict(
+            seed=args.seed,
+            dt_path=args.dt_path,
+            enrich_limit=args.enrich_limit,
+            render_limit=args.render_limit
+        ),
+        results=[]
+    )
+    for size in args.sizes:
+        print(f"[*] Benchmarking {size} service principals")
+        result = run_isolated(size, args.seed, args.dt_path, args.enrich_limit, args.render_limit, work_dir)
+        report["results"].append(result)
+        if "error" in result:
+            print(f"[-] {result['error']}")
+            continue
+        for name, phase in result["phases"].items():
+            print(f"    {name:<18} {phase['seconds']:>9.3f}s  peak {phase['peak_rss_mb']:>8.1f} MB")
+
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"[+] Results written to {args.output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Startup benchmark for the CLI. Each mode runs in a fresh interpreter with
+# -X importtime against a small synthetic database and records wall time,
+# total import time and which heavy dependencies were loaded. Modes fail if
+# they load a dependency they do not use, or if wall time regresses against
+# a previous run. Import time is reported but not compared: imports that
+# happen in detection worker threads are inflated by GIL contention.
+#
+#   python benchmarks/bench_startup.py --output startup.json
+#   python benchmarks/bench_startup.py --compare startup.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "benchmarks"))
+
+# Top-level packages reported for every mode
+HEAVY_MODULES = (
+    'msgraph', 'azure', 'httpx', 'kiota_abstractions', 'kiota_serialization_json',
+    'pandas', 'numpy', 'rich', 'duckdb', 'jmespath', 'yaml'
+)
+SDK_MODULES = ('msgraph', 'azure', 'httpx', 'kiota_abstractions', 'kiota_serialization_json')
+
+# name: (interpreter arguments, modules the mode must not load). Arguments
+# after -m GraphAudit.main run the real CLI; the collect and daemon modes
+# cannot reach Graph offline, so only their imports are measured.
+MODES = {
+    'import':  (["-c", "import GraphAudit.main"], SDK_MODULES + ('pandas', 'numpy', 'rich')),
+    'help':    (["-m", "GraphAudit.main", "--help"], SDK_MODULES + ('pandas', 'numpy', 'rich')),
+    'detect':  (["-m", "GraphAudit.main", "{cli}"], SDK_MODULES),
+    'summary': (["-m", "GraphAudit.main", "{cli}", "--summary"], SDK_MODULES),
+    'report':  (["-m", "GraphAudit.main", "{cli}", "--format", "json", "--report-file", os.devnull], SDK_MODULES + ('rich',)),
+    'collect': (["-c", "import GraphAudit.main, GraphAudit.graphcrawl"], ()),
+    'daemon':  (["-c", "import GraphAudit.main, GraphAudit.graphcrawl, GraphAudit.daemon"], ())
+}
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package"
+    total_us = 0
+    modules  = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        total_us += int(fields[0])
+        modules.add(fields[2].strip().split('.')[0])
+    return total_us / 1000, modules
+
+
+def run_mode(name, work_dir, cli_args, repeat):
+    argv, forbidden = MODES[name]
+    args = []
+    for arg in argv:
+        args.extend(cli_args if arg == "{cli}" else [arg])
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT / "src"))
+    samples = []
+    modules = set()
+    # The first run writes bytecode and the template cache and is discarded
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime"] + args,
+            cwd=work_dir, env=env, capture_output=True, text=True
+        )
+        wall_ms = (time.perf_counter() - start) * 1000
+        if proc.returncode != 0:
+            return dict(error=proc.stderr.strip().splitlines()[-1:] or [f"exit code {proc.returncode}"])
+        import_ms, modules = parse_importtime(proc.stderr)
+        if i:
+            samples.append((wall_ms, import_ms))
+    loaded = sorted(set(HEAVY_MODULES) & modules)
+    return dict(
+        wall_ms=round(statistics.median(s[0] for s in samples), 1),
+        import_ms=round(statistics.median(s[1] for s in samples), 1),
+        modules=len(modules),
+        heavy_modules=loaded,
+        unexpected=sorted(set(forbidden) & modules)
+    )
+
+
+def prepare(work_dir, sp_count, seed):
+    from synth_tenant import SyntheticTenant, write_database
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    db_path = work_dir / "graph_data.db"
+    write_database(db_path, SyntheticTenant(sp_count, seed).build())
+    # The CLI reads config/ and detections/ from its working directory
+    for name in ("config", "detections"):
+        link = work_dir / name
+        if not link.exists():
+            link.symlink_to(REPO_ROOT / name)
+    return ["--db-path", str(db_path), "--template-cache", str(work_dir / ".template_cache")]
+
+
+def compare(current, baseline_path, tolerance, slack_ms):
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+    regressions = []
+    print(f"{'mode':<10} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, result in current["modes"].items():
+        before = baseline.get("modes", {}).get(name, {}).get("wall_ms")
+        after  = result.get("wall_ms")
+        if not before or after is None:
+            continue
+        print(f"{name:<10} {before:>10.1f} {after:>10.1f} {after / before:>7.2f}")
+        if after > before * (1 + tolerance) + slack_ms:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GraphAudit CLI startup per mode")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per mode (median is reported)")
+    parser.add_argument("--sp-count", type=int, default=200, help="Service principals in the synthetic database")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--work-dir", type=str, default=None, help="Directory for the generated database")
+    parser.add_argument("--output", type=str, default="startup_results.json")
+    parser.add_argument("--compare", type=str, help="Previous results file; exits non-zero on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative wall time increase")
+    parser.add_argument("--slack-ms", type=float, default=50, help="Allowed absolute wall time increase")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="graphaudit_startup_")
+    cli_args = prepare(work_dir, args.sp_count, args.seed)
+    report = dict(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        environment=dict(python=platform.python_version(), platform=platform.platform()),
+        parameters=dict(repeat=args.repeat, sp_count=args.sp_count, seed=args.seed),
+        modes={}
+    )
+    failed = []
+    for name in args.modes:
+        result = run_mode(name, work_dir, cli_args, args.repeat)
+        report["modes"][name] = result
+        if "error" in result:
+            print(f"[-] {name}: {result['error']}")
+            failed.append(name)
+            continue
+        print(
+            f"    {name:<10} wall {result['wall_ms']:>8.1f} ms  import {result['import_ms']:>8.1f} ms  "
+            f"{', '.join(result['heavy_modules'])}"
+        )
+        if result["unexpected"]:
+            print(f"[-] {name} loaded {', '.join(result['unexpected'])}")
+            failed.append(name)
+
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    print(f"[+] Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.tolerance, args.slack_ms)
+        if regressions:
+            print(f"[-] Startup time regressed: {', '.join(regressions)}")
+            failed.extend(regressions)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# Seeded generator for synthetic graph_data.db files. Rows mirror what
+# GraphCrawler stores: camelCase Graph properties with nested values as
+# JSON strings and a service_principal_id column on every sub-resource.
+
+import json
+import uuid
+import random
+import argparse
+import duckdb
+import pandas as pd
+from pathlib import Path
+
+
+GRAPH_APP_ID   = "00000003-0000-0000-c000-000000000000"
+MICROSOFT_TIDS = (
+    "f8cdef31-a31e-4b4a-93e4-5f571e91255a",
+    "72f988bf-86f1-41af-91ab-2d7cd011db47"
+)
+GRAPH_ROLES = (
+    "Application.ReadWrite.All",
+    "AppRoleAssignment.ReadWrite.All",
+    "RoleManagement.ReadWrite.Directory",
+    "Directory.Read.All",
+    "Directory.ReadWrite.All",
+    "User.Read.All",
+    "Group.ReadWrite.All",
+    "Mail.Read",
+    "Sites.Read.All",
+    "Files.ReadWrite.All"
+)
+DIRECTORY_ROLES = (
+    "Global Administrator",
+    "Privileged Role Administrator",
+    "Application Administrator",
+    "Cloud Application Administrator",
+    "Directory Readers"
+)
+TABLES = (
+    'service_principals',
+    'app_role_assignment_edges',
+    'app_roles',
+    'sp_oauth_grants',
+    'sp_member_of',
+    'applications'
+)
+
+
+class SyntheticTenant():
+    def __init__(self, sp_count=1000, seed=1, tenant_id=None):
+        self._rand     = random.Random(seed)
+        self.sp_count  = sp_count
+        self.tenant_id = tenant_id or self._uuid()
+        self.tables    = {name: [] for name in TABLES}
+        self._resources = []
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self._rand.getrandbits(128), version=4))
+
+    def _credentials(self, kind, max_count=2):
+        creds = []
+        for _ in range(self._rand.randint(1, max_count)):
+            cred = {
+                "customKeyIdentifier": None,
+                "displayName": self._rand.choice(["prod", "ci", "backup", None]),
+                "endDateTime": f"{self._rand.randint(2024, 2030)}-01-01T00:00:00Z",
+                "keyId": self._uuid(),
+                "startDateTime": "2023-01-01T00:00:00Z"
+            }
+            if kind == 'password':
+                cred["hint"] = self._uuid()[:3]
+            else:
+                cred["type"] = "AsymmetricX509Cert"
+                cred["usage"] = "Verify"
+            creds.append(cred)
+        return json.dumps(creds)
+
+    def _add_resource(self, sp, role_names):
+        roles = []
+        for value in role_names:
+            role = {
+                "allowedMemberTypes": json.dumps(["Application"]),
+                "description": f"Allows the app to {value}",
+                "displayName": value,
+                "id": self._uuid(),
+                "isEnabled": True,
+                "origin": "Application",
+                "value": value,
+                "service_principal_id": sp["id"]
+            }
+            roles.append(role)
+            self.tables['app_roles'].append(role)
+        sp["appRoles"] = json.dumps([{k: v for k, v in r.items() if k != 'service_principal_id'} for r in roles])
+        self._resources.append((sp, roles))
+
+    def _service_principal(self, idx, app_id, owner, sp_type):
+        rand = self._rand
+        has_pwd = rand.random() < 0.15
+        has_key = rand.random() < 0.10
+        return {
+            "id": self._uuid(),
+            "accountEnabled": rand.random() < 0.95,
+            "appDisplayName": f"app-{idx}",
+            "appId": app_id,
+            "appOwnerOrganizationId": owner,
+            "displayName": f"sp-{idx}",
+            "homepage": f"https://app-{idx}.example.com" if rand.random() < 0.3 else None,
+            "keyCredentials": self._credentials('key') if has_key else "[]",
+            "notificationEmailAddresses": "[]",
+            "passwordCredentials": self._credentials('password') if has_pwd else "[]",
+            "replyUrls": json.dumps([f"https://app-{idx}.example.com/auth"]),
+            "servicePrincipalNames": json.dumps([app_id]),
+            "servicePrincipalType": sp_type,
+            "tags": json.dumps(["WindowsAzureActiveDirectoryIntegratedApp"]),
+            "verifiedPublisher": json.dumps({"displayName": None}),
+            "appRoles": "[]"
+        }
+
+    def _application(self, idx, app_id, sp):
+        rand = self._rand
+        rra = []
+        for sp_res, roles in rand.sample(self._resources, k=min(len(self._resources), rand.randint(0, 3))):
+            access = [
+                {"id": role["id"], "type": "Role"}
+                for role in rand.sample(roles, k=min(len(roles), rand.randint(1, 3)))
+            ]
+            rra.append({"resourceAppId": sp_res["appId"], "resourceAccess": access})
+        return {
+            "id": self._uuid(),
+            "appId": app_id,
+            "createdDateTime": "2022-06-01T00:00:00Z",
+            "description": None,
+            "displayName": f"app-{idx}",
+            "identifierUris": json.dumps([f"api://{app_id}"]) if rand.random() < 0.2 else "[]",
+            "keyCredentials": self._credentials('key') if rand.random() < 0.08 else "[]",
+            "notes": None,
+            "passwordCredentials": self._credentials('password') if rand.random() < 0.25 else "[]",
+            "publisherDomain": "contoso.example.com",
+            "requiredResourceAccess": json.dumps(rra),
+            "signInAudience": rand.choice(["AzureADMyOrg", "AzureADMultipleOrgs"]),
+            "tags": "[]",
+            "web": json.dumps({"homePageUrl": sp["homepage"], "redirectUris": json.loads(sp["replyUrls"])})
+        }
+
+    def _assignment(self, sp, sp_res, role):
+        return {
+            "id": self._uuid(),
+            "appRoleId": role["id"],
+            "createdDateTime": "2023-03-01T00:00:00Z",
+            "principalDisplayName": sp["displayName"],
+            "principalId": sp["id"],
+            "principalType": "ServicePrincipal",
+            "resourceDisplayName": sp_res["displayName"],
+            "resourceId": sp_res["id"]
+        }
+
+    def build(self):
+        rand = self._rand
+        sps = self.tables['service_principals']
+
+        # Resource APIs first so assignments and requiredResourceAccess have targets
+        graph = self._service_principal(0, GRAPH_APP_ID, MICROSOFT_TIDS[0], "Application")
+        graph["displayName"] = "Microsoft Graph"
+        self._add_resource(graph, GRAPH_ROLES)
+        sps.append(graph)
+        for idx in range(1, max(2, self.sp_count // 100)):
+            sp = self._service_principal(idx, self._uuid(), self.tenant_id, "Application")
+            self._add_resource(sp, [f"Api{idx}.Role{n}" for n in range(rand.randint(2, 20))])
+            sps.append(sp)
+
+        for idx in range(len(sps), self.sp_count):
+            roll = rand.random()
+            if roll < 0.15:
+                sp_type = "ManagedIdentity"
+            elif roll < 0.18:
+                sp_type = "Legacy"
+            else:
+                sp_type = "Application"
+            first_party = rand.random() < 0.35
+            third_party = not first_party and rand.random() < 0.10
+            if first_party:
+                owner = rand.choice(MICROSOFT_TIDS)
+            elif third_party:
+                owner = self._uuid()
+            else:
+                owner = self.tenant_id
+
+            app_id = self._uuid()
+            sp = self._service_principal(idx, app_id, owner, sp_type)
+            sps.append(sp)
+            if owner == self.tenant_id and sp_type == "Application":
+                self.tables['applications'].append(self._application(idx, app_id, sp))
+
+        for sp in sps[len(self._resources):]:
+            # Skewed towards Microsoft Graph, like real tenants
+            for _ in range(int(rand.expovariate(1.0))):
+                sp_res, roles = self._resources[0] if rand.random() < 0.6 else rand.choice(self._resources)
+                self.tables['app_role_assignment_edges'].append(self._assignment(sp, sp_res, rand.choice(roles)))
+
+            if rand.random() < 0.20:
+                sp_res, _ = self._resources[0]
+                self.tables['sp_oauth_grants'].append({
+                    "id": self._uuid(),
+                    "clientId": sp["id"],
+                    "consentType": rand.choice(["AllPrincipals", "Principal"]),
+                    "principalId": None,
+                    "resourceId": sp_res["id"],
+                    "scope": " ".join(rand.sample(("openid", "profile", "User.Read", "Mail.Read", "offline_access"), k=2)),
+                    "service_principal_id": sp["id"]
+                })
+
+            if rand.random() < 0.03:
+                role = rand.choice(DIRECTORY_ROLES)
+                self.tables['sp_member_of'].append({
+                    "@odata.type": "#microsoft.graph.directoryRole",
+                    "id": self._uuid(),
+                    "description": f"{role} description",
+                    "displayName": role,
+                    "roleTemplateId": self._uuid(),
+                    "service_principal_id": sp["id"]
+                })
+            elif rand.random() < 0.05:
+                self.tables['sp_member_of'].append({
+                    "@odata.type": "#microsoft.graph.group",
+                    "id": self._uuid(),
+                    "description": None,
+                    "displayName": f"group-{rand.randint(0, 500)}",
+                    "roleTemplateId": None,
+                    "service_principal_id": sp["id"]
+                })
+        return self
+
+    def frames(self):
+        return {name: pd.DataFrame(rows) for name, rows in self.tables.items()}
+
+    def mutate(self, change_rate=0.01):
+        # Next "collection": rotate some credentials, add and remove some SPs
+        rand = self._rand
+        sps  = [dict(sp) for sp in self.tables['service_principals']]
+        changes = max(1, int(len(sps) * change_rate))
+        for sp in rand.sample(sps, k=changes):
+            sp["passwordCredentials"] = self._credentials('password')
+        for sp in rand.sample(sps, k=changes // 2):
+            sps.remove(sp)
+        for idx in range(changes // 2):
+            sps.append(self._service_principal(self.sp_count + idx, self._uuid(), self.tenant_id, "Application"))
+        return pd.DataFrame(sps)
+
+
+def write_database(path, tenant):
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    db = duckdb.connect(str(path))
+    try:
+        for name, df in tenant.frames().items():
+            if df.empty:
+                continue
+            db.execute(f"CREATE TABLE {name} AS SELECT * FROM df")
+    finally:
+        db.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic graph_data.db")
+    parser.add_argument("--sp-count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db-path", type=str, default="synthetic_graph_data.db")
+    args = parser.parse_args()
+
+    tenant = SyntheticTenant(args.sp_count, args.seed).build()
+    write_database(args.db_path, tenant)
+    for name, rows in tenant.tables.items():
+        print(f"[+] {name}: {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
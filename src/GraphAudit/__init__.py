@@ -1,6 +1,40 @@
-from .config import ConfigOptions
-from .detections import Detection, DetectionFactory
-from .graphcrawl import GraphCrawler
-from .graphdata import GraphData
-from .graphdiff import GraphDiff
-from .render import ScreenRender
\ No newline at end of file
+import importlib
+
+# Public classes are imported on first access, so `graphaudit` (which starts
+# from GraphAudit.main) only loads the modules the selected mode needs
+_EXPORTS = {
+    'ResponseArchive':  '.archive',
+    'ConfigOptions':    '.config',
+    'TripwireDaemon':   '.daemon',
+    'Detection':        '.detections',
+    'DetectionFactory': '.detections',
+    'FindingsStore':    '.findings',
+    'FindingsWriter':   '.export',
+    'GraphCrawler':     '.graphcrawl',
+    'GraphData':        '.graphdata',
+    'GraphDiff':        '.graphdiff',
+    'GraphIndex':       '.graphindex',
+    'RenderPlan':       '.render',
+    'ScreenRender':     '.render',
+    'CsvReport':        '.report',
+    'HtmlReport':       '.report',
+    'JsonReport':       '.report',
+    'QueryService':     '.service',
+    'CompiledTemplate': '.templates',
+    'TemplateCompiler': '.templates'
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
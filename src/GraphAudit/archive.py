@@ -0,0 +1,205 @@
+import os
+import json
+import threading
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from .graphdata import GraphData
+from .export import open_ndjson, read_ndjson
+from .log import log_init
+
+# pandas is imported when the archived rows are turned into tables
+
+
+# Table each archived resource is stored in. Service principal pages also
+# fill app_roles from the appRoles of every SP.
+RESOURCE_TABLES = {
+    'applications': 'applications',
+    'service_principals': 'service_principals',
+    'app_role_assigned_to': 'app_role_assignment_edges',
+    'app_role_assignments': 'app_role_assignment_edges',
+    'oauth2_permission_grants': 'sp_oauth_grants',
+    'member_of': 'sp_member_of'
+}
+# Sub-resource rows that carry the id of the SP they were listed under
+OWNED_RESOURCES = ('oauth2_permission_grants', 'member_of')
+# Tables in the order fetch() stores them
+STORE_ORDER = (
+    'applications',
+    'service_principals',
+    'app_role_assignment_edges',
+    'app_roles',
+    'sp_oauth_grants',
+    'sp_member_of'
+)
+SHARD_SUFFIX = {None: ".ndjson", "gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ResponseArchive():
+    # Append-only archive of the Graph pages fetched by one collection, in
+    # <directory>/<UTC start time>/. Every thread that serializes pages
+    # writes its own shard, so writers never share a handle and shards can
+    # be ingested in parallel. One line per page:
+    #
+    #   {"resource": "service_principals", "page": 3, "objects": [...]}
+    #   {"resource": "member_of", "sp_id": ..., "attempt": 0, "page": 0, "objects": [...]}
+    #
+    # Objects are the Graph JSON the table rows are built from. Page numbers
+    # restore the listing order; a retried sub-resource listing is written
+    # again with a higher attempt and replaces the earlier pages.
+    def __init__(self, directory, compression="gzip"):
+        self._logger      = log_init(__name__)
+        self._compression = None if compression == "none" else compression
+        self._path        = Path(directory) / datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._local       = threading.local()
+        self._shards      = []
+        self._lock        = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _shard(self):
+        fp = getattr(self._local, 'fp', None)
+        if fp is None:
+            with self._lock:
+                name = f"pages-{len(self._shards):03d}{SHARD_SUFFIX[self._compression]}"
+                fp = open_ndjson(self._path / name, self._compression)
+                self._shards.append(fp)
+            self._local.fp = fp
+        return fp
+
+    def write(self, record, objects):
+        fp = self._shard()
+        fp.write(json.dumps({**record, "objects": objects}, separators=(',', ':'), default=str))
+        fp.write("\n")
+
+    def close(self):
+        with self._lock:
+            for fp in self._shards:
+                fp.close()
+            if self._shards:
+                self._logger.info(f"[+] Archived Graph responses to {self._path} ({len(self._shards)} files)")
+            self._shards = []
+
+
+def _shard_files(path):
+    return sorted(p for p in path.iterdir() if p.is_file() and p.name.startswith("pages-"))
+
+
+def archive_run(path):
+    # An archived collection: the given run directory, or the latest run
+    # in an archive directory
+    path = Path(path)
+    if not path.is_dir():
+        raise ArchiveError(f"No such archive directory: {path}")
+    if _shard_files(path):
+        return path
+    runs = sorted(p for p in path.iterdir() if p.is_dir() and _shard_files(p))
+    if not runs:
+        raise ArchiveError(f"No archived Graph responses in {path}")
+    return runs[-1]
+
+
+def _rows(objects, sp_id=None):
+    rows = []
+    for obj in objects:
+        row = GraphData.json_row(obj)
+        if sp_id is not None:
+            row['service_principal_id'] = sp_id
+        rows.append(row)
+    return rows
+
+
+def _read_shard(path):
+    # Runs in a worker process: the rows of every page of one shard.
+    # Collection pages are returned as (resource, page, rows, app roles);
+    # sub-resource listings keep only the pages of their latest attempt.
+    pages    = []
+    listings = {}
+    for record in read_ndjson(path):
+        resource = record['resource']
+        objects  = record['objects']
+        if 'sp_id' not in record:
+            roles = []
+            if resource == 'service_principals':
+                for sp in objects:
+                    roles.extend(_rows(sp.get('appRoles') or [], sp.get('id')))
+            pages.append((resource, record['page'], _rows(objects), roles))
+            continue
+
+        owner = record['sp_id'] if resource in OWNED_RESOURCES else None
+        key = (resource, record['sp_id'])
+        attempt, listing = listings.get(key, (-1, []))
+        if record['attempt'] > attempt:
+            attempt, listing = record['attempt'], []
+        if record['attempt'] == attempt:
+            listing.append((record['page'], _rows(objects, owner)))
+        listings[key] = (attempt, listing)
+    return pages, listings
+
+
+def _tables(shards):
+    # Merges the shards into the rows fetch() would have collected, in the
+    # same order: collections by page, sub-resources by the position of
+    # their SP in the service principal listing
+    collections = []
+    listings    = {}
+    for pages, shard_listings in shards:
+        collections.extend(pages)
+        for key, (attempt, listing) in shard_listings.items():
+            current = listings.get(key)
+            if current is None or attempt > current[0]:
+                listings[key] = (attempt, list(listing))
+            elif attempt == current[0]:
+                current[1].extend(listing)
+
+    tables = {table: [] for table in STORE_ORDER}
+    for resource, _, rows, roles in sorted(collections, key=lambda page: (page[0], page[1])):
+        tables[RESOURCE_TABLES[resource]].extend(rows)
+        tables['app_roles'].extend(roles)
+
+    position = {row.get('id'): i for i, row in enumerate(tables['service_principals'])}
+    order = sorted(listings, key=lambda key: (position.get(key[1], len(position)), key[1], key[0]))
+    for key in order:
+        for _, rows in sorted(listings[key][1], key=lambda page: page[0]):
+            tables[RESOURCE_TABLES[key[0]]].extend(rows)
+    return tables
+
+
+def ingest_archive(graph_data, path, workers=None):
+    # Rebuilds every table from an archived collection without network
+    # access. Shards are parsed in separate processes.
+    import pandas as pd
+
+    logger = log_init(__name__)
+    run    = archive_run(path)
+    files  = _shard_files(run)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(files)))
+    logger.info(f"[*] Ingesting {len(files)} archive files from {run} with {workers} workers")
+
+    if workers == 1:
+        shards = [_read_shard(file) for file in files]
+    else:
+        # spawn: the parent process runs DuckDB and logging threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            shards = list(pool.map(_read_shard, files))
+
+    with graph_data.staging():
+        for table, rows in _tables(shards).items():
+            if rows:
+                graph_data.store_table(table, pd.DataFrame(rows))
+                logger.info(f"[+] Stored {len(rows)} records in {table}")
@@ -0,0 +1,203 @@
+import json
+import time
+import asyncio
+import pandas as pd
+from datetime import datetime, timezone
+from .findings import FindingsStore
+from .log import log_init
+
+
+# Sub-resource tables re-fetched for changed service principals, in the
+# order GraphCrawler.fetch_sp_subresources returns them, and the columns
+# holding the SP each row belongs to
+SUBRESOURCE_TABLES = (
+    ('app_role_assignment_edges', ('principalId', 'resourceId')),
+    ('sp_oauth_grants', 'service_principal_id'),
+    ('sp_member_of', 'service_principal_id')
+)
+
+
+class TripwireDaemon():
+    # Long-running diff mode. One authenticated crawler, HTTP pool and warm
+    # in-memory database are kept for the whole run. Each poll fetches only
+    # the applications and service principals changed since the last poll
+    # (Graph delta queries), re-fetches the assignments of changed SPs, diffs
+    # the change set with GraphDiff, re-evaluates detections incrementally and
+    # writes every change and finding as a JSON event.
+    def __init__(self, graph_data, graph_diff, writer, detections=(), interval=300):
+        self._logger     = log_init(__name__)
+        self._graph_data = graph_data
+        self._graph_diff = graph_diff
+        self._writer     = writer
+        self._detections = list(detections)
+        self._interval   = interval
+        self._store      = FindingsStore(graph_data) if self._detections else None
+        self._delta_links = self._load_delta_links()
+        # Events of the running poll, written once it is published
+        self._pending    = []
+
+    def _load_delta_links(self):
+        self._graph_data.ensure_state_tables()
+        rows = self._graph_data.query("SELECT resource, delta_link FROM delta_links", output_format='list')
+        return {resource: link for resource, link in rows or []}
+
+    def _save_delta_links(self, links):
+        db = self._graph_data.db
+        db.execute("DELETE FROM delta_links")
+        db.executemany(
+            "INSERT INTO delta_links VALUES (?, ?)",
+            [[resource, link] for resource, link in links.items()]
+        )
+        self._graph_data._persist_to_disk('delta_links')
+
+    async def run(self, crawler, polls=None):
+        count = 0
+        while polls is None or count < polls:
+            started = time.monotonic()
+            try:
+                events = await self.poll(crawler)
+                self._logger.info(f"[+] Poll {count + 1}: {events} events")
+            except Exception as e:
+                self._logger.error(f"[-] Poll failed: {str(e)}")
+            count += 1
+            if polls is not None and count >= polls:
+                break
+            await asyncio.sleep(max(0, self._interval - (time.monotonic() - started)))
+
+    async def poll(self, crawler):
+        # Each poll is published to the database file as a whole. Delta
+        # links and alerts only move forward once it is: a failed poll is
+        # rolled back, its events are dropped and the next one fetches the
+        # same changes again.
+        links = dict(self._delta_links)
+        self._pending = []
+        try:
+            with self._graph_data.staging():
+                events = await self._poll(crawler, links)
+            for record in self._pending:
+                self._writer.write_record(record)
+            self._writer.flush()
+        finally:
+            self._pending = []
+        self._delta_links = links
+        return events
+
+    async def _poll(self, crawler, links):
+        self._graph_data.reset_snapshot()
+        self._graph_diff.reset()
+        events = 0
+
+        changed_sps = []
+        removed_sps = []
+        for resource in ('applications', 'service_principals'):
+            link = links.get(resource)
+            objects, links[resource] = await crawler.fetch_delta(resource, link)
+            changed, removed = self._split(objects)
+            if link is None:
+                # First poll enumerates every object; anything stored that was
+                # not returned no longer exists
+                removed = self._missing(resource, changed)
+            if changed or removed:
+                self._graph_data.upsert_table(resource, pd.DataFrame(changed), removed)
+            if resource == 'service_principals':
+                changed_sps = [obj['id'] for obj in changed]
+                removed_sps = removed
+                self._update_app_roles(changed, removed)
+
+        if changed_sps or removed_sps:
+            frames = await crawler.fetch_sp_subresources(changed_sps)
+            for (table, columns), df in zip(SUBRESOURCE_TABLES, frames):
+                self._graph_data.replace_rows(
+                    table, df, columns, changed_sps + removed_sps
+                )
+
+        self._save_delta_links(links)
+        events += self._emit_changes()
+        events += self._evaluate_detections()
+        return events
+
+    def _split(self, objects):
+        # Delta pages can repeat an object; the last occurrence wins
+        latest = {}
+        for obj in objects:
+            if obj.get('id'):
+                latest[obj['id']] = obj
+        changed = [obj for obj in latest.values() if '@removed' not in obj]
+        removed = [obj['id'] for obj in latest.values() if '@removed' in obj]
+        for obj in changed:
+            obj.pop('@odata.type', None)
+        return changed, removed
+
+    def _missing(self, resource, changed):
+        if resource not in self._graph_data.tables:
+            return []
+        current = {obj['id'] for obj in changed}
+        rows = self._graph_data.query(f"SELECT id FROM {resource}", output_format='list') or []
+        return [row[0] for row in rows if row[0] not in current]
+
+    def _update_app_roles(self, changed, removed):
+        # Only SPs whose delta object carried appRoles are replaced
+        changed = [sp for sp in changed if sp.get('appRoles') is not None]
+        roles = []
+        for sp in changed:
+            try:
+                sp_roles = json.loads(sp.get('appRoles') or '[]')
+            except (TypeError, ValueError):
+                sp_roles = []
+            for role in sp_roles:
+                role = {key: self._graph_data._convert_to_json_string(value) for key, value in role.items()}
+                role['service_principal_id'] = sp['id']
+                roles.append(role)
+        self._graph_data.replace_rows(
+            'app_roles',
+            pd.DataFrame(roles),
+            'service_principal_id',
+            [sp['id'] for sp in changed] + list(removed)
+        )
+
+    def _event(self, event, **fields):
+        record = {
+            "event": event,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "snapshot": self._graph_data.latest_snapshot()
+        }
+        record.update(fields)
+        self._pending.append(record)
+
+    def _emit_changes(self):
+        events = 0
+        for table in self._graph_diff.tables:
+            try:
+                results = self._graph_diff.results(table)
+            except KeyError:
+                continue
+            keys = self._graph_diff.key_columns(table)
+            for change, df in results.items():
+                for row in df.to_dict('records'):
+                    changed_fields = row.get('changed_fields')
+                    self._event(
+                        "change",
+                        table=table,
+                        change=change,
+                        key={key: row[key] for key in keys},
+                        label=row.get('label'),
+                        changed_fields=[] if changed_fields is None else list(changed_fields)
+                    )
+                    events += 1
+        return events
+
+    def _evaluate_detections(self):
+        events = 0
+        for detection in self._detections:
+            try:
+                new, resolved, _ = self._store.evaluate(detection)
+            except Exception as e:
+                self._logger.error(f"[-] Detection '{detection.name}' failed: {str(e)}")
+                continue
+            for sp in self._graph_data.iter_sp_summary(tuple(new)):
+                self._event("finding", detection=detection.name, service_principal=sp)
+                events += 1
+            for sp_id in sorted(resolved):
+                self._event("resolved", detection=detection.name, service_principal_id=sp_id)
+                events += 1
+        return events
@@ -1,82 +1,364 @@
-from .render import ScreenRender
-from pathlib import Path
+from .render import ScreenRender, SUMMARY_COLUMNS, TENANT_COLUMN, merge_projections
+from .templates import TemplateCompiler
+from .findings import FindingsStore
+from .export import FindingsWriter
+from .profiler import profile_phase, profile_detection
+from concurrent.futures import ThreadPoolExecutor
 from .log import log_init
-import yaml
+
+
+def _has_key(keys, key):
+    # Findings of templates without a tenant column carry no tenant and
+    # match the SP in every tenant
+    return key in keys or (None, key[1]) in keys
+
 
 class DetectionFactory():
     def __init__(
         self, 
         graph_data, 
         template_path='detections',
-        output_path=None):
+        output_path=None,
+        template_cache='.template_cache',
+        output_compression=None,
+        report=None,
+        summary=False,
+        detail_ids=None,
+        pager=False):
         
         self._logger     = log_init(__name__)
+        self._graph_data = graph_data
         self._detections = []
-        self._templates  = self._load_templates(template_path)
+        self._writer     = FindingsWriter(output_path, output_compression) if output_path else None
+        # One console for every detection; output is printed in order anyway.
+        # Reports never print through Rich, so they do not create one
+        self._console    = None if report else self._rich_console()
+        # Optional non-Rich report (json/csv/html), see report.py
+        self._report     = report
+        # Summary mode prints one row per finding and defers enrichment to
+        # the SPs whose detail is requested (detail_ids, or all via pager).
+        # Reports always carry the full objects.
+        self._summary    = (summary or bool(detail_ids) or pager) and not report
+        compiler         = TemplateCompiler(graph_data, cache_path=template_cache)
+        self._templates  = compiler.load(template_path)
         for template in self._templates:
-            detection = Detection(template, graph_data, output_path)
+            detection = Detection(template, graph_data, self._writer, self._console, report)
+            if self._summary:
+                detection.set_summary(detail_ids, pager)
             self._detections.append(detection)
 
     def __iter__(self):
         return iter(self._detections)
 
-    def _load_templates(self, template_path):
-        path = Path(template_path)
-        templates = []
-    
-        if path.is_file():
-            if path.suffix.lower() in (".yaml", ".yml"):
-                with open(path, "r") as fp:
-                    self._logger.info(f"Loading detection: {path}")
-                    templates.append(yaml.safe_load(fp))
-            else:
-                self._logger.warning(f"File {path} is not a YAML file, skipping")
-        elif path.is_dir():
-            files = path.iterdir()
-            for file in files:
-                if file.suffix.lower() in (".yaml", ".yml"):
-                    with open(file, "r") as fp:
-                        self._logger.info(f"Loading detection: {file}")
-                        templates.append(yaml.safe_load(fp))
-    
-        else:
-            self._logger.error(f"Path {path} does not exist or is not a file/directory")
-        return templates
+    @staticmethod
+    def _rich_console():
+        from rich.console import Console
+        return Console()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+        if self._report:
+            self._report.close()
+
+    def run(self, workers=4):
+        # Detections run concurrently; each worker thread queries GraphData
+        # through its own cursor. Output is still printed in template order,
+        # each detection as soon as it and every detection before it are done.
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(detection.run) for detection in self._detections
+            ]
+            for detection, future in zip(self._detections, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    self._logger.error(f"[-] Detection '{detection.name}' failed: {str(e)}")
+                    continue
+                detection.print()
+
+    def run_fused(self):
+        # All template queries are evaluated in a single labelled statement,
+        # then the union of matched SPs is enriched once and handed back to
+        # each detection. SPs are keyed by (tenant, sp_id).
+        profiler = self._graph_data.profiler
+        with profile_phase(profiler, 'query'):
+            id_map = self._fused_query()
+        if id_map is None:
+            self._logger.warning("[-] Fused query failed, running detections individually")
+            return self.run(workers=1)
+
+        id_set = set()
+        for ids in id_map.values():
+            id_set.update(ids)
 
+        results = {idx: [] for idx in id_map}
+        if id_set and not self._summary:
+            projection = merge_projections(
+                detection.projection for detection in self._detections
+            )
+            with profile_phase(profiler, 'enrichment'):
+                for sp in self._graph_data.iter_sp_by_id(tuple(id_set), projection=projection):
+                    key = self._graph_data.sp_key(sp)
+                    for idx, ids in id_map.items():
+                        if _has_key(ids, key):
+                            results[idx].append(sp)
+
+        for idx, detection in enumerate(self._detections):
+            if profiler:
+                detection.profile_query(len(id_map[idx]))
+            detection.set_matched(id_map[idx])
+            detection.set_results(results.get(idx, []))
+            detection.print()
+
+    def run_incremental(self):
+        # Only SPs changed since each detection was last evaluated are
+        # re-checked. New and resolved findings are reported separately.
+        store = FindingsStore(self._graph_data)
+        tenant = self._graph_data.tenant
+        for detection in self._detections:
+            try:
+                new, resolved, unchanged = store.evaluate(detection)
+            except Exception as e:
+                self._logger.error(f"[-] Detection '{detection.name}' failed: {str(e)}")
+                continue
+
+            # Findings are stored by sp_id; the store only takes a single
+            # database, whose tenant every finding shares
+            new = {(tenant, sp_id) for sp_id in new}
+            detection.set_matched(new)
+            if not self._summary:
+                with profile_detection(detection.profiler, detection.name), \
+                        profile_phase(detection.profiler, 'enrichment'):
+                    detection.set_results(
+                        self._graph_data.get_sp_by_id(tuple(new), detection.projection) if new else []
+                    )
+            detection.print()
+            detection.print_resolved(resolved, len(unchanged))
+
+    def _fused_query(self):
+        if not self._detections:
+            return {}
+
+        ctes = []
+        selects = []
+        for idx, detection in enumerate(self._detections):
+            # CTE column aliasing labels the first column of every query as
+            # sp_id, whatever the template called it
+            query = detection.query.strip().rstrip(';')
+            ctes.append(f"d{idx}(sp_id) AS (\n{query}\n)")
+            selects.append(
+                f"SELECT {idx} AS detection_idx, sp_id, {detection.tenant_select} AS tenant FROM d{idx}"
+            )
+        sql = "WITH " + ",\n".join(ctes) + "\n" + "\nUNION ALL\n".join(selects)
+
+        id_map = {idx: set() for idx in range(len(self._detections))}
+        try:
+            for rows in self._graph_data.query_stream(sql, output_format='list', tenant_views=True):
+                for idx, sp_id, tenant in rows:
+                    id_map[idx].add((tenant, sp_id))
+        except Exception as e:
+            self._logger.error(f"[-] Fused detection query error: {str(e)}")
+            return None
+        return id_map
 
 class Detection(ScreenRender):
-    def __init__(self, template, graph_data, output_path):
-        super().__init__() 
+    def __init__(self, template, graph_data, writer=None, console=None, report=None):
+        super().__init__(template.output, template.render_plan, console)
         self._logger = log_init(__name__)
         
         self._results_list = []
+        # (tenant, sp_id) of every matched SP
+        self._matched = set()
+        self._tenant_column = None
+        self._summary = False
+        self._detail_ids = set()
+        self._pager = False
         
         self._graph_data  = graph_data
-        self._output_path = output_path
+        self._writer      = writer
+        self._report      = report
+
+        self._name  = template.name
+        self._query = template.query
+        self._output_template = template.output
+        self._description = template.description
+        self._source = template.source
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def query(self):
+        return self._query
+
+    @property
+    def description(self):
+        return self._description
 
-        self._name  = template['name']
-        self._query = template['query']
-        self._output_template = template['output']
-        self._description = template['description']
+    @property
+    def render_plan(self):
+        return self._render_plan
+
+    @property
+    def tenant_select(self):
+        # SQL for the tenant of each matched SP: the query's tenant column,
+        # or for templates that only return sp_id the tenant of a single
+        # database (NULL when federated)
+        if self._tenant_column is None:
+            try:
+                columns = self._graph_data.query_columns(self._query.strip().rstrip(';'))
+            except Exception:
+                columns = []
+            self._tenant_column = 'tenant' in columns[1:]
+        if self._tenant_column:
+            return "tenant"
+        tenant = self._graph_data.tenant
+        return "NULL" if tenant is None else "'" + tenant.replace("'", "''") + "'"
+
+    @property
+    def projection(self):
+        # Enrichment fetches only what the data views render; findings written
+        # to --output-file carry the full objects
+        return None if self._writer else self._render_plan.projection
+
+    def set_results(self, results):
+        self._results_list = results
+
+    def set_matched(self, id_set):
+        self._matched = set(id_set)
+
+    def set_summary(self, detail_ids=None, pager=False):
+        self._summary = True
+        self._detail_ids = {sp_id.lower() for sp_id in detail_ids or []}
+        self._pager = pager
       
+    @property
+    def profiler(self):
+        return self._graph_data.profiler
+
+    def evaluate_ids(self, sp_filter=None):
+        # (tenant, sp_id) of every matched SP
+        query = self._query.strip().rstrip(';')
+        query = f"WITH d(sp_id) AS (\n{query}\n) SELECT {self.tenant_select}, sp_id FROM d"
+        if sp_filter:
+            # Restrict evaluation to the SPs returned by the sp_filter subquery
+            query += f" WHERE sp_id IN ({sp_filter})"
+
+        id_set = set()
+        with profile_detection(self.profiler, self._name), profile_phase(self.profiler, 'query'):
+            for rows in self._graph_data.query_stream(
+                query, 
+                output_format='list',
+                tenant_views=True
+            ):
+                id_set.update(rows)
+        return id_set
+
     def run(self):
-        results = self._graph_data.query(
-            self._query, 
-            output_format='list'
-        )
-        if results:
-            id_list = tuple({entry[0] for entry in results})
+        id_set = self.evaluate_ids()
+        self._matched = id_set
+        if id_set and not self._summary:
             # Look up service principal objects
-            results = self._graph_data.get_sp_by_id(id_list)
+            with profile_detection(self.profiler, self._name), profile_phase(self.profiler, 'enrichment'):
+                results = self._graph_data.get_sp_by_id(tuple(id_set), self.projection)
             if results:
                 self._results_list = results
+        if self.profiler:
+            self.profile_query(len(id_set))
+
+    def profile_query(self, matched):
+        self.profiler.set(self._name, 'matched', matched)
+        self.profiler.set(self._name, 'source', self._source)
+        try:
+            plan = self._graph_data.explain(self._query.strip().rstrip(';'), analyze=True)
+        except Exception as e:
+            plan = f"EXPLAIN ANALYZE failed: {str(e)}"
+        self.profiler.set(self._name, 'explain_analyze', plan)
         
+    def print_resolved(self, resolved, unchanged=0):
+        if not resolved and not unchanged:
+            return
+        rows = []
+        if resolved:
+            id_list = ",".join(f"'{sp_id}'" for sp_id in resolved)
+            names = {
+                row[0]: row[1] for row in self._graph_data.query(
+                    f"SELECT id, displayName FROM service_principals WHERE id IN ({id_list})",
+                    output_format='list'
+                ) or []
+            }
+            rows = [(sp_id, names.get(sp_id)) for sp_id in sorted(resolved)]
+        if self._report:
+            self._report.write_resolved(self._name, rows)
+            return
+        self._render_resolved(self._name, rows, unchanged)
+
     def print(self):
+        with profile_detection(self.profiler, self._name), profile_phase(self.profiler, 'render'):
+            self._print()
+
+    def _print(self):
+        if self._summary:
+            self._print_summary()
+            return
         if self._results_list:
-            self._render_header(self._name, self._description)
+            if self._report:
+                self._report.start_detection(self._name, self._description)
+            else:
+                self._render_header(self._name, self._description)
             for sp in self._results_list:
-                if self._output_path:
-                    self._write_manifest(sp, self._output_path)
-                self._render_results(sp, self._output_template)
-       
-        
\ No newline at end of file
+                if self._writer:
+                    self._writer.write(self._name, sp)
+                if self._report:
+                    self._report.write(self._name, sp, self._render_plan)
+                else:
+                    self._render_results(sp)
+            if self._report:
+                self._report.end_detection(self._name)
+
+    def _print_summary(self):
+        if not self._matched:
+            return
+        columns = SUMMARY_COLUMNS
+        if self._graph_data.federated:
+            columns = SUMMARY_COLUMNS[:1] + [TENANT_COLUMN] + SUMMARY_COLUMNS[1:]
+        self._render_summary(
+            self._name,
+            self._description,
+            len(self._matched),
+            self._graph_data.iter_sp_summary(tuple(self._matched)),
+            columns
+        )
+
+        if self._pager:
+            detail_ids = self._matched
+        else:
+            detail_ids = {key for key in self._matched if key[1].lower() in self._detail_ids}
+        # The findings file still needs every enriched object
+        targets = self._matched if self._writer else detail_ids
+        if not targets:
+            return
+
+        details = []
+        with profile_phase(self.profiler, 'enrichment'):
+            for sp in self._graph_data.iter_sp_by_id(tuple(targets), projection=self.projection):
+                if self._writer:
+                    self._writer.write(self._name, sp)
+                if _has_key(detail_ids, self._graph_data.sp_key(sp)):
+                    details.append(sp)
+
+        if self._pager:
+            with self.console.pager(styles=True):
+                for sp in details:
+                    self._render_results(sp)
+        else:
+            for sp in details:
+                self._render_results(sp)
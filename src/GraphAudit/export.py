@@ -0,0 +1,112 @@
+import io
+import gzip
+import json
+from datetime import datetime, timezone
+from .log import log_init
+
+
+class ExportError(Exception):
+    pass
+
+
+def compression_from_suffix(path):
+    path = str(path).lower()
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def open_ndjson(path, compression=None, buffer_size=1024 * 1024):
+    # Text handle appending to a plain, gzip or zstd file. Compressed files
+    # grow by one gzip member / zstd frame per handle, which both readers
+    # decode as a single stream.
+    try:
+        if compression in (None, "none"):
+            return open(path, 'a', buffering=buffer_size, encoding='utf-8')
+
+        if compression == "gzip":
+            raw = gzip.open(path, 'ab', compresslevel=6)
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError as e:
+                raise ExportError("zstd compression requires the zstandard package") from e
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, 'ab'))
+        else:
+            raise ExportError(f"Unsupported compression: {compression}")
+
+        buffered = io.BufferedWriter(raw, buffer_size=buffer_size)
+        return io.TextIOWrapper(buffered, encoding='utf-8')
+    except ExportError:
+        raise
+    except Exception as e:
+        raise ExportError(f"Could not open output file {path}: {str(e)}") from e
+
+
+def read_ndjson(path):
+    # Records of a file written through open_ndjson
+    compression = compression_from_suffix(path)
+    if compression == "gzip":
+        fp = gzip.open(path, 'rt', encoding='utf-8')
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ExportError("zstd compression requires the zstandard package") from e
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        fp = io.TextIOWrapper(reader, encoding='utf-8')
+    else:
+        fp = open(path, 'r', encoding='utf-8')
+    with fp:
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+class FindingsWriter():
+    # One buffered handle for the whole run. Each finding is written as a
+    # single compact JSON line so the file can be streamed by SIEM ingestion.
+    def __init__(self, output_path, compression=None, buffer_size=1024 * 1024):
+        self._logger      = log_init(__name__)
+        self._output_path = output_path
+        self._compression = compression or compression_from_suffix(output_path)
+        self._buffer_size = buffer_size
+        self._count       = 0
+        self._fp          = self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def count(self):
+        return self._count
+
+    def _open(self):
+        return open_ndjson(self._output_path, self._compression, self._buffer_size)
+
+    def write(self, detection, obj):
+        self.write_record({
+            "detection": detection,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "service_principal": obj
+        })
+
+    def write_record(self, record):
+        self._fp.write(json.dumps(record, separators=(',', ':'), default=str))
+        self._fp.write("\n")
+        self._count += 1
+
+    def flush(self):
+        if self._fp:
+            self._fp.flush()
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+            self._logger.info(f"[+] Wrote {self._count} findings to {self._output_path}")
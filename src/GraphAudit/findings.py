@@ -0,0 +1,151 @@
+import re
+import hashlib
+from .graphdata import TABLES, SP_KEY_COLUMNS, ASSIGNMENT_TABLE, ASSIGNMENT_VIEWS
+from .log import log_init
+
+
+class FindingsError(Exception):
+    pass
+
+
+class FindingsStore():
+    # Findings of one writable database, kept by sp_id. Federated tenant
+    # databases are attached read-only and their SP ids may repeat, so they
+    # have no findings store.
+    def __init__(self, graph_data, persist=True):
+        if graph_data.federated:
+            raise FindingsError("Incremental evaluation needs a single database, not federated tenants")
+        self._logger     = log_init(__name__)
+        self._graph_data = graph_data
+        self._persist    = persist
+        self._graph_data.ensure_state_tables()
+
+    def tables_read(self, query):
+        tables = [
+            table for table in TABLES
+            if re.search(rf'\b{table}\b', query, re.IGNORECASE)
+        ]
+        # Changes are recorded against the table behind the assignment views
+        if ASSIGNMENT_TABLE not in tables and any(
+            re.search(rf'\b{view}\b', query, re.IGNORECASE) for view in ASSIGNMENT_VIEWS
+        ):
+            tables.append(ASSIGNMENT_TABLE)
+        return tables
+
+    def needs_full_evaluation(self, query):
+        # The result for one SP can depend on rows of SPs that did not change:
+        # graph_* functions walk the whole graph, and tables without an SP key
+        # record no changes in sp_changes
+        if re.search(r'\bgraph_\w+\s*\(', query, re.IGNORECASE):
+            return True
+        ctes = {
+            name.lower() for name in
+            re.findall(r'\b(\w+)\s*(?:\([^()]*\))?\s+AS\s*(?:NOT\s+)?(?:MATERIALIZED\s*)?\(', query, re.IGNORECASE)
+        }
+        keyed = set(SP_KEY_COLUMNS) | set(ASSIGNMENT_VIEWS) | ctes
+        for name in re.findall(r'\b(?:FROM|JOIN)\s+([\w."]+)', query, re.IGNORECASE):
+            if name.strip('"').split('.')[-1].strip('"').lower() not in keyed:
+                return True
+        return False
+
+    def _query_hash(self, query):
+        return hashlib.sha1(query.strip().encode()).hexdigest()
+
+    def _state(self, name):
+        rows = self._graph_data.query(
+            "SELECT query_hash, snapshot FROM detection_state "
+            f"WHERE detection = '{self._escape(name)}'",
+            output_format='list'
+        )
+        return rows[0] if rows else None
+
+    def _escape(self, value):
+        return str(value).replace("'", "''")
+
+    def open_findings(self, name):
+        rows = self._graph_data.query(
+            "SELECT sp_id FROM findings "
+            f"WHERE detection = '{self._escape(name)}' AND resolved_snapshot IS NULL",
+            output_format='list'
+        )
+        return {row[0] for row in rows or []}
+
+    def changed_sp_filter(self, query, since_snapshot):
+        # Subquery returning every SP touched since the given snapshot in any
+        # table the detection reads
+        tables = self.tables_read(query)
+        if not tables:
+            return None
+        table_list = ",".join(f"'{table}'" for table in tables)
+        return (
+            "SELECT DISTINCT sp_id FROM sp_changes "
+            f"WHERE snapshot > {int(since_snapshot)} AND table_name IN ({table_list})"
+        )
+
+    def evaluate(self, detection, snapshot=None):
+        # Returns (new_ids, resolved_ids, unchanged_open_ids). Falls back to a
+        # full evaluation when the detection was never run, its query changed,
+        # or it reads data that is not tracked per SP.
+        snapshot   = snapshot or self._graph_data.latest_snapshot() or 0
+        query_hash = self._query_hash(detection.query)
+        state      = self._state(detection.name)
+        previous   = self.open_findings(detection.name)
+
+        if state and state[0] == query_hash:
+            if state[1] >= snapshot:
+                self._logger.info(f"[*] {detection.name}: no new snapshot since last evaluation")
+                return set(), set(), previous
+            incremental = not self.needs_full_evaluation(detection.query)
+        else:
+            incremental = False
+
+        if incremental:
+            sp_filter = self.changed_sp_filter(detection.query, state[1])
+            if sp_filter is None:
+                # Reads none of the collected tables, nothing can have changed
+                return set(), set(), previous
+
+            candidates = {
+                row[0] for row in self._graph_data.query(sp_filter, output_format='list') or []
+            }
+            matched  = self._ids(detection.evaluate_ids(sp_filter)) if candidates else set()
+            resolved = (previous & candidates) - matched
+            self._logger.info(
+                f"[*] {detection.name}: incremental evaluation over {len(candidates)} changed SPs"
+            )
+        else:
+            matched  = self._ids(detection.evaluate_ids())
+            resolved = previous - matched
+            self._logger.info(f"[*] {detection.name}: full evaluation")
+
+        new = matched - previous
+        self._record(detection.name, query_hash, snapshot, new, resolved)
+        return new, resolved, previous - resolved - new
+
+    @staticmethod
+    def _ids(keys):
+        # (tenant, sp_id) keys of a single database all share its tenant
+        return {sp_id for _, sp_id in keys}
+
+    def _record(self, name, query_hash, snapshot, new, resolved):
+        db = self._graph_data.db
+        if new:
+            db.executemany(
+                "INSERT INTO findings VALUES (?, ?, ?, NULL)",
+                [[name, sp_id, snapshot] for sp_id in new]
+            )
+        if resolved:
+            db.execute(
+                f"UPDATE findings SET resolved_snapshot = {int(snapshot)} "
+                f"WHERE detection = ? AND resolved_snapshot IS NULL "
+                f"AND sp_id IN (SELECT unnest(?))",
+                [name, list(resolved)]
+            )
+        db.execute("DELETE FROM detection_state WHERE detection = ?", [name])
+        db.execute(
+            "INSERT INTO detection_state VALUES (?, ?, ?)",
+            [name, query_hash, snapshot]
+        )
+        if self._persist:
+            self._graph_data._persist_to_disk('findings')
+            self._graph_data._persist_to_disk('detection_state')
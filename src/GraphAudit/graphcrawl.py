@@ -1,5 +1,6 @@
 import os
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from .graphdata import GraphData
 from msgraph import GraphServiceClient
 from azure.identity import InteractiveBrowserCredential, TokenCachePersistenceOptions, AuthenticationRecord
@@ -22,16 +23,59 @@ import httpx
 CLIENT_ID = "04b07795-8ddb-461a-bbee-02f9e1bf7b46"
 # Default scope for Microsoft Graph
 SCOPES = ["https://graph.microsoft.com/.default"]
+# Pages with fewer objects are converted on the event loop
+POOL_MIN_PAGE = 50
+# displayName range filters need Graph's advanced query support
+ADVANCED_QUERY_HEADERS = {"ConsistencyLevel": "eventual"}
+PARTITION_CHARS = "abcdefghijklmnopqrstuvwxyz"
+# Assignment rows reference both of their service principals and are stored
+# without the service_principal_id of the SP they were listed under
+ASSIGNMENT_RESOURCES = ('app_role_assigned_to', 'app_role_assignments')
+# Properties requested by delta queries (tripwire daemon)
+DELTA_SELECT = {
+    'service_principals': [
+        'id', 'appId', 'displayName', 'servicePrincipalType', 'accountEnabled',
+        'appOwnerOrganizationId', 'passwordCredentials', 'keyCredentials',
+        'servicePrincipalNames', 'appRoles'
+    ],
+    'applications': [
+        'id', 'appId', 'displayName', 'passwordCredentials', 'keyCredentials',
+        'requiredResourceAccess'
+    ]
+}
+
+
+def partition_filters(count):
+    # $filter expressions splitting a collection into `count` displayName
+    # ranges plus objects without a displayName. Consecutive ranges share
+    # their bound ([..b], [b..f], [f..]), so together they cover every name
+    # whatever collation Graph applies.
+    count  = max(1, min(count, len(PARTITION_CHARS)))
+    step   = len(PARTITION_CHARS) / count
+    bounds = [PARTITION_CHARS[round(i * step)] for i in range(1, count)]
+    filters = ["displayName eq null"]
+    lower = None
+    for upper in bounds + [None]:
+        parts = []
+        if lower:
+            parts.append(f"displayName ge '{lower}'")
+        if upper:
+            parts.append(f"displayName le '{upper}'")
+        filters.append(" and ".join(parts) or "displayName ne null")
+        lower = upper
+    return filters
 
 
 class GraphException(Exception):
     def __init__(self, message, *args, **kwargs):
         logger = logging.getLogger(__name__)
-        logger.error("%s", message, exc_info=True)
+        # Logged at the raise site; the traceback is rendered by the log
+        # listener thread, and repeated failures are rate-limited
+        logger.error("%s", message, exc_info=True, stacklevel=2)
         super().__init__(message, *args, **kwargs)
 
 class GraphCrawler:
-    def __init__(self, graph_data, debug = 0, batch_size = 250, use_cache = False):
+    def __init__(self, graph_data, debug = 0, batch_size = 250, use_cache = False, workers = None, partitions = 1, archive = None):
         
         self._logger       = log_init(__name__)
         self._graph_data   = graph_data
@@ -40,6 +84,17 @@ class GraphCrawler:
         self._graph_client = None
         self._semaphore    = asyncio.Semaphore(5)
         self._use_cache    = use_cache
+        # Pages are converted from kiota models to rows on a worker pool so
+        # the event loop only does network I/O. At most two pages per worker
+        # are queued; further pages wait, which holds back the fetchers.
+        self._workers      = workers or min(4, os.cpu_count() or 1)
+        self._executor     = ThreadPoolExecutor(self._workers, thread_name_prefix='graphcrawl')
+        self._convert_slots = asyncio.Semaphore(self._workers * 2)
+        # Concurrent displayName ranges used to list service principals and
+        # applications; 1 follows a single nextLink chain
+        self._partitions   = max(1, partitions or 1)
+        # ResponseArchive receiving every page of a full collection
+        self._archive      = archive
         
     async def __aenter__(self):
         #print(f"Use cache: {self._use_cache}")
@@ -56,6 +111,69 @@ class GraphCrawler:
                         await client.aclose()
             except Exception as e:
                 self._logger.error(f"Error closing HTTP client: {e}")
+        self._executor.shutdown(wait=True)
+
+
+    async def _run_in_pool(self, function, *args):
+        async with self._convert_slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+
+    async def _submit_page(self, function, page, *args):
+        # Hands a page to the worker pool and returns a future, so the caller
+        # can fetch the next page while this one is converted. Waits when
+        # all conversion slots are taken. Small pages (most sub-resource
+        # lists) cost less to convert inline than to hand to a worker.
+        loop = asyncio.get_running_loop()
+        if len(page) < POOL_MIN_PAGE:
+            future = loop.create_future()
+            future.set_result(function(page, *args))
+            return future
+        await self._convert_slots.acquire()
+        future = loop.run_in_executor(self._executor, function, page, *args)
+        future.add_done_callback(lambda _: self._convert_slots.release())
+        return future
+
+
+    def _serialize_page(self, objects, sp_id=None, record=None):
+        # Runs on the worker pool. With an archive, the page is also written
+        # there, described by record (see ResponseArchive).
+        rows    = []
+        objects = [self._graph_data.kiota_to_dict(obj) for obj in objects]
+        for obj in objects:
+            row = self._graph_data.json_row(obj)
+            if sp_id is not None:
+                row['service_principal_id'] = sp_id
+            rows.append(row)
+        self._archive_page(record, objects)
+        return rows
+
+
+    def _serialize_sp_page(self, sps, record=None):
+        # Runs on the worker pool: service principal rows and their app roles
+        sp_rows   = []
+        role_rows = []
+        objects   = []
+        for sp in sps:
+            obj = self._graph_data.kiota_to_dict(sp)
+            objects.append(obj)
+            sp_rows.append(self._graph_data.json_row(obj))
+            for role in sp.app_roles or []:
+                role_data = self._graph_data.kiota_to_json(role)
+                role_data['service_principal_id'] = sp.id
+                role_rows.append(role_data)
+        self._archive_page(record, objects)
+        return sp_rows, role_rows
+
+
+    def _archive_page(self, record, objects):
+        if self._archive is not None and record is not None:
+            self._archive.write(record, objects)
+
+
+    @staticmethod
+    def _frames(*row_lists):
+        return tuple(pd.DataFrame(rows) for rows in row_lists)
 
 
     async def _authenticate(self, client_id=CLIENT_ID, use_cache=False):
@@ -112,13 +230,15 @@ class GraphCrawler:
         client, 
         initial_response, 
         response_type,
-        max_retries = 3
+        max_retries = 3,
+        headers = None
     ):
+        # Yields one page (list of kiota objects) at a time. The network slot
+        # is released before the page is handed to the consumer.
         if not initial_response or not initial_response.value:
             return
 
-        for item in initial_response.value:
-            yield item
+        yield initial_response.value
 
         next_link = initial_response.odata_next_link
         retry_count = 0
@@ -129,61 +249,142 @@ class GraphCrawler:
                     request_info = client.to_get_request_information()
                     request_info.url_template = next_link
                     request_info.path_parameters = {}
+                    for key, value in (headers or {}).items():
+                        request_info.headers.add(key, value)
 
                     response = await client.request_adapter.send_async(
                         request_info,
                         response_type,
                         error_map={"4XX": ODataError, "5XX": ODataError}
                     )
-
-                    if response and response.value:
-                        for item in response.value:
-                            yield item
-                        next_link = response.odata_next_link
-                        retry_count = 0  # Reset retry count on success
-                    else:
-                        next_link = None
                         
             except (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
                 retry_count += 1
                 if retry_count <= max_retries:
                     wait_time = min(2 ** retry_count, 30)  # Exponential backoff, max 30s
-                    self._logger.warning(f"Connection error, retrying in {wait_time}s (attempt {retry_count}/{max_retries}): {e}")
+                    self._logger.warning("Connection error, retrying in %ss (attempt %s/%s): %s", wait_time, retry_count, max_retries, e)
                     await asyncio.sleep(wait_time)
                     continue
                 else:
-                    self._logger.error(f"Max retries exceeded for pagination: {e}")
+                    self._logger.error("Max retries exceeded for pagination: %s", e)
                     raise GraphException(f"Connection failed after {max_retries} retries: {e}")
             except Exception as e:
-                self._logger.error(f"Unexpected error during pagination: {e}")
+                self._logger.error("Unexpected error during pagination: %s", e)
                 raise GraphException(f"Pagination error: {e}")
-            
+
+            retry_count = 0  # Reset retry count on success
+            if response and response.value:
+                next_link = response.odata_next_link
+                yield response.value
+            else:
+                next_link = None
+
+
+    async def _enumerate(self, collection, query_parameters):
+        # Pages of a top-level collection (service_principals, applications),
+        # either one nextLink chain or self._partitions chains walked at once
+        if self._partitions > 1:
+            async for page in self._enumerate_partitioned(collection, query_parameters):
+                yield page
+            return
+
+        request_config = RequestConfiguration(query_parameters=query_parameters(top=999))
+        response = await collection.get(request_configuration=request_config)
+        async for page in self._paginate_with_retry(collection, response, type(response)):
+            yield page
+
+
+    async def _walk_partition(self, collection, query_parameters, filter, pages):
+        request_config = RequestConfiguration(
+            query_parameters=query_parameters(top=999, filter=filter, count=True)
+        )
+        for key, value in ADVANCED_QUERY_HEADERS.items():
+            request_config.headers.add(key, value)
+        async with self._semaphore:
+            response = await collection.get(request_configuration=request_config)
+        async for page in self._paginate_with_retry(
+            collection,
+            response,
+            type(response),
+            headers=ADVANCED_QUERY_HEADERS
+        ):
+            await pages.put(page)
+
+
+    async def _enumerate_partitioned(self, collection, query_parameters):
+        # Each displayName range is listed concurrently. Range bounds are
+        # inclusive on both sides, so an object named exactly like a bound is
+        # returned twice; pages are merged with de-duplication by id. If any
+        # range fails (e.g. the tenant rejects the filter), the collection is
+        # listed again sequentially and only unseen objects are yielded.
+        pages   = asyncio.Queue(maxsize=self._partitions * 2)
+        errors  = []
+        seen    = set()
+        done    = object()
+
+        async def walk(filter):
+            try:
+                await self._walk_partition(collection, query_parameters, filter, pages)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                await pages.put(done)
+
+        filters = partition_filters(self._partitions)
+        tasks = [asyncio.create_task(walk(filter)) for filter in filters]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                page = await pages.get()
+                if page is done:
+                    remaining -= 1
+                    continue
+                page = [obj for obj in page if obj.id not in seen]
+                seen.update(obj.id for obj in page)
+                if page:
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if errors:
+            self._logger.warning(
+                "Partitioned listing failed (%s), falling back to a single listing", errors[0]
+            )
+            self._partitions = 1
+            async for page in self._enumerate(collection, query_parameters):
+                page = [obj for obj in page if obj.id not in seen]
+                if page:
+                    yield page
+
 
 
 
     async def fetch(self):
+        # Tables are published together when the collection completes;
+        # detection runs meanwhile keep reading the previous database
         try:
-            self._logger.info("[*] Starting collection: This might take a few hours depending on the size of your Entra-ID Directory ☕️")
-            self._logger.info("[*] Starting to fetch applications...")
-            df = await self.fetch_applications()
-            if not df.empty:
-                self._graph_data.store_table('applications', df)
-                #self._logger.info(f"[+] Stored {len(df)} applications")
-
-            self._logger.info("[*] Starting to fetch service principals...")
-            df_list = await self.fetch_service_principals()
-            tables = (
-                'service_principals', 
-                'app_role_assignments', 
-                'app_role_assigned_to', 
-                'app_roles', 
-                'sp_oauth_grants', 
-                'sp_member_of' 
-            )   
-            for table, df in zip(tables, df_list):
+            with self._graph_data.staging():
+                self._logger.info("[*] Starting collection: This might take a few hours depending on the size of your Entra-ID Directory ☕️")
+                self._logger.info("[*] Starting to fetch applications...")
+                df = await self.fetch_applications()
                 if not df.empty:
-                    self._graph_data.store_table(table, df)
-                    self._logger.info(f"[+] Stored {len(df)} records in {table}")
+                    self._graph_data.store_table('applications', df)
+                    #self._logger.info(f"[+] Stored {len(df)} applications")
+
+                self._logger.info("[*] Starting to fetch service principals...")
+                df_list = await self.fetch_service_principals()
+                tables = (
+                    'service_principals', 
+                    'app_role_assignment_edges', 
+                    'app_roles', 
+                    'sp_oauth_grants', 
+                    'sp_member_of' 
+                )   
+                for table, df in zip(tables, df_list):
+                    if not df.empty:
+                        self._graph_data.store_table(table, df)
+                        self._logger.info(f"[+] Stored {len(df)} records in {table}")
                     
         except Exception as e:
             self._logger.error(f"Error fetching data: {e}")
@@ -196,66 +397,54 @@ class GraphCrawler:
         member_of_list = []
         app_roles_list = []
         oauth_grants_list = []
-        app_role_assignment_list = []
-        app_role_assigned_to_list = []
+        assignment_list = []
 
         try:
-            query_params = ServicePrincipalsRequestBuilder.\
-                ServicePrincipalsRequestBuilderGetQueryParameters(top=999)
-            request_config = RequestConfiguration(query_parameters=query_params)
-
-            response = await self._graph_client.service_principals.get(
-                request_configuration=request_config
-            )
-
             counter       = 0
             batch_counter = 0
 
-            page_response = self._paginate_with_retry(
-                self._graph_client.service_principals, 
-                response, 
-                type(response)
+            page_response = self._enumerate(
+                self._graph_client.service_principals,
+                ServicePrincipalsRequestBuilder.ServicePrincipalsRequestBuilderGetQueryParameters
             )
             
             tasks = []
-            async for sp in page_response:
-                sp_list.append(self._graph_data.kiota_to_json(sp))
-
-                # Handle app roles
-                if sp.app_roles:
-                    for role in sp.app_roles:
-                        role_data = self._graph_data.kiota_to_json(role)
-                        role_data['service_principal_id'] = sp.id
-                        app_roles_list.append(role_data)
-
-                # Create task for subresources
-                task = self.fetch_sp_subresources_batch(sp.id)
-                tasks.append(task)
-                
-                counter       += 1
-                batch_counter += 1
-                
-                # Process in batches
-                if batch_counter >= self._batch_size or (self._debug and counter >= self._debug):
-                    self._logger.info(f"[*] Processing batch of {len(tasks)} service principals...")
-                    results_batch = await asyncio.gather(*tasks, return_exceptions=True)
-                    
-                    for result in results_batch:
-                        if isinstance(result, Exception):
-                            self._logger.error(f"Error in batch processing: {result}")
-                            continue
-                            
-                        app_role_assignment_list.extend(result[0])
-                        app_role_assigned_to_list.extend(result[1])
-                        oauth_grants_list.extend(result[2])
-                        member_of_list.extend(result[3])
-                    
-                    tasks = []
-                    batch_counter = 0
-                    
-                    # Delay between batches
-                    await asyncio.sleep(0.5)
-                
+            pending = []
+            async for page in page_response:
+                if self._debug:
+                    page = page[:max(self._debug - counter, 0)]
+                sp_ids = [sp.id for sp in page]
+                record = {"resource": "service_principals", "page": len(pending)}
+                pending.append(await self._submit_page(self._serialize_sp_page, page, record))
+
+                for sp_id in sp_ids:
+                    # Create task for subresources
+                    task = self.fetch_sp_subresources_batch(sp_id)
+                    tasks.append(task)
+
+                    counter       += 1
+                    batch_counter += 1
+
+                    # Process in batches
+                    if batch_counter >= self._batch_size or (self._debug and counter >= self._debug):
+                        self._logger.info(f"[*] Processing batch of {len(tasks)} service principals...")
+                        results_batch = await asyncio.gather(*tasks, return_exceptions=True)
+
+                        for result in results_batch:
+                            if isinstance(result, Exception):
+                                self._logger.error("Error in batch processing: %s", result)
+                                continue
+
+                            assignment_list.extend(result[0])
+                            oauth_grants_list.extend(result[1])
+                            member_of_list.extend(result[2])
+
+                        tasks = []
+                        batch_counter = 0
+
+                        # Delay between batches
+                        await asyncio.sleep(0.5)
+
                 if self._debug and counter >= self._debug:
                     break
             
@@ -266,36 +455,38 @@ class GraphCrawler:
                 
                 for result in results_batch:
                     if isinstance(result, Exception):
-                        self._logger.error(f"Error in final batch processing: {result}")
+                        self._logger.error("Error in final batch processing: %s", result)
                         continue
                         
-                    app_role_assignment_list.extend(result[0])
-                    app_role_assigned_to_list.extend(result[1])
-                    oauth_grants_list.extend(result[2])
-                    member_of_list.extend(result[3])
+                    assignment_list.extend(result[0])
+                    oauth_grants_list.extend(result[1])
+                    member_of_list.extend(result[2])
                 
+            for sp_rows, role_rows in await asyncio.gather(*pending):
+                sp_list.extend(sp_rows)
+                app_roles_list.extend(role_rows)
+
         except Exception as e:
             raise GraphException(f"MS Graph API error fetching ServicePrincipals: {str(e)}")
     
-        return (
-            pd.DataFrame(sp_list), 
-            pd.DataFrame(app_role_assignment_list), 
-            pd.DataFrame(app_role_assigned_to_list),
-            pd.DataFrame(app_roles_list), 
-            pd.DataFrame(oauth_grants_list), 
-            pd.DataFrame(member_of_list)
+        return await self._run_in_pool(
+            self._frames,
+            sp_list, 
+            assignment_list, 
+            app_roles_list, 
+            oauth_grants_list, 
+            member_of_list
         )
     
 
-    async def fetch_sp_subresources_batch(self, sp_id):
+    async def fetch_sp_subresources_batch(self, sp_id, outbound=False):
+        # Every assignment is listed under its resource SP, whatever the
+        # principal type, so a full collection fetches each edge once from
+        # the appRoleAssignedTo side. The principal side (appRoleAssignments)
+        # is only fetched with outbound=True, for a subset of SPs whose
+        # resources are not re-listed.
         try:
-            results = await asyncio.gather(
-                self.fetch_sp_subresource_with_retry(
-                    'app_role_assignments',
-                    AppRoleAssignmentsRequestBuilder.\
-                        AppRoleAssignmentsRequestBuilderGetQueryParameters,
-                    sp_id
-                ),
+            requests = [
                 self.fetch_sp_subresource_with_retry(
                     'app_role_assigned_to',
                     AppRoleAssignedToRequestBuilder.\
@@ -313,49 +504,55 @@ class GraphCrawler:
                     MemberOfRequestBuilder.\
                         MemberOfRequestBuilderGetQueryParameters,
                     sp_id
-                ),
-                return_exceptions=True
-            )
+                )
+            ]
+            if outbound:
+                requests.append(
+                    self.fetch_sp_subresource_with_retry(
+                        'app_role_assignments',
+                        AppRoleAssignmentsRequestBuilder.\
+                            AppRoleAssignmentsRequestBuilderGetQueryParameters,
+                        sp_id
+                    )
+                )
+            results = await asyncio.gather(*requests, return_exceptions=True)
             
             # Handle any exceptions in the results
             processed_results = []
             for i, result in enumerate(results):
                 if isinstance(result, Exception):
-                    self._logger.error(f"Error fetching subresource {i} for SP {sp_id}: {result}")
+                    self._logger.error("Error fetching subresource %s for SP %s: %s", i, sp_id, result)
                     processed_results.append([]) 
                 else:
                     processed_results.append(result)
-            
+
+            if outbound:
+                processed_results[0] = processed_results[0] + processed_results.pop()
             return processed_results
             
         except Exception as e:
-            self._logger.error(f"Error in batch subresource fetch for SP {sp_id}: {e}")
-            return [[], [], [], []]
+            self._logger.error("Error in batch subresource fetch for SP %s: %s", sp_id, e)
+            return [[], [], []]
 
 
     async def fetch_applications(self):
         app_list = []
         try:
-            query_params = ApplicationsRequestBuilder.\
-                ApplicationsRequestBuilderGetQueryParameters(top=999)
-            
-            request_config = RequestConfiguration(query_parameters=query_params)
-            
-            response = await self._graph_client.applications.get(
-                request_configuration=request_config
-            )
-
-            async for app in self._paginate_with_retry(
-                self._graph_client.applications, 
-                response, 
-                type(response)
+            pending = []
+            async for page in self._enumerate(
+                self._graph_client.applications,
+                ApplicationsRequestBuilder.ApplicationsRequestBuilderGetQueryParameters
             ):
-                app_list.append(self._graph_data.kiota_to_json(app))
+                record = {"resource": "applications", "page": len(pending)}
+                pending.append(await self._submit_page(self._serialize_page, page, None, record))
+            for rows in await asyncio.gather(*pending):
+                app_list.extend(rows)
            
         except Exception as e:
             raise GraphException(f"MS Graph API error fetching Applications: {str(e)}")
     
-        return pd.DataFrame(app_list)
+        frames = await self._run_in_pool(self._frames, app_list)
+        return frames[0]
     
 
 
@@ -368,46 +565,135 @@ class GraphCrawler:
     ):  
         for attempt in range(max_retries + 1):
             try:
-                async with self._semaphore:
-                    results_list = []
-                    
-                    query_params = builder(top=999)
-                    request_config = RequestConfiguration(query_parameters=query_params)
-                      
-                    sp_obj = self._graph_client.service_principals.\
-                        by_service_principal_id(sp_id)
-                    resource_path = getattr(sp_obj, resource_name)
+                results_list = []
+
+                query_params = builder(top=999)
+                request_config = RequestConfiguration(query_parameters=query_params)
+
+                sp_obj = self._graph_client.service_principals.\
+                    by_service_principal_id(sp_id)
+                resource_path = getattr(sp_obj, resource_name)
 
+                # The slot is held for the request only; further pages take
+                # their own slot and conversion runs on the worker pool
+                async with self._semaphore:
                     response = await resource_path.get(request_configuration=request_config)
-                    
-                    async for obj in self._paginate_with_retry(
-                        resource_path, 
-                        response, 
-                        type(response)
-                    ):
-                        obj_data = self._graph_data.kiota_to_json(obj)
-                        obj_data['service_principal_id'] = sp_id 
-                        results_list.append(obj_data)
-
-                    return results_list
+
+                owner = None if resource_name in ASSIGNMENT_RESOURCES else sp_id
+                record = {"resource": resource_name, "sp_id": sp_id, "attempt": attempt}
+                pending = []
+                async for page in self._paginate_with_retry(
+                    resource_path, 
+                    response, 
+                    type(response)
+                ):
+                    record = {**record, "page": len(pending)}
+                    pending.append(await self._submit_page(self._serialize_page, page, owner, record))
+                for rows in await asyncio.gather(*pending):
+                    results_list.extend(rows)
+
+                if attempt and not pending:
+                    # Empty retry: supersedes the archived pages of failed attempts
+                    self._archive_page({**record, "page": 0}, [])
+                return results_list
                     
             except AttributeError:
                 raise GraphException(f"No such resource: {resource_name} on service principal object")
             except (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
                 if attempt < max_retries:
                     wait_time = min(2 ** attempt, 30)  # Exponential backoff
-                    self._logger.error(f"Connection error fetching {resource_name} for SP {sp_id}, retrying in {wait_time}s (attempt {attempt + 1}/{max_retries + 1}): {e}")
+                    self._logger.error(
+                        "Connection error fetching %s for SP %s, retrying in %ss (attempt %s/%s): %s",
+                        resource_name, sp_id, wait_time, attempt + 1, max_retries + 1, e
+                    )
                     await asyncio.sleep(wait_time)
                     continue
                 else:
-                    self._logger.error(f"Max retries exceeded for {resource_name} on SP {sp_id}: {e}")
+                    self._logger.error("Max retries exceeded for %s on SP %s: %s", resource_name, sp_id, e)
+                    self._archive_failed(resource_name, sp_id, attempt)
                     return [] 
             except Exception as e:
-                self._logger.error(f"Error fetching {resource_name} for SP {sp_id}: {e}")
+                self._logger.error("Error fetching %s for SP %s: %s", resource_name, sp_id, e)
                 if attempt < max_retries:
                     await asyncio.sleep(2 ** attempt)
                     continue
                 else:
+                    self._archive_failed(resource_name, sp_id, attempt)
                     return []
         
-        return []
\ No newline at end of file
+        return []
+
+
+
+    def _archive_failed(self, resource_name, sp_id, attempt):
+        # The listing is stored empty, so pages archived by the failed
+        # attempts must not be ingested either
+        record = {"resource": resource_name, "sp_id": sp_id, "attempt": attempt + 1, "page": 0}
+        self._archive_page(record, [])
+
+
+    async def fetch_delta(self, resource, delta_link=None, max_retries=3):
+        # Objects of resource ('service_principals' or 'applications') changed
+        # since delta_link, or every object when there is no link yet, and
+        # the link for the next call. Removed objects carry an "@removed" key.
+        collection = getattr(self._graph_client, resource).delta
+        if delta_link:
+            builder = collection.with_url(delta_link)
+            request_config = None
+        else:
+            builder = collection
+            query_params = collection.DeltaRequestBuilderGetQueryParameters(
+                select=DELTA_SELECT[resource]
+            )
+            request_config = RequestConfiguration(query_parameters=query_params)
+
+        pending = []
+        while builder:
+            for attempt in range(max_retries + 1):
+                try:
+                    async with self._semaphore:
+                        response = await builder.get(request_configuration=request_config)
+                    break
+                except (httpx.ConnectError, httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
+                    if attempt >= max_retries:
+                        raise GraphException(f"Connection failed after {max_retries} retries fetching {resource} delta: {e}")
+                    wait_time = min(2 ** (attempt + 1), 30)
+                    self._logger.warning("Connection error, retrying in %ss (attempt %s/%s): %s", wait_time, attempt + 1, max_retries, e)
+                    await asyncio.sleep(wait_time)
+                except Exception as e:
+                    raise GraphException(f"MS Graph API error fetching {resource} delta: {str(e)}")
+
+            request_config = None
+            if response and response.value:
+                pending.append(await self._submit_page(self._serialize_page, response.value))
+            if response and response.odata_next_link:
+                builder = collection.with_url(response.odata_next_link)
+            else:
+                if response and response.odata_delta_link:
+                    delta_link = response.odata_delta_link
+                builder = None
+
+        objects = []
+        for rows in await asyncio.gather(*pending):
+            objects.extend(rows)
+        return objects, delta_link
+
+
+    async def fetch_sp_subresources(self, sp_ids):
+        # Assignments (in both directions), grants and memberships of the
+        # given service principals, in the order of the sub-resource tables
+        lists = ([], [], [])
+        sp_ids = list(sp_ids)
+        for start in range(0, len(sp_ids), self._batch_size):
+            batch = sp_ids[start:start + self._batch_size]
+            results = await asyncio.gather(
+                *(self.fetch_sp_subresources_batch(sp_id, outbound=True) for sp_id in batch)
+            )
+            for result in results:
+                for rows, result_rows in zip(lists, result):
+                    rows.extend(result_rows)
+        # An assignment between two of the SPs is listed from both ends
+        edges = {}
+        for row in lists[0]:
+            edges.setdefault(row.get('id'), row)
+        return await self._run_in_pool(self._frames, list(edges.values()), *lists[1:])
@@ -1,37 +1,200 @@
+import os
 import json
 import duckdb
+import shutil
 import sqlite3
 import logging
-import pandas as pd
+import threading
+import time
+from contextlib import contextmanager
+try:
+    from duckdb.sqltypes import VARCHAR, BOOLEAN, INTEGER
+except ImportError:
+    from duckdb.typing import VARCHAR, BOOLEAN, INTEGER
 from pathlib import Path
 from datetime import datetime
 from .log import log_init
+from .profiler import profile_phase
 
-from kiota_serialization_json.json_serialization_writer_factory import JsonSerializationWriterFactory
-from kiota_abstractions.serialization import Parsable
-from kiota_abstractions.store import InMemoryBackingStore
+# pandas, numpy (GraphIndex) and the kiota serializers are imported where
+# they are used: a detection run over a cached database needs none of them
+
+
+TABLES = [
+    'service_principals', 
+    'app_role_assignment_edges', 
+    'app_roles', 
+    'sp_oauth_grants',
+    'sp_member_of', 
+    'applications'
+]
+
+# Columns in each table that hold a service principal id. A changed row marks
+# every SP it references as changed, so both ends of a join are re-evaluated.
+SP_KEY_COLUMNS = {
+    'service_principals': ['id'],
+    'app_role_assignment_edges': ['principalId', 'resourceId'],
+    'app_roles': ['service_principal_id'],
+    'sp_oauth_grants': ['service_principal_id', 'clientId', 'resourceId'],
+    'sp_member_of': ['service_principal_id'],
+    'applications': []
+}
+
+# Every app role assignment is stored once in app_role_assignment_edges. The
+# per-direction tables of earlier collections are views over it, with
+# service_principal_id set to the SP the assignment was listed under.
+ASSIGNMENT_TABLE = 'app_role_assignment_edges'
+ASSIGNMENT_VIEWS = {
+    'app_role_assignments': (
+        "SELECT *, principalId AS service_principal_id FROM app_role_assignment_edges "
+        "WHERE principalType = 'ServicePrincipal'"
+    ),
+    'app_role_assigned_to': "SELECT *, resourceId AS service_principal_id FROM app_role_assignment_edges"
+}
+
+# Objects attached to each service principal by enrichment. With a render
+# projection only the referenced ones are fetched, and only their projected
+# columns (RenderPlan.projection).
+SP_ENRICHMENTS = ('appRoleImports', 'appRoleExports', 'oauth2PermissionGrants', 'application', 'member_of')
+
+# Schema of the views detection SQL reads from a single database: every
+# collected table with a constant tenant column, the database file name, so
+# templates join on tenant whether or not the data is federated
+TENANT_VIEWS = 'tenant_views'
+
+# A DuckDB file opened for writing by another process (a collection
+# publishing, --incremental saving findings) cannot be attached until it is
+# closed again. Attaching is retried with backoff, about 8s in total.
+LOCK_RETRIES = 6
+LOCK_BACKOFF = 0.25
+
+# Bookkeeping tables kept alongside the collected data
+STATE_TABLES = {
+    'snapshots': "snapshot INTEGER, created TIMESTAMP",
+    'sp_changes': "snapshot INTEGER, table_name VARCHAR, sp_id VARCHAR",
+    'findings': "detection VARCHAR, sp_id VARCHAR, found_snapshot INTEGER, resolved_snapshot INTEGER",
+    'detection_state': "detection VARCHAR, query_hash VARCHAR, snapshot INTEGER",
+    # Per-row hashes of each GraphDiff field set, saved at ingest
+    'row_fingerprints': "table_name VARCHAR, field_set VARCHAR, row_key VARCHAR, fingerprint UBIGINT",
+    # Graph delta query links of the tripwire daemon
+    'delta_links': "resource VARCHAR, delta_link VARCHAR"
+}
 
 
 class GraphException(Exception):
     def __init__(self, message, *args, **kwargs):
         logger = logging.getLogger(__name__)
-        logger.error("%s", message, exc_info=True)
+        # Logged at the raise site; the traceback is rendered by the log
+        # listener thread, and repeated failures are rate-limited
+        logger.error("%s", message, exc_info=True, stacklevel=2)
         super().__init__(message, *args, **kwargs)
 
 class GraphData():
-    def __init__(self, db_path='graph_data.db', graph_diff=None):
+    def __init__(
+            self, 
+            db_path='graph_data.db', 
+            graph_diff=None,
+            memory_limit=None,
+            threads=None,
+            temp_directory=None,
+            batch_size=2048,
+            profiler=None,
+            tenants=None
+        ):
         self.tables  = {}
         self._hash_registry = {}
         self._logger = log_init(__name__, level=logging.ERROR)
         self._graph_diff = graph_diff
+        self._batch_size = batch_size
+        self._local = threading.local()
+        self._snapshot = None
+        self.profiler = profiler
+        self._graph_index = None
+        self._index_lock = threading.Lock()
+        self._column_cache = {}
+        # Staging database of a running collection (see staging) and the
+        # tables persisted to it so far
+        self._staging = None
+        self._staged  = set()
+
+        # Federated mode: {tenant: db_path} attached read-only instead of
+        # loading db_path into memory
+        self.tenants = dict(tenants or {})
 
         self._db_path = db_path
         self.db = duckdb.connect(':memory:')
-        self._load_from_disk(self._db_path)
+        self._configure_engine(memory_limit, threads, temp_directory)
+        with profile_phase(self.profiler, 'load'):
+            if self.tenants:
+                self._attach_tenants(self.tenants)
+            else:
+                self.db.execute(f"CREATE SCHEMA {TENANT_VIEWS}")
+                self._load_from_disk(self._db_path)
+        self._register_graph_functions()
+
+    @property
+    def federated(self):
+        return bool(self.tenants)
+
+    @property
+    def tenant(self):
+        # Tenant of a single database, named after the file like --tenants
+        # does; federated rows carry their own
+        return None if self.federated else Path(self._db_path).stem
+
+    def same_tenant(self, left, right):
+        # Extra join condition for joins that are not on a globally unique
+        # object id (appId, app role id), empty for a single database
+        return f" AND {left}.tenant = {right}.tenant" if self.federated else ""
+
+    def sp_key(self, sp):
+        # (tenant, sp_id) of an enriched service principal
+        return (sp.get('tenant') if self.federated else self.tenant, sp['id'])
+
+    def _sp_key_filter(self, sp_keys, alias='sp'):
+        # Condition matching (tenant, sp_id) keys or bare ids. A bare id, or a
+        # key without a tenant, matches the SP in every tenant
+        def quote(value):
+            return "'" + str(value).replace("'", "''") + "'"
+
+        ids, pairs = [], []
+        for key in sp_keys:
+            tenant, sp_id = key if isinstance(key, tuple) else (None, key)
+            if tenant is None or not self.federated:
+                ids.append(quote(sp_id))
+            else:
+                pairs.append(f"({quote(tenant)}, {quote(sp_id)})")
+        clauses = []
+        if ids:
+            clauses.append(f"{alias}.id IN ({','.join(ids)})")
+        if pairs:
+            clauses.append(f"({alias}.tenant, {alias}.id) IN ({','.join(pairs)})")
+        return "(" + " OR ".join(clauses) + ")"
 
     @property
     def db_path(self):
         return self._db_path
+
+
+    def _connection(self):
+        # DuckDB connections are not safe to share between threads. Worker
+        # threads each get their own cursor onto the same in-memory database.
+        if threading.current_thread() is threading.main_thread():
+            return self.db
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self.db.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+
+    def _sql_cursor(self, tenant_views=False):
+        # Cursor for one statement. Detection and user SQL (tenant_views)
+        # reads a single database through the tenant views
+        cursor = self._connection().cursor()
+        if tenant_views and not self.federated:
+            cursor.execute(f"SET search_path = '{TENANT_VIEWS},main'")
+        return cursor
    
 
     def fresh(self, refresh_days=7):
@@ -44,16 +207,93 @@ class GraphData():
 
 
 
+    @property
+    def graph_index(self):
+        # Built on first use from the currently loaded tables
+        with self._index_lock:
+            if self._graph_index is None:
+                from .graphindex import GraphIndex
+                self._graph_index = GraphIndex(self)
+            return self._graph_index
+
+
+    def reset_graph_index(self):
+        with self._index_lock:
+            self._graph_index = None
+
+
+    def _register_graph_functions(self):
+        # Attack-path lookups callable from detection SQL, e.g.
+        #   WHERE graph_can_reach(sp.id, 'app_role:Microsoft Graph/RoleManagement.ReadWrite.Directory', sp.tenant)
+        # The optional tenant picks the SP of that tenant when federated
+        # databases share SP ids; without it an SP id matches in every tenant
+        def node(sp_id, tenant):
+            if ':' in sp_id:
+                return sp_id
+            return f"sp:{sp_id}@{tenant.lower()}" if tenant and self.federated else f"sp:{sp_id}"
+
+        def can_reach(sp_id, target, tenant):
+            if sp_id is None or target is None:
+                return False
+            return self.graph_index.can_reach(node(sp_id, tenant), target)
+
+        def distance(sp_id, target, tenant):
+            if sp_id is None or target is None:
+                return None
+            return self.graph_index.distance(node(sp_id, tenant), target)
+
+        def path(sp_id, target, tenant):
+            if sp_id is None or target is None:
+                return None
+            hops = self.graph_index.shortest_path(node(sp_id, tenant), target)
+            return " -> ".join(hops) if hops else None
+
+        functions = (
+            ('graph_can_reach', can_reach, BOOLEAN),
+            ('graph_distance', distance, INTEGER),
+            ('graph_path', path, VARCHAR)
+        )
+        try:
+            for name, function, return_type in functions:
+                self.db.create_function(
+                    f"_{name}", 
+                    function, 
+                    [VARCHAR, VARCHAR, VARCHAR], 
+                    return_type, 
+                    null_handling='special',
+                    side_effects=False
+                )
+                # Python functions cannot be overloaded, macros can
+                self.db.execute(
+                    f"CREATE MACRO {name}(sp_id, target) AS _{name}(sp_id, target, NULL), "
+                    f"(sp_id, target, tenant) AS _{name}(sp_id, target, tenant)"
+                )
+        except Exception as e:
+            raise GraphException(f"Error registering graph functions: {str(e)}") from e
+
+
+    def _configure_engine(self, memory_limit=None, threads=None, temp_directory=None):
+        try:
+            if memory_limit:
+                self.db.execute(f"SET memory_limit = '{memory_limit}'")
+            if threads:
+                self.db.execute(f"SET threads = {int(threads)}")
+            if temp_directory:
+                # Operators that exceed memory_limit spill here instead of failing
+                Path(temp_directory).mkdir(parents=True, exist_ok=True)
+                self.db.execute(f"SET temp_directory = '{temp_directory}'")
+            if memory_limit or threads or temp_directory:
+                self._logger.info(
+                    f"[*] DuckDB limits: memory_limit={memory_limit}, threads={threads}, temp_directory={temp_directory}"
+                )
+        except Exception as e:
+            raise GraphException(f"Error configuring database engine: {str(e)}") from e
+
+
     def _load_from_disk(self, db_path):
-        tables = [
-            'service_principals', 
-            'app_role_assignments', 
-            'app_role_assigned_to', 
-            'app_roles', 
-            'sp_oauth_grants',
-            'sp_member_of', 
-            'applications'
-        ]
+        # Per-direction assignment tables are loaded from older databases and
+        # merged into the edge table by _upgrade_assignments
+        tables = TABLES + list(ASSIGNMENT_VIEWS)
 
         try:
             if not Path(db_path).exists():
@@ -65,9 +305,16 @@ class GraphData():
                 header = fp.read(16)
 
             if header.startswith(b'SQLite format 3\0'):
+                conn = sqlite3.connect(db_path)
+                stored = {
+                    row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                }
+                conn.close()
                 self.db.execute("INSTALL sqlite; LOAD sqlite;")
                 self.db.execute("SET sqlite_all_varchar=true")
                 for table in tables:
+                    if table not in stored:
+                        continue
                     self.db.execute(
                          f"CREATE TABLE IF NOT EXISTS {table} AS "
                          f"SELECT * FROM sqlite_scan('{db_path}', '{table}')"
@@ -79,20 +326,130 @@ class GraphData():
             elif b'DUCK' in header[:16]:
                 # Temporarily attach the disk database
                 self._logger.info(f"[+] Attached duckdb database: {db_path}")
-                self.db.execute(f"ATTACH DATABASE '{db_path}' AS disk_db")
+                self._attach(db_path, 'disk_db', read_only=True)
+                stored = {
+                    row[0] for row in self.db.execute(
+                        "SELECT table_name FROM duckdb_tables() WHERE database_name = 'disk_db'"
+                    ).fetchall()
+                }
                 for table in tables:
+                    if table not in stored:
+                        continue
                     self.db.execute(f"CREATE TABLE {table} AS SELECT * FROM disk_db.{table}")
                     self.tables[table] = self.db.table(table)
+                for table in STATE_TABLES:
+                    if table in stored:
+                        self.db.execute(f"CREATE TABLE {table} AS SELECT * FROM disk_db.{table}")
                 # Detach the disk database since we've copied the data    
                 self.db.execute("DETACH DATABASE disk_db")
                 
             else:
                 raise GraphException(f"Could not determine file format for {db_path}")
 
+            self._upgrade_assignments()
+            self._create_tenant_views()
+
         except Exception as e:
             raise GraphException(f"Error loading database from disk: {str(e)}") from e
 
 
+    def _upgrade_assignments(self):
+        # Databases collected before assignments were stored once hold every
+        # service principal to service principal assignment twice, once per
+        # direction. They are merged into the edge table, one row per id.
+        legacy = [table for table in ASSIGNMENT_VIEWS if table in self.tables]
+        if legacy and ASSIGNMENT_TABLE not in self.tables:
+            self.db.execute(
+                f"CREATE TABLE {ASSIGNMENT_TABLE} AS {self._legacy_assignments(legacy)}"
+            )
+            self.tables[ASSIGNMENT_TABLE] = self.db.table(ASSIGNMENT_TABLE)
+            self._logger.info(f"[*] Merged {', '.join(legacy)} into {ASSIGNMENT_TABLE}")
+        for table in legacy:
+            self.db.execute(f"DROP TABLE {table}")
+            del self.tables[table]
+        self._create_assignment_views()
+
+
+    @staticmethod
+    def _legacy_assignments(tables):
+        union = " UNION ALL BY NAME ".join(f"SELECT * FROM {table}" for table in tables)
+        return (
+            f"SELECT * EXCLUDE (service_principal_id) FROM ({union}) "
+            "QUALIFY row_number() OVER (PARTITION BY id) = 1"
+        )
+
+
+    def _create_assignment_views(self):
+        if ASSIGNMENT_TABLE not in self.tables:
+            return
+        for view, select in ASSIGNMENT_VIEWS.items():
+            self.db.execute(f"CREATE OR REPLACE VIEW {view} AS {select}")
+
+
+    def _create_tenant_views(self):
+        tenant = self.tenant.replace("'", "''")
+        names = list(self.tables)
+        if ASSIGNMENT_TABLE in self.tables:
+            names.extend(ASSIGNMENT_VIEWS)
+        for name in names:
+            self.db.execute(
+                f"CREATE OR REPLACE VIEW {TENANT_VIEWS}.{name} AS "
+                f"SELECT '{tenant}' AS tenant, * FROM main.{name}"
+            )
+
+
+    def _attach_tenants(self, tenants):
+        # Every tenant database is attached read-only and each collected
+        # table becomes a view over all of them with a leading tenant column.
+        # Nothing is copied into memory.
+        try:
+            attached = []
+            for i, (tenant, path) in enumerate(tenants.items()):
+                if not Path(path).exists():
+                    raise GraphException(f"No database found for tenant {tenant}: {path}")
+                with open(path, 'rb') as fp:
+                    header = fp.read(16)
+                alias = f"tenant_{i}"
+                if header.startswith(b'SQLite format 3\0'):
+                    self.db.execute("INSTALL sqlite; LOAD sqlite;")
+                    self.db.execute("SET sqlite_all_varchar=true")
+                    self.db.execute(f"ATTACH DATABASE '{path}' AS {alias} (TYPE sqlite, READ_ONLY)")
+                elif b'DUCK' in header:
+                    self.db.execute(f"ATTACH DATABASE '{path}' AS {alias} (READ_ONLY)")
+                else:
+                    raise GraphException(f"Could not determine file format for {path}")
+                stored = {
+                    row[0] for row in self.db.execute(
+                        "SELECT table_name FROM information_schema.tables WHERE table_catalog = ?", [alias]
+                    ).fetchall()
+                }
+                attached.append((tenant.replace("'", "''"), alias, stored))
+                self._logger.info(f"[+] Attached {path} as tenant {tenant}")
+
+            for table in TABLES:
+                selects = [
+                    f"SELECT '{tenant}' AS tenant, * FROM {alias}.{table}"
+                    for tenant, alias, stored in attached if table in stored
+                ]
+                if table == ASSIGNMENT_TABLE:
+                    for tenant, alias, stored in attached:
+                        legacy = [f"{alias}.{view}" for view in ASSIGNMENT_VIEWS if view in stored]
+                        if legacy and table not in stored:
+                            selects.append(
+                                f"SELECT '{tenant}' AS tenant, * FROM ({self._legacy_assignments(legacy)})"
+                            )
+                if not selects:
+                    continue
+                self.db.execute(f"CREATE VIEW {table} AS {' UNION ALL BY NAME '.join(selects)}")
+                self.tables[table] = self.db.table(table)
+            self._create_assignment_views()
+
+        except GraphException:
+            raise
+        except Exception as e:
+            raise GraphException(f"Error attaching tenant databases: {str(e)}") from e
+
+
     def store_table(
             self, 
             name, 
@@ -102,40 +459,238 @@ class GraphData():
         ):
 
         try:
-           # Perform diff before loading new data
-            if self._graph_diff and name in self.tables:
-                cache_df = self.tables[name].to_df()
-                self._graph_diff.compare(name, cache_df, df)
-
             if df.empty:
                 self._logger.warning(f"[*] Empty dataframe for table {name}.")
                 return
+
+            # Scan the DataFrame once; the diff, change capture and the table
+            # replacement all read the staged copy
+            self.db.execute("CREATE OR REPLACE TEMP TABLE _incoming AS SELECT * FROM df")
+            self._ingest(name, persist)
             
-            # Replace the in-memory table with new DataFrame data
-            self.db.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM df")
-            self.tables[name] = self.db.table(name)
-            
-            if persist:
-                self._persist_to_disk(name)
-                if sqlite:
-                    conn = sqlite3.connect(f"{self.db_path}.sqlite")
-                    df.to_sql(name, conn, if_exists='replace', index=False)
-                    conn.close()
+            if persist and sqlite:
+                conn = sqlite3.connect(self._sqlite_path())
+                df.to_sql(name, conn, if_exists='replace', index=False)
+                conn.close()
 
             self._logger.info(f"[+] Stored table '{name}' with {len(df)} rows and {len(df.columns)} columns")
 
         except Exception as e:
             raise GraphException(f"GraphData: Error storing table: {str(e)}") from e  
+
+
+    def upsert_table(self, name, df, removed=(), key='id', persist=True):
+        # Merge changed objects (possibly with only some columns) and removed
+        # keys into a stored table, then ingest it like a full collection
+        try:
+            if name not in self.tables:
+                self.store_table(name, df, persist, sqlite=False)
+                return
+
+            columns = {row[0]: row[1] for row in self.db.execute(f"DESCRIBE {name}").fetchall()}
+            self._stage_keys('_removed', removed)
+            if df.empty:
+                self.db.execute(f'CREATE OR REPLACE TEMP TABLE _delta AS SELECT "{key}" FROM {name} WHERE false')
+            else:
+                self.db.execute("CREATE OR REPLACE TEMP TABLE _delta AS SELECT * FROM df")
+            delta = [
+                row[0] for row in self.db.execute("DESCRIBE _delta").fetchall()
+                if row[0] in columns
+            ]
+            kept     = ", ".join(f'"{col}"' for col in delta if col != key)
+            # Properties a changed object did not return keep their stored value
+            replaced = ", ".join(
+                f'COALESCE(TRY_CAST(d."{col}" AS {columns[col]}), t."{col}") AS "{col}"' for col in delta
+            )
+            exclude  = ", ".join(f'"{col}"' for col in delta)
+            updated  = f"SELECT t.* EXCLUDE ({exclude}), {replaced} FROM {name} t JOIN _delta d USING (\"{key}\")"
+            if not kept:
+                updated = f"SELECT t.* FROM {name} t JOIN _delta d USING (\"{key}\")"
+            self.db.execute(f"""
+                CREATE OR REPLACE TEMP TABLE _incoming AS
+                SELECT * FROM {name}
+                WHERE "{key}" NOT IN (SELECT "{key}" FROM _delta) AND "{key}" NOT IN (SELECT k FROM _removed)
+                UNION ALL BY NAME
+                ({updated})
+                UNION ALL BY NAME
+                SELECT {", ".join(f'"{col}"' for col in delta)} FROM _delta
+                WHERE "{key}" NOT IN (SELECT "{key}" FROM {name})
+            """)
+            self.db.execute("DROP TABLE IF EXISTS _delta")
+            self.db.execute("DROP TABLE IF EXISTS _removed")
+            self._ingest(name, persist)
+            self._logger.info(f"[+] Merged {len(df)} changed and {len(removed)} removed rows into '{name}'")
+
+        except Exception as e:
+            raise GraphException(f"GraphData: Error merging table: {str(e)}") from e
+
+
+    def replace_rows(self, name, df, column, values, persist=True):
+        # Replace every row whose column (or any of a list of columns) is in
+        # values, e.g. the assignments of a set of re-fetched service principals
+        try:
+            if name not in self.tables:
+                if not df.empty:
+                    self.store_table(name, df, persist, sqlite=False)
+                return
+
+            columns = [column] if isinstance(column, str) else list(column)
+            self._stage_keys('_replaced', values)
+            select = f"SELECT * FROM {name} WHERE " + " AND ".join(
+                f'"{col}" NOT IN (SELECT k FROM _replaced)' for col in columns
+            )
+            if not df.empty:
+                select += " UNION ALL BY NAME SELECT * FROM df"
+            self.db.execute(f"CREATE OR REPLACE TEMP TABLE _incoming AS {select}")
+            self.db.execute("DROP TABLE IF EXISTS _replaced")
+            self._ingest(name, persist)
+
+        except Exception as e:
+            raise GraphException(f"GraphData: Error replacing rows: {str(e)}") from e
+
+
+    def _stage_keys(self, table, keys):
+        self.db.execute(
+            f"CREATE OR REPLACE TEMP TABLE {table} AS SELECT unnest(?::VARCHAR[]) AS k",
+            [[str(key) for key in keys]]
+        )
+
+
+    def _ingest(self, name, persist=True):
+        # Diff, change capture and replacement of a table by the rows staged
+        # in _incoming
+        if self._graph_diff and name in self._graph_diff.tables:
+            self.ensure_state_tables()
+            self._graph_diff.compare_tables(
+                self.db, 
+                name, 
+                name if name in self.tables else None, 
+                '_incoming',
+                fingerprints='row_fingerprints'
+            )
+            if persist:
+                self._persist_to_disk('row_fingerprints')
+        else:
+            # Without a GraphDiff the stored fingerprints no longer describe
+            # the table; a later diff must hash it again
+            self.ensure_state_tables()
+            dropped = self.db.execute(
+                "DELETE FROM row_fingerprints WHERE table_name = ?", [name]
+            ).fetchone()[0]
+            if dropped and persist:
+                self._persist_to_disk('row_fingerprints')
+
+        self._record_changes(name, '_incoming', persist)
+        
+        # Replace the in-memory table with the new data
+        self.db.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM _incoming")
+        self.db.execute("DROP TABLE IF EXISTS _incoming")
+        self.tables[name] = self.db.table(name)
+        if name == ASSIGNMENT_TABLE:
+            self._create_assignment_views()
+        self._create_tenant_views()
+        self._column_cache.clear()
+        self.reset_graph_index()
         
+        if persist:
+            self._persist_to_disk(name)
         
+        
+    def ensure_state_tables(self):
+        for table, schema in STATE_TABLES.items():
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({schema})")
+
+
+    @property
+    def snapshot(self):
+        # One snapshot per collection run, created by the first stored table
+        if self._snapshot is None:
+            self.ensure_state_tables()
+            self._snapshot = (self.latest_snapshot() or 0) + 1
+            self.db.execute(
+                "INSERT INTO snapshots VALUES (?, ?)", 
+                [self._snapshot, datetime.now()]
+            )
+        return self._snapshot
+
+
+    def reset_snapshot(self):
+        # The next stored table opens a new snapshot (long-running processes)
+        self._snapshot = None
+
+
+    def latest_snapshot(self):
+        try:
+            row = self._connection().execute("SELECT max(snapshot) FROM snapshots").fetchone()
+            return row[0] if row else None
+        except duckdb.CatalogException:
+            return None
+
+
+    def _record_changes(self, name, relation, persist=True):
+        if name not in SP_KEY_COLUMNS:
+            return
+        snapshot = self.snapshot
+
+        if name in self.tables:
+            try:
+                self.db.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE _changed AS
+                    (SELECT * FROM {name} EXCEPT SELECT * FROM {relation})
+                    UNION ALL
+                    (SELECT * FROM {relation} EXCEPT SELECT * FROM {name})
+                """)
+            except duckdb.Error as e:
+                # Schema changed between collections; treat every row as changed
+                self._logger.info(f"[*] Could not diff {name} ({str(e)}), marking all rows changed")
+                self.db.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE _changed AS
+                    SELECT * FROM {name} UNION ALL BY NAME SELECT * FROM {relation}
+                """)
+        else:
+            self.db.execute(f"CREATE OR REPLACE TEMP TABLE _changed AS SELECT * FROM {relation}")
+
+        columns = {row[0] for row in self.db.execute(f"DESCRIBE {relation}").fetchall()}
+        selects = [
+            f"SELECT CAST(\"{col}\" AS VARCHAR) AS sp_id FROM _changed WHERE \"{col}\" IS NOT NULL"
+            for col in SP_KEY_COLUMNS[name] if col in columns
+        ]
+        if name == 'applications' and 'service_principals' in self.tables:
+            selects.append(
+                "SELECT sp.id AS sp_id FROM service_principals sp "
+                "JOIN _changed c ON lower(sp.appId) = lower(c.appId)"
+            )
+        if selects:
+            self.db.execute(f"""
+                INSERT INTO sp_changes 
+                SELECT DISTINCT {snapshot}, '{name}', sp_id 
+                FROM ({" UNION ".join(selects)})
+            """)
+        self.db.execute("DROP TABLE IF EXISTS _changed")
+
+        if persist:
+            self._persist_to_disk('snapshots')
+            self._persist_to_disk('sp_changes')
+
+
     def _persist_to_disk(self, table_name):
+        if self.federated:
+            raise GraphException(f"Tenant databases are attached read-only, cannot save {table_name}")
+        if self._staging is not None:
+            # Written once, with every other staged table, when published
+            self._staged.add(table_name)
+            return
         try:
             
             self._logger.info(f"[*] Attaching {table_name}")
-            self.db.execute(f"ATTACH DATABASE '{self._db_path}' AS disk_db")
+            self._attach(self._db_path, 'disk_db')
 
             # Replace the table on disk with the in-memory version
             self.db.execute(f"CREATE OR REPLACE TABLE disk_db.{table_name} AS SELECT * FROM {table_name}")
+            if table_name == ASSIGNMENT_TABLE:
+                # Superseded per-direction tables of an older collection
+                for view in ASSIGNMENT_VIEWS:
+                    self.db.execute(f"DROP TABLE IF EXISTS disk_db.{view}")
 
              # Detach the disk database
             self.db.execute("DETACH DATABASE disk_db")
@@ -146,9 +701,215 @@ class GraphData():
             raise GraphException(f"Error saving table {table_name} to disk: {self.db_path} Error: {str(e)}") from e
 
     
+    @contextmanager
+    def staging(self):
+        # Tables persisted inside the block are collected into a new
+        # database file next to db_path, which then replaces db_path in one
+        # atomic rename. Processes opening db_path meanwhile load the
+        # previous database and never see a partly written collection. If
+        # the block fails, db_path is left as it was and the in-memory tables
+        # are reloaded from it, so a retry sees the same changes again. If
+        # only the publish fails, the staging file is kept: it holds the
+        # complete collection and can be moved over db_path by hand.
+        if self.federated:
+            raise GraphException("Tenant databases are attached read-only, cannot collect into them")
+        if self._staging is not None or self._db_path == ':memory:':
+            yield
+            return
+        path = f"{self._db_path}.{os.getpid()}.staging"
+        self._remove_files(path, f"{path}.wal", f"{path}.sqlite")
+        self._staging = path
+        keep = False
+        try:
+            yield
+            written = self._write_staging(path)
+            keep = True
+            self._publish(path, written)
+            keep = False
+        except BaseException:
+            self._staging = None
+            self._rollback()
+            raise
+        finally:
+            self._staging = None
+            self._staged  = set()
+            if keep:
+                self._remove_files(f"{path}.wal")
+            else:
+                self._remove_files(path, f"{path}.wal", f"{path}.sqlite")
+
+
+    def _rollback(self):
+        # Reload after a failed collection. A reload that fails as well
+        # leaves the in-memory tables as they were and must not hide the
+        # error of the collection.
+        try:
+            self._reload()
+        except Exception as e:
+            self._logger.error(f"[-] Could not reload {self._db_path} after a failed collection: {str(e)}")
+
+
+    def _reload(self):
+        # Back to the database as last published. The current tables are
+        # set aside and only dropped once the published ones are loaded.
+        current = [
+            row[0] for row in self.db.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE database_name = 'memory' "
+                "AND schema_name = 'main' AND NOT temporary"
+            ).fetchall()
+        ]
+        state = (self.tables, self._snapshot)
+        for view in ASSIGNMENT_VIEWS:
+            self.db.execute(f"DROP VIEW IF EXISTS {view}")
+        for table in current:
+            self.db.execute(f"ALTER TABLE {table} RENAME TO _previous_{table}")
+        self.tables = {}
+        self._snapshot = None
+        self._column_cache.clear()
+        self.reset_graph_index()
+        try:
+            self._load_from_disk(self._db_path)
+        except BaseException:
+            self.db.execute("DETACH DATABASE IF EXISTS disk_db")
+            for (table,) in self.db.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE database_name = 'memory' "
+                "AND schema_name = 'main' AND NOT temporary AND NOT starts_with(table_name, '_previous_')"
+            ).fetchall():
+                self.db.execute(f"DROP TABLE {table}")
+            for table in current:
+                self.db.execute(f"ALTER TABLE _previous_{table} RENAME TO {table}")
+            self.tables, self._snapshot = state
+            self._create_assignment_views()
+            raise
+        for table in current:
+            self.db.execute(f"DROP TABLE _previous_{table}")
+        self.db.execute(f"DROP SCHEMA {TENANT_VIEWS} CASCADE")
+        self.db.execute(f"CREATE SCHEMA {TENANT_VIEWS}")
+        self._create_tenant_views()
+
+
+    def _attach(self, path, alias, read_only=False):
+        delay = LOCK_BACKOFF
+        for attempt in range(LOCK_RETRIES):
+            try:
+                self.db.execute(f"ATTACH DATABASE '{path}' AS {alias}{' (READ_ONLY)' if read_only else ''}")
+                return
+            except duckdb.IOException as e:
+                if "lock" not in str(e) or attempt == LOCK_RETRIES - 1:
+                    raise
+                self._logger.info(f"[*] {path} is locked by another process, retrying in {delay}s")
+                time.sleep(delay)
+                delay *= 2
+
+
+    def _write_staging(self, path):
+        # The complete collection from memory: the staged tables and every
+        # other table as loaded. Needs no access to db_path.
+        persistent = set(TABLES) | set(STATE_TABLES)
+        in_memory = {
+            row[0] for row in self.db.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE database_name = 'memory' "
+                "AND schema_name = 'main' AND NOT temporary"
+            ).fetchall()
+        } & persistent
+        written = in_memory | self._staged
+        try:
+            self.db.execute(f"ATTACH DATABASE '{path}' AS staging_db")
+            try:
+                for table in written:
+                    self.db.execute(f"CREATE TABLE staging_db.{table} AS SELECT * FROM {table}")
+                self.db.execute("CHECKPOINT staging_db")
+            finally:
+                self.db.execute("DETACH DATABASE staging_db")
+        except Exception as e:
+            raise GraphException(f"Error writing collection to {path}: {str(e)}") from e
+        return written
+
+
+    def _publish(self, path, written):
+        # Tables the collection did not store are taken from db_path as it
+        # is now, so findings persisted by a detection run during the
+        # collection are kept, then the staging file replaces db_path.
+        try:
+            carried = set()
+            if self._is_duckdb_file(self._db_path):
+                self.db.execute(f"ATTACH DATABASE '{path}' AS staging_db")
+                try:
+                    self._attach(self._db_path, 'live_db', read_only=True)
+                    try:
+                        stored = {
+                            row[0] for row in self.db.execute(
+                                "SELECT table_name FROM duckdb_tables() WHERE database_name = 'live_db'"
+                            ).fetchall()
+                        }
+                        # Per-direction assignment tables are superseded by the edge table
+                        for table in stored - self._staged - set(ASSIGNMENT_VIEWS):
+                            self.db.execute(
+                                f"CREATE OR REPLACE TABLE staging_db.{table} AS SELECT * FROM live_db.{table}"
+                            )
+                            carried.add(table)
+                    finally:
+                        self.db.execute("DETACH DATABASE live_db")
+                    self.db.execute("CHECKPOINT staging_db")
+                finally:
+                    self.db.execute("DETACH DATABASE staging_db")
+
+            self._fsync(path)
+            if Path(f"{path}.sqlite").exists():
+                os.replace(f"{path}.sqlite", f"{self._db_path}.sqlite")
+            os.replace(path, self._db_path)
+            self._fsync(Path(self._db_path).resolve().parent)
+            self._logger.info(f"[+] Published {len(written | carried)} tables to {self._db_path}")
+
+        except Exception as e:
+            raise GraphException(
+                f"Error publishing collection to {self._db_path}: {str(e)}. "
+                f"The collection is kept in {path}"
+            ) from e
+
+
+    def _sqlite_path(self):
+        # The sqlite export is staged with the database; it starts as a copy
+        # of the current export, so tables not collected again are kept
+        path = f"{self._db_path}.sqlite"
+        if self._staging is None:
+            return path
+        staged = f"{self._staging}.sqlite"
+        if not Path(staged).exists() and Path(path).exists():
+            shutil.copyfile(path, staged)
+        return staged
+
+
+    @staticmethod
+    def _is_duckdb_file(path):
+        if not Path(path).exists():
+            return False
+        with open(path, 'rb') as fp:
+            return b'DUCK' in fp.read(16)
+
+
+    @staticmethod
+    def _fsync(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    @staticmethod
+    def _remove_files(*paths):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
     def query(self, sql, output_format='dict'):
         try:
-            result = self.db.execute(sql)
+            self._count_statement()
+            result = self._connection().execute(sql)
             if result:
                 if output_format == 'df':
                     return result.fetchdf()
@@ -166,6 +927,7 @@ class GraphData():
             if "does not exist" in str(e):
                 self._logger.info(f"[-] Query returned empty result due to missing table")
                 if output_format == 'df':
+                    import pandas as pd
                     return pd.DataFrame()
                 elif output_format == 'list':
                     return []
@@ -173,9 +935,82 @@ class GraphData():
                     return {} if output_format == 'dict' else json.dumps([])
                 else:
                     return []
+
+
+    def statement_types(self, sql):
+        # Statement types of a SQL string, e.g. ['SELECT']; raises on parse errors
+        return [statement.type.name for statement in self._connection().extract_statements(sql)]
+
+
+    def disable_external_access(self):
+        # For long-running read-only use: SQL can no longer read or write
+        # files or attach databases. Cannot be undone for this connection.
+        self.db.execute("SET enable_external_access = false")
+
+
+    def explain(self, sql, analyze=False, tenant_views=True):
+        # Raises on invalid SQL; used to validate detection queries at load time
+        prefix = "EXPLAIN ANALYZE" if analyze else "EXPLAIN"
+        cursor = self._sql_cursor(tenant_views)
+        try:
+            rows = cursor.execute(f"{prefix} {sql}").fetchall()
+        finally:
+            cursor.close()
+        return "\n".join(str(row[-1]) for row in rows)
+
+
+    def query_columns(self, sql, tenant_views=True):
+        # Result column names of a query, without running it
+        cursor = self._sql_cursor(tenant_views)
+        try:
+            return [row[0] for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+        finally:
+            cursor.close()
+
+
+    def query_stream(self, sql, output_format='dict', batch_size=None, tenant_views=False):
+        batch_size = batch_size or self._batch_size
+        # Own cursor so queries issued while consuming the stream do not
+        # invalidate the pending result
+        cursor = self._sql_cursor(tenant_views)
+        try:
+            self._count_statement()
+            result = cursor.execute(sql)
+            if not result:
+                return
+            if output_format == 'arrow':
+                # Requires pyarrow
+                reader = result.fetch_record_batch(batch_size)
+                for batch in reader:
+                    yield batch
+                return
+
+            if output_format not in ('list', 'dict'):
+                raise GraphException(f"Unsupported output_format: {output_format}")
+
+            col_names = [desc[0] for desc in result.description]
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                if output_format == 'dict':
+                    yield [dict(zip(col_names, row)) for row in rows]
+                else:
+                    yield rows
+        except GraphException:
+            raise
+        except Exception as e:
+            # XXX Handle missing tables. Need to fix with proper schema. 
+            if "does not exist" in str(e):
+                self._logger.info(f"[-] Query returned empty result due to missing table")
+                return
+            raise GraphException(f"GraphData: Error streaming query: {str(e)}") from e
+        finally:
+            cursor.close()
    
                 
-    def _convert_to_json_string(self, value):
+    @staticmethod
+    def _convert_to_json_string(value):
         if isinstance(value, (list, dict)):
             try:
                 return json.dumps(value)
@@ -184,7 +1019,17 @@ class GraphData():
         return value            
 
 
+    def _count_statement(self):
+        if self.profiler:
+            self.profiler.count_statement()
+
+
     def _jaysonify_embedded_strings(self, obj):
+        with profile_phase(self.profiler, 'decode'):
+            return self._decode_embedded_strings(obj)
+
+
+    def _decode_embedded_strings(self, obj):
         if isinstance(obj, dict):
             for key, value in obj.items():
                 if isinstance(value, str):
@@ -202,96 +1047,207 @@ class GraphData():
         return obj
                     
 
-    def get_sp_by_id(self, sp_id_list):
+    def get_sp_by_id(self, sp_id_list, projection=None):
+        return list(self.iter_sp_by_id(sp_id_list, projection=projection))
+
+
+    def iter_sp_by_id(self, sp_id_list, batch_size=None, projection=None):
+        # sp_id_list holds (tenant, sp_id) keys or bare ids. projection
+        # (RenderPlan.projection) limits enrichment to the fields a detection
+        # renders; None returns the full objects
+        if not sp_id_list:
+            return
         try:
-            id_list = ",".join(f"'{id}'" for id in sp_id_list)
-            sp_list = self.query(f"SELECT * FROM service_principals WHERE id IN ({id_list})")
-            if not sp_list:
+            found = False
+            columns = self._select_list('service_principals', projection, '', ('id', 'displayName'))
+            for sp_list in self.query_stream(
+                f"SELECT {', '.join(columns)} FROM service_principals sp "
+                f"WHERE {self._sp_key_filter(sp_id_list)}",
+                batch_size=batch_size
+            ):
+                for sp in sp_list:
+                    found = True
+                    if not sp["id"]:
+                        self._logger.warning("[-] ServicePrincipal is missing id property")
+                        continue
+                    yield self._enrich_sp(sp, projection)
+
+            if not found:
                 self._logger.warning("[-] No entries found in service_principals")
-                return []
 
-            for sp in sp_list:
-                sp_id = sp["id"]
-                if not sp_id:
-                    self._logger.warning("[-] ServicePrincipal is missing id property")
-                    continue
+        except Exception as e:
+            raise GraphException(f"GrapData: Error running query: {str(e)}") from e
 
-                # Fetch import role assignments
-                import_ra = self.query(
-                    f"""
-                        SELECT a.*, COALESCE(r.value, 'No matching role') AS scope
-                            FROM (
-                                SELECT * FROM app_role_assigned_to WHERE principalId IN ('{sp_id}')
-                            ) a
-                            LEFT JOIN app_roles r ON lower(a.appRoleId) = lower(r.id) AND r.service_principal_id = a.resourceId
-                     """)
-                import_ra = self._jaysonify_embedded_strings(import_ra)
-
-                # Fetch export role assignments
-                export_ra = self.query(
-                    f"""
-                        SELECT a.*, COALESCE(r.value, 'No matching role') AS scope
-                        FROM (
-                            SELECT * FROM app_role_assignments WHERE resourceId IN ('{sp_id}')
-                            UNION
-                            SELECT * FROM app_role_assigned_to WHERE resourceId IN ('{sp_id}')
-                        ) a
-                        LEFT JOIN app_roles r ON a.appRoleId = r.id
-                    """)
-                export_ra = self._jaysonify_embedded_strings(export_ra)
-
-                # OAuth2 grants
-                oauth_grants = self.query(
-                    f"""
-                        SELECT g.*, COALESCE(sp.displayName, 'No matching resource') AS resourceDisplayName
-                        FROM sp_oauth_grants g
-                        LEFT JOIN service_principals sp ON lower(g.resourceId) = lower(sp.id)
-                        WHERE g.service_principal_id IN ('{sp_id}')
-                    """)
-                oauth_grants = self._jaysonify_embedded_strings(oauth_grants)
-
-                # Application
-                app = self.query(f"""
-                    SELECT a.*, sp.id AS service_principal_id
-                    FROM applications a
-                    INNER JOIN service_principals sp ON lower(sp.appId) = lower(a.appId)
-                    WHERE sp.id IN ('{sp_id}')
-                """)
 
-                app = app[0] if app else app
-                if app:
-                    app = self._jaysonify_embedded_strings(app)
-                    self._app_resource_access_enrich(app)
+    def _columns(self, table):
+        columns = self._column_cache.get(table)
+        if columns is None:
+            rows = self._connection().execute(f"DESCRIBE {table}").fetchall()
+            columns = self._column_cache[table] = [row[0] for row in rows]
+        return columns
 
-                # Directory Roles
-                directory_roles = self.query(f"""
-                    SELECT *
-                    FROM sp_member_of
-                    WHERE service_principal_id = '{sp_id}'
-                """)
-                directory_roles = self._jaysonify_embedded_strings(directory_roles)
 
-                sp['appRoleImports'] = import_ra
-                sp['appRoleExports'] = export_ra
-                sp['oauth2PermissionGrants'] = oauth_grants
-                sp['application'] = app
-                sp['member_of'] = directory_roles
-                sp = self._jaysonify_embedded_strings(sp)
+    def _select_list(self, table, projection, level, keep=(), alias=None):
+        # Columns of table for one projection level, always including keep
+        # and the tenant of federated data
+        prefix = f"{alias}." if alias else ""
+        fields = None if projection is None else projection.get(level)
+        if fields is None:
+            return [f"{prefix}*"]
+        wanted = set(fields) | set(keep) | {'tenant'}
+        return [
+            prefix + '"' + column.replace('"', '""') + '"'
+            for column in self._columns(table) if column in wanted
+        ]
+
+
+    def table_names(self):
+        rows = self._connection().execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_catalog = current_database()"
+        ).fetchall()
+        return {row[0] for row in rows}
+
+
+    def iter_sp_summary(self, sp_id_list, batch_size=None):
+        # One compact row per SP with the key risk fields, computed in a single
+        # statement instead of the per-SP enrichment queries
+        if not sp_id_list:
+            return
+        tables  = self.table_names()
+        columns = [
+            "sp.id", "sp.displayName", "sp.servicePrincipalType", "sp.accountEnabled",
+            "COALESCE(json_array_length(sp.passwordCredentials), 0)"
+            " + COALESCE(json_array_length(sp.keyCredentials), 0) AS spCredentials"
+        ]
+        joins = []
+        if 'applications' in tables:
+            columns.append(
+                "COALESCE(json_array_length(a.passwordCredentials), 0)"
+                " + COALESCE(json_array_length(a.keyCredentials), 0) AS appCredentials"
+            )
+            joins.append(
+                "LEFT JOIN applications a ON lower(sp.appId) = lower(a.appId)" + self.same_tenant('sp', 'a')
+            )
+        if ASSIGNMENT_TABLE in tables:
+            columns.append(
+                f"(SELECT count(*) FROM {ASSIGNMENT_TABLE} r WHERE r.principalId = sp.id"
+                f"{self.same_tenant('r', 'sp')}) AS appRoles"
+            )
+        if 'sp_member_of' in tables:
+            columns.append(
+                "(SELECT count(*) FROM sp_member_of m WHERE m.service_principal_id = sp.id"
+                f"{self.same_tenant('m', 'sp')}"
+                " AND m.\"@odata.type\" = '#microsoft.graph.directoryRole') AS directoryRoles"
+            )
+        if self.federated:
+            columns.insert(0, "sp.tenant")
+        sql = (
+            f"SELECT {', '.join(columns)} FROM service_principals sp {' '.join(joins)} "
+            f"WHERE {self._sp_key_filter(sp_id_list)} ORDER BY sp.displayName, sp.id"
+        )
+        for rows in self.query_stream(sql, batch_size=batch_size):
+            yield from rows
+
+
+    def _enrich_sp(self, sp, projection=None):
+        sp_id = sp["id"]
+        root = None if projection is None else projection.get('')
+        wanted = [name for name in SP_ENRICHMENTS if root is None or name in root]
+        # Federated SP ids can repeat across tenants, e.g. two snapshots of
+        # one tenant; related rows are taken from the SP's own tenant
+        tenant = ""
+        if self.federated:
+            tenant = " AND a.tenant = '" + str(sp.get('tenant')).replace("'", "''") + "'"
+
+        def columns(table, name):
+            return ", ".join(self._select_list(table, projection, name, ('id',), alias='a'))
+
+        if 'appRoleImports' in wanted:
+            sp['appRoleImports'] = self._sp_app_role_imports(sp_id, columns('app_role_assigned_to', 'appRoleImports'), tenant)
+        if 'appRoleExports' in wanted:
+            sp['appRoleExports'] = self._sp_app_role_exports(sp_id, columns('app_role_assigned_to', 'appRoleExports'), tenant)
+        if 'oauth2PermissionGrants' in wanted:
+            sp['oauth2PermissionGrants'] = self._sp_oauth_grants(sp_id, columns('sp_oauth_grants', 'oauth2PermissionGrants'), tenant)
+        if 'application' in wanted:
+            sp['application'] = self._sp_application(sp_id, columns('applications', 'application'), tenant)
+        if 'member_of' in wanted:
+            sp['member_of'] = self._sp_member_of(sp_id, columns('sp_member_of', 'member_of'), tenant)
+        sp = self._jaysonify_embedded_strings(sp)
+        return sp
+
+
+    def _sp_app_role_imports(self, sp_id, columns, tenant=""):
+        import_ra = self.query(
+            f"""
+                SELECT {columns}, COALESCE(r.value, 'No matching role') AS scope
+                    FROM (
+                        SELECT * FROM app_role_assigned_to a WHERE principalId IN ('{sp_id}'){tenant}
+                    ) a
+                    LEFT JOIN app_roles r ON lower(a.appRoleId) = lower(r.id) AND r.service_principal_id = a.resourceId{self.same_tenant('a', 'r')}
+             """)
+        return self._jaysonify_embedded_strings(import_ra)
+
+
+    def _sp_app_role_exports(self, sp_id, columns, tenant=""):
+        export_ra = self.query(
+            f"""
+                SELECT {columns}, COALESCE(r.value, 'No matching role') AS scope
+                FROM (
+                    SELECT * FROM app_role_assigned_to a WHERE resourceId IN ('{sp_id}'){tenant}
+                ) a
+                LEFT JOIN app_roles r ON a.appRoleId = r.id{self.same_tenant('a', 'r')}
+            """)
+        return self._jaysonify_embedded_strings(export_ra)
+
+
+    def _sp_oauth_grants(self, sp_id, columns, tenant=""):
+        oauth_grants = self.query(
+            f"""
+                SELECT {columns}, COALESCE(sp.displayName, 'No matching resource') AS resourceDisplayName
+                FROM sp_oauth_grants a
+                LEFT JOIN service_principals sp ON lower(a.resourceId) = lower(sp.id){self.same_tenant('a', 'sp')}
+                WHERE a.service_principal_id IN ('{sp_id}'){tenant}
+            """)
+        return self._jaysonify_embedded_strings(oauth_grants)
+
+
+    def _sp_application(self, sp_id, columns, tenant=""):
+        app = self.query(f"""
+            SELECT {columns}, sp.id AS service_principal_id
+            FROM applications a
+            INNER JOIN service_principals sp ON lower(sp.appId) = lower(a.appId){self.same_tenant('sp', 'a')}
+            WHERE sp.id IN ('{sp_id}'){tenant}
+        """)
+
+        app = app[0] if app else app
+        if app:
+            app = self._jaysonify_embedded_strings(app)
+            self._app_resource_access_enrich(app)
+        return app
+
+
+    def _sp_member_of(self, sp_id, columns, tenant=""):
+        directory_roles = self.query(f"""
+            SELECT {columns}
+            FROM sp_member_of a
+            WHERE a.service_principal_id = '{sp_id}'{tenant}
+        """)
+        return self._jaysonify_embedded_strings(directory_roles)
 
-            return sp_list
-        
-        except Exception as e:
-            raise GraphException(f"GrapData: Error running query: {str(e)}") from e
-        
 
     def _app_resource_access_enrich(self, app):
         try:
             if not isinstance(app, dict) or app == {}:
                 self._logger.error(f"[-] Invalid Application: {app}")
                 return
-            relation = self.tables.get('service_principals')
-            if not relation:
+            if 'service_principals' not in self.tables:
                 raise GraphException(f"Could not find im memory service_principals")
+            relation = self._connection().table('service_principals')
+            relation_approle = self._connection().table('app_roles')
+            if self.federated:
+                tenant = str(app.get('tenant')).replace("'", "''")
+                relation = relation.filter(f"tenant = '{tenant}'")
+                relation_approle = relation_approle.filter(f"tenant = '{tenant}'")
             rra_list = app.get("requiredResourceAccess")
             if not rra_list:
                 return
@@ -299,13 +1255,14 @@ class GraphData():
             for rra in rra_list:
                 resource_app_id = (rra.get("resourceAppId") or "").lower().strip()
                 if resource_app_id:
+                    self._count_statement()
                     rows = relation.filter(f"appId = '{resource_app_id}'").project("displayName").fetchall()
                     rra["resourceDisplayName"] = next((row[0] for row in rows if row), None)
 
-                    relation_approle = self.tables.get('app_roles')
                     for ra in rra.get("resourceAccess"):
                         if ra.get("type") == "Role":
                             role_id = (ra.get("id")).lower().strip()
+                            self._count_statement()
                             rows = relation_approle.filter(f"id = '{role_id}'").project("value", "description").fetchall()
                             if rows:
                                 value, description = rows[0]
@@ -316,6 +1273,26 @@ class GraphData():
                                 
 
     def kiota_to_json(self, kiota_obj):
+        result = self.kiota_to_dict(kiota_obj)
+        if isinstance(result, dict):
+            return self.json_row(result)
+        return result
+
+
+    @staticmethod
+    def json_row(obj):
+        # Table row of a Graph object as returned by kiota_to_dict: nested
+        # lists and objects are stored as JSON strings
+        return {key: GraphData._convert_to_json_string(value) for key, value in obj.items()}
+
+
+    def kiota_to_dict(self, kiota_obj):
+        # Graph JSON of a kiota model, before it is flattened into a row.
+        # This is what the response archive stores.
+        from kiota_serialization_json.json_serialization_writer_factory import JsonSerializationWriterFactory
+        from kiota_abstractions.serialization import Parsable
+        from kiota_abstractions.store import InMemoryBackingStore
+
         result = {}
         if kiota_obj is None:
             return result
@@ -349,9 +1326,6 @@ class GraphData():
                 self._logger.error(f"[-] Error serializing InMemoryBackingStore: {e}")
                 return result
 
-        for key, value in result.items():
-            result[key] = self._convert_to_json_string(value)
-
         return result
     
     
@@ -1,13 +1,22 @@
 import json
+import duckdb
 import hashlib
 import logging
-from pathlib import Path
+from .config import ConfigOptions
 from .log import log_init
 
+
+# String forms of an empty value; treated as NULL when comparing
+EMPTY_VALUES = ('', '[]', '{}', 'null', 'None')
+# Column suffix for the previous value of a compared field in diff results
+PREVIOUS_SUFFIX = "_previous"
+
 class GraphException(Exception):
     def __init__(self, message, *args, **kwargs):
         logger = logging.getLogger(__name__)
-        logger.error("%s", message, exc_info=True)
+        # Logged at the raise site; the traceback is rendered by the log
+        # listener thread, and repeated failures are rate-limited
+        logger.error("%s", message, exc_info=True, stacklevel=2)
         super().__init__(message, *args, **kwargs)
 
 
@@ -31,38 +40,46 @@ class GraphDiff():
     def _write_result(self, name, fp):
         try:
             results = self._hash_results[name]
-        
+            spec    = self._hash_registry[name]
+
             fp.write(f"Type: {name}\n")
-            result = results['mod']
-            self._format_creds(fp, "Modified SPs with Client Credentials", result)
-       
-            result = results['new']
-            self._format_creds(fp, "New SPs with Client Credentials     ", result)
+            self._format_changes(fp, f"Modified {name}", results['mod'], spec)
+            self._format_changes(fp, f"New {name}     ", results['new'], spec)
+            self._format_changes(fp, f"Removed {name} ", results['del'], spec)
 
         except Exception as e:
             raise GraphException(f"[-] Error logging result: {e}")
            
 
-    def _format_creds(self, fp, title, result):
+    def _format_changes(self, fp, title, result, spec):
+        import pandas as pd
         fp.write(f"==========[ {title} ]==========\n")
         for _, row in result.iterrows():
-            fp.write(f"\tID: {row['id']}, Name: {row['displayName']}\n")
-            
-            key_cred = row.get('keyCredentials')
-            if key_cred and key_cred not in ['[]', '{}', 'null', 'None'] and len(str(key_cred).strip()) > 2:
-                fp.write("\t\t[Key Credentials]\n")
-                self._format_creds_array(fp, key_cred)
-            
-            pwd_cred = row.get('passwordCredentials')
-            if pwd_cred and pwd_cred not in ['[]', '{}', 'null', 'None'] and len(str(pwd_cred).strip()) > 2:
-                fp.write("\t\t[Password Credentials]\n")
-                self._format_creds_array(fp, pwd_cred)
+            key = ", ".join(str(row[col]) for col in spec['key'])
+            fp.write(f"\tID: {key}, Name: {row['label']}\n")
+
+            changed = list(row['changed_fields'])
+            if row['change'] == 'mod':
+                fp.write(f"\t\tChanged fields: {', '.join(changed)}\n")
+            for field in changed:
+                if row['change'] != 'del' and not pd.isna(row[field]):
+                    fp.write(f"\t\t[{field}]\n")
+                    self._format_creds_array(fp, row[field])
+                previous = row[f"{field}{PREVIOUS_SUFFIX}"]
+                if row['change'] != 'new' and not pd.isna(previous):
+                    fp.write(f"\t\t[{field} (previous)]\n")
+                    self._format_creds_array(fp, previous)
         fp.write('\n')
 
 
     def _format_creds_array(self, fp, cred_string):
         try:
-            creds = json.loads(cred_string) if isinstance(cred_string, str) else cred_string
+            try:
+                creds = json.loads(cred_string) if isinstance(cred_string, str) else cred_string
+            except json.JSONDecodeError:
+                # Plain column value
+                fp.write(f"\t\t\t{cred_string}\n")
+                return
             
             if not isinstance(creds, list):
                 fp.write(f"\t\t\t{creds}\n")
@@ -85,88 +102,214 @@ class GraphDiff():
             fp.write(f"\t\t\t{cred_string}\n")
 
         
-    def make_hash(self, name, fields):
-        self._hash_registry[name] = self._hash_fields(fields)
+    def load_config(self, config_path):
+        # Tables to compare, see config/diff_config.yaml
+        config = ConfigOptions(config_path).values or {}
+        for name, table in config.items():
+            table = table or {}
+            self.make_hash(name, table.get('fields'), table.get('key'), table.get('label'))
+
+
+    def make_hash(self, name, fields=None, key=None, label='displayName'):
+        # fields=None compares every column except the key
+        self._hash_registry[name] = {
+            'key': list(key or ['id']),
+            'fields': list(fields) if fields else None,
+            'label': label
+        }
         self._fields[name] = fields
 
 
-    def _hash_fields(self, fields):
+    @property
+    def tables(self):
+        return list(self._hash_registry)
+
+
+    def key_columns(self, name):
+        return list(self._hash_registry[name]['key'])
+
+
+    def reset(self):
+        # Forget previous results; a long-running process diffs many times
+        self._hash_results = {}
+
+
+    def _columns(self, con, relation):
+        return [row[0] for row in con.execute(f'DESCRIBE SELECT * FROM {relation}').fetchall()]
+
+
+    def _row_key(self, keys):
+        return "concat_ws(chr(31), " + ", ".join(f'CAST("{key}" AS VARCHAR)' for key in keys) + ")"
+
+
+    def _side(self, relation, columns, spec, fields):
+        def value(col):
+            if col not in columns:
+                return "NULL::VARCHAR"
+            # Empty values count as absent, like an SP without credentials
+            return (
+                f'CASE WHEN CAST("{col}" AS VARCHAR) IN {EMPTY_VALUES} '
+                f'THEN NULL ELSE CAST("{col}" AS VARCHAR) END'
+            )
+
+        exprs = [f'CAST("{key}" AS VARCHAR) AS k{i}' for i, key in enumerate(spec['key'])]
+        exprs += [f"{value(field)} AS f{i}" for i, field in enumerate(fields)]
+        label = spec['label']
+        exprs.append(f'CAST("{label}" AS VARCHAR) AS _label' if label in columns else "NULL::VARCHAR AS _label")
+        exprs.append("TRUE AS _present")
+        select = f"SELECT {', '.join(exprs)} FROM {relation}"
+        row_key = ", ".join(f"k{i}" for i in range(len(spec['key'])))
+        # Vectorized row hash over the normalized fields
+        hashed = ", ".join(f"f{i}" for i in range(len(fields)))
+        return f"SELECT *, concat_ws(chr(31), {row_key}) AS row_key, hash({hashed}) AS _hash FROM ({select})"
+
+
+    def _field_set(self, name, spec, fields):
+        # Identifies what a stored fingerprint was computed over. DuckDB's
+        # hash() is not stable across versions, so fingerprints saved by
+        # another version are ignored and the stored table is compared.
+        data = json.dumps([name, spec['key'], fields, duckdb.__version__])
+        return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+    def _diff(self, con, name, old_relation, new_relation, fingerprints=None):
+        spec = self._hash_registry.get(name)
+        if not spec:
+            self._logger.error(f"[-] No hash function registered for {name}")
+            return {}
+
+        old_columns = self._columns(con, old_relation) if old_relation else []
+        new_columns = self._columns(con, new_relation)
+        keys = spec['key']
+        missing = [key for key in keys if key not in new_columns or (old_relation and key not in old_columns)]
+        if missing:
+            self._logger.error(f"[-] Key columns {missing} missing from {name}")
+            return {}
+
+        fields = spec['fields']
+        if fields is None:
+            fields = [col for col in old_columns if col not in keys]
+            fields += [col for col in new_columns if col not in keys and col not in fields]
+        if not fields:
+            return {}
+        field_set = self._field_set(name, spec, fields)
+
+        # New rows are hashed once, for the diff and as the next fingerprints
+        con.execute(f"CREATE OR REPLACE TEMP TABLE _diff_new AS {self._side(new_relation, new_columns, spec, fields)}")
         try:
-            is_obj_value = self._is_obj_value
-            return lambda obj: (
-                None if not any(f in obj and is_obj_value(obj.get(f)) for f in fields) else
-                hashlib.sha1(
-                    json.dumps(
-                        {f: obj.get(f) for f in fields if f in obj and is_obj_value(obj.get(f))},
-                        sort_keys=True
-                    ).encode()
-                ).hexdigest()
+            result = {}
+            if old_relation:
+                result = self._compare(con, name, old_relation, old_columns, spec, fields, field_set, fingerprints)
+            if fingerprints:
+                con.execute(f"DELETE FROM {fingerprints} WHERE table_name = ?", [name])
+                con.execute(
+                    f"INSERT INTO {fingerprints} SELECT ?, ?, row_key, _hash FROM _diff_new",
+                    [name, field_set]
+                )
+        finally:
+            con.execute("DROP TABLE IF EXISTS _diff_new")
+        return result
+
+
+    def _compare(self, con, name, old_relation, old_columns, spec, fields, field_set, fingerprints=None):
+        def quote(text):
+            return text.replace("'", "''")
+
+        stored = 0
+        if fingerprints:
+            stored = con.execute(
+                f"SELECT count(*) FROM {fingerprints} WHERE table_name = ? AND field_set = ?",
+                [name, field_set]
+            ).fetchone()[0]
+        if stored:
+            # Fingerprints saved when the previous collection was stored
+            old_hashes = (
+                f"SELECT row_key, fingerprint AS _hash FROM {fingerprints} "
+                f"WHERE table_name = '{quote(name)}' AND field_set = '{field_set}'"
             )
-        except Exception as e:
-            raise GraphException(f"[-] Error logging result: {e}")            
-
-
-    def _is_obj_value(self, value):
-        if value is None:
-            return False
-        if isinstance(value, str):
-            if len(value) == 0 or value in ['[]', '{}', 'null', 'None']:
-                return False
-        elif isinstance(value, (list, dict)) and len(value) == 0:
-            return False
-        return True
-        
-    
+        else:
+            old_hashes = f"SELECT row_key, _hash FROM ({self._side(old_relation, old_columns, spec, fields)})"
+        # Old rows are filtered on their key before any value is normalized
+        changed_old = (
+            f"(SELECT * FROM {old_relation} WHERE {self._row_key(spec['key'])} "
+            f"IN (SELECT row_key FROM changed))"
+        )
+
+        changed = ", ".join(
+            f"CASE WHEN o.f{i} IS DISTINCT FROM n.f{i} THEN '{quote(field)}' END"
+            for i, field in enumerate(fields)
+        )
+        any_new = " OR ".join(f"n.f{i} IS NOT NULL" for i in range(len(fields)))
+        columns = [f'COALESCE(n.k{i}, o.k{i}) AS "{key}"' for i, key in enumerate(spec['key'])]
+        columns.append('COALESCE(n._label, o._label) AS "label"')
+        columns.append(
+            "CASE WHEN o._present IS NULL THEN 'new' "
+            "WHEN n._present IS NULL THEN 'del' ELSE 'mod' END AS change"
+        )
+        columns.append(f"list_filter([{changed}], x -> x IS NOT NULL) AS changed_fields")
+        for i, field in enumerate(fields):
+            columns.append(f'n.f{i} AS "{field}"')
+            columns.append(f'o.f{i} AS "{field}{PREVIOUS_SUFFIX}"')
+
+        # Hashes decide which rows changed; only those rows of the old table
+        # are read back for field-level detail
+        sql = f"""
+            WITH h AS ({old_hashes}),
+            changed AS (
+                SELECT COALESCE(n.row_key, h.row_key) AS row_key
+                FROM _diff_new n FULL OUTER JOIN h ON n.row_key = h.row_key
+                WHERE (h.row_key IS NULL AND ({any_new}))
+                   OR n.row_key IS NULL
+                   OR n._hash <> h._hash
+            ),
+            o AS ({self._side(changed_old, old_columns, spec, fields)}),
+            n AS (SELECT * FROM _diff_new WHERE row_key IN (SELECT row_key FROM changed))
+            SELECT * FROM (
+                SELECT {", ".join(columns)}
+                FROM o FULL OUTER JOIN n ON o.row_key = n.row_key
+            )
+            -- A hash mismatch without a differing field is not a change
+            WHERE change <> 'mod' OR len(changed_fields) > 0
+        """
+        df = con.execute(sql).fetchdf()
+        result = {
+            change: df[df["change"] == change].reset_index(drop=True)
+            for change in ('new', 'del', 'mod')
+        }
+        self._hash_results[name] = result
+        return result
+
+
     def results(self, name):
         return self._hash_results[name]
-    
 
-    def compare(self, name, cache_df, df):
+
+    def compare_tables(self, con, name, old_table, new_table, fingerprints=None):
+        # Diff the stored table against the freshly collected rows inside
+        # DuckDB, before the table is replaced. With a fingerprints table the
+        # old side is read from the hashes saved at the previous ingest, and
+        # the new hashes are saved for the next one. old_table=None only
+        # saves fingerprints.
         try:
-            result = {}
+            return self._diff(con, name, old_table, new_table, fingerprints)
+        except Exception as e:
+            raise GraphException(f"[-] Error comparing {name}: {e}")
+
 
+    def compare(self, name, cache_df, df):
+        try:
             if cache_df.empty:
                 self._logger.error("[-] Empty table. First run?")
-                return {}  
-            
-            hash_func = self._hash_registry.get(name)
-            if not hash_func:
-                self._logger.error(f"[-] No hash function registered for {name}")
-                return {} 
+                return {}
 
-            df = df.copy()
-            df["hash"] = df.apply(hash_func, axis=1)
-
-            cache_df = cache_df.copy()
-            cache_df["hash"] = cache_df.apply(hash_func, axis=1)
-            
-            df = df.set_index("id")     
-            cache_df = cache_df.set_index("id")
-
-            # Find different types of changes
-            cmn_ids = df.index.intersection(cache_df.index)
-            new_ids = df.index.difference(cache_df.index)
-            new_ids_with_hash = new_ids[df.loc[new_ids]["hash"].notnull()]
-            del_ids = cache_df.index.difference(df.index)
-
-            # Compare only rows with common IDs for changes
-            if len(cmn_ids) > 0:
-                set1_df = df.loc[cmn_ids]
-                set2_df = cache_df.loc[cmn_ids]
-                diff_mask = (
-                                (set1_df["hash"] != set2_df["hash"]) & 
-                                (set1_df["hash"].notna()) & 
-                                (set2_df["hash"].notna())
-                            )
-                mod_ids = set1_df.index[diff_mask] 
-            else:
-                mod_ids = df.index[[]] 
-
-            result['new'] = df.loc[new_ids_with_hash].reset_index()
-            result['del'] = cache_df.loc[del_ids].reset_index()
-            result['mod'] = cache_df.loc[mod_ids].reset_index()
-            self._hash_results[name] = result
+            con = duckdb.connect(':memory:')
+            try:
+                con.register('_diff_old', cache_df)
+                con.register('_diff_df', df)
+                return self._diff(con, name, '_diff_old', '_diff_df')
+            finally:
+                con.close()
+        except GraphException:
+            raise
         except Exception as e:
-            raise GraphException(f"[-] Error logging result: {e}")            
-
-        return result 
\ No newline at end of file
+            raise GraphException(f"[-] Error comparing {name}: {e}")
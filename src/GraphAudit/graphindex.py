@@ -0,0 +1,318 @@
+import duckdb
+import threading
+import numpy as np
+from .log import log_init
+
+
+# Node types. TENANT is a single hub node standing for "every application".
+# OAUTH_SCOPE is a delegated permission of a resource SP, e.g. Mail.Read of
+# Microsoft Graph.
+SP, APP, APP_ROLE, DIRECTORY_ROLE, TENANT, OAUTH_SCOPE = range(6)
+NODE_TYPES = ('sp', 'app', 'app_role', 'directory_role', 'tenant', 'oauth_scope')
+
+# Edge types. An edge means "holding the source gives access to the target".
+# A delegated grant gives the client the granted scopes, not control of the
+# resource SP, so OAUTH_GRANT edges end at scope nodes.
+CREDENTIAL_OF, ASSIGNED, OAUTH_GRANT, MEMBER_OF, CONTROLS = range(5)
+EDGE_TYPES = ('credential_of', 'assigned', 'oauth_grant', 'member_of', 'controls')
+
+# Permissions that hand over every application (and with it every SP
+# credential). Modelled as CONTROLS edges through the tenant hub node, from
+# app roles and from delegated scopes of the same name.
+ESCALATION_APP_ROLES = (
+    'Application.ReadWrite.All',
+    'AppRoleAssignment.ReadWrite.All',
+    'RoleManagement.ReadWrite.Directory'
+)
+ESCALATION_DIRECTORY_ROLES = (
+    'Global Administrator',
+    'Privileged Role Administrator',
+    'Application Administrator',
+    'Cloud Application Administrator'
+)
+
+
+class GraphIndexError(Exception):
+    pass
+
+
+class GraphIndex():
+    # Attack-path graph over the collected tables, stored as integer-indexed
+    # CSR arrays in both directions. Node keys are "<type>:<id>", e.g.
+    # "sp:<id>", "app:<appId>", "app_role:<id>", "directory_role:<id>",
+    # "oauth_scope:<resource sp id>/<scope>". Targets can also be named:
+    # "app_role:<resource>/<value>", "resource:<resource>" (any role of the
+    # resource), "oauth_scope:<resource>/<scope>" and
+    # "directory_role:<displayName>".
+    def __init__(self, graph_data, escalation=True):
+        self._logger     = log_init(__name__)
+        self._graph_data = graph_data
+        self._escalation = escalation
+        self._keys       = []
+        self._node_ids   = {}
+        self._node_types = []
+        self._names      = {}
+        self._reverse_cache = {}
+        self._lock       = threading.Lock()
+        self._build()
+
+    @property
+    def node_count(self):
+        return len(self._keys)
+
+    @property
+    def edge_count(self):
+        return len(self._indices)
+
+    def _node(self, key, node_type):
+        idx = self._node_ids.get(key)
+        if idx is None:
+            idx = len(self._keys)
+            self._node_ids[key] = idx
+            self._keys.append(key)
+            self._node_types.append(node_type)
+        return idx
+
+    @staticmethod
+    def _scoped(key, tenant):
+        return key if tenant is None else f"{key}@{tenant.lower()}"
+
+    def _alias(self, name, idx):
+        self._names.setdefault(name.lower(), []).append(idx)
+
+    def _rows(self, sql):
+        try:
+            return self._cursor.execute(sql).fetchall()
+        except duckdb.CatalogException:
+            # Table not collected
+            return []
+
+    def _build(self):
+        # Dedicated cursor: the index may be built lazily from inside a graph_*
+        # SQL function while the calling query still holds its connection
+        self._cursor = self._graph_data.db.cursor()
+        try:
+            self._build_csr()
+        finally:
+            self._cursor.close()
+            self._cursor = None
+
+    def _build_csr(self):
+        src, dst, etype = [], [], []
+
+        def edge(a, b, t):
+            src.append(a)
+            dst.append(b)
+            etype.append(t)
+
+        # With federated tenant databases every node is scoped per tenant:
+        # app ids and app role ids repeat across tenants, and so do SP ids
+        # when two snapshots of one tenant are attached. "sp:<id>" stays
+        # usable as a name for the SP in every tenant.
+        tenant = "tenant" if getattr(self._graph_data, 'federated', False) else "NULL"
+
+        sp_by_app = {}
+        resource_names = {}
+        for scope, sp_id, app_id, name in self._rows(
+            f"SELECT {tenant}, lower(id), lower(appId), displayName FROM service_principals"
+        ):
+            idx = self._node(self._scoped(f"sp:{sp_id}", scope), SP)
+            if scope is not None:
+                self._alias(f"sp:{sp_id}", idx)
+            resource_names[(scope, sp_id)] = name
+            if app_id:
+                sp_by_app[(scope, app_id)] = idx
+
+        escalation_roles = []
+        for scope, role_id, sp_id, value in self._rows(
+            f"SELECT {tenant}, lower(id), lower(service_principal_id), value FROM app_roles"
+        ):
+            idx = self._node(self._scoped(f"app_role:{role_id}", scope), APP_ROLE)
+            resource = resource_names.get((scope, sp_id))
+            if resource:
+                self._alias(f"app_role:{resource}/{value}", idx)
+                self._alias(f"resource:{resource}", idx)
+            if value in ESCALATION_APP_ROLES:
+                escalation_roles.append((scope, idx))
+
+        app_nodes = []
+        for scope, app_id in self._rows(f"SELECT DISTINCT {tenant}, lower(appId) FROM applications"):
+            idx = self._node(self._scoped(f"app:{app_id}", scope), APP)
+            app_nodes.append((scope, idx))
+            if (scope, app_id) in sp_by_app:
+                edge(idx, sp_by_app[(scope, app_id)], CREDENTIAL_OF)
+
+        for scope, principal_id, role_id in self._rows(f"""
+            SELECT DISTINCT {tenant}, lower(principalId), lower(appRoleId)
+            FROM app_role_assignment_edges
+        """):
+            a = self._node_ids.get(self._scoped(f"sp:{principal_id}", scope))
+            b = self._node_ids.get(self._scoped(f"app_role:{role_id}", scope))
+            if a is not None and b is not None:
+                edge(a, b, ASSIGNED)
+
+        escalation_scopes = []
+        for scope, client_id, resource_id, permission in self._rows(f"""
+            SELECT DISTINCT {tenant}, lower(clientId), lower(resourceId),
+                unnest(string_split(trim(coalesce(scope, '')), ' '))
+            FROM sp_oauth_grants
+        """):
+            a = self._node_ids.get(self._scoped(f"sp:{client_id}", scope))
+            if a is None or not permission or (scope, resource_id) not in resource_names:
+                continue
+            key = self._scoped(f"oauth_scope:{resource_id}/{permission.lower()}", scope)
+            new = key not in self._node_ids
+            idx = self._node(key, OAUTH_SCOPE)
+            if new:
+                resource = resource_names[(scope, resource_id)]
+                if resource:
+                    self._alias(f"oauth_scope:{resource}/{permission}", idx)
+                if permission in ESCALATION_APP_ROLES:
+                    escalation_scopes.append((scope, idx))
+            edge(a, idx, OAUTH_GRANT)
+
+        escalation_dir_roles = []
+        for scope, sp_id, role_id, name in self._rows(f"""
+            SELECT DISTINCT {tenant}, lower(service_principal_id), lower(id), displayName
+            FROM sp_member_of
+            WHERE "@odata.type" = '#microsoft.graph.directoryRole'
+        """):
+            idx = self._node(self._scoped(f"directory_role:{role_id}", scope), DIRECTORY_ROLE)
+            if name:
+                self._alias(f"directory_role:{name}", idx)
+                if name in ESCALATION_DIRECTORY_ROLES and (scope, idx) not in escalation_dir_roles:
+                    escalation_dir_roles.append((scope, idx))
+            a = self._node_ids.get(self._scoped(f"sp:{sp_id}", scope))
+            if a is not None:
+                edge(a, idx, MEMBER_OF)
+
+        if self._escalation and app_nodes:
+            hubs = {}
+            for scope, app in app_nodes:
+                if scope not in hubs:
+                    hubs[scope] = self._node(self._scoped("tenant:applications", scope), TENANT)
+                edge(hubs[scope], app, CONTROLS)
+            for scope, role in escalation_roles + escalation_dir_roles + escalation_scopes:
+                if scope in hubs:
+                    edge(role, hubs[scope], CONTROLS)
+
+        n = len(self._keys)
+        self._types = np.asarray(self._node_types, dtype=np.int8)
+        src   = np.asarray(src, dtype=np.int32)
+        dst   = np.asarray(dst, dtype=np.int32)
+        etype = np.asarray(etype, dtype=np.int8)
+        self._indptr, self._indices, self._etypes = self._csr(src, dst, etype, n)
+        self._rindptr, self._rindices, self._retypes = self._csr(dst, src, etype, n)
+        self._logger.info(f"[+] Graph index: {n} nodes, {len(src)} edges")
+
+    def _csr(self, src, dst, etype, n):
+        order   = np.argsort(src, kind='stable')
+        counts  = np.bincount(src, minlength=n) if len(src) else np.zeros(n, dtype=np.int64)
+        indptr  = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return indptr, dst[order], etype[order]
+
+    def _edge_mask(self, edge_types):
+        if edge_types is None:
+            return None
+        mask = np.zeros(len(EDGE_TYPES), dtype=bool)
+        for name in edge_types:
+            if name not in EDGE_TYPES:
+                raise GraphIndexError(f"Unknown edge type: {name}")
+            mask[EDGE_TYPES.index(name)] = True
+        return mask
+
+    def resolve(self, key):
+        key = key.strip()
+        idx = self._node_ids.get(key.lower())
+        if idx is not None:
+            return [idx]
+        return list(self._names.get(key.lower(), []))
+
+    def key(self, idx):
+        return self._keys[idx]
+
+    def _expand(self, frontier, indptr, indices, etypes, mask):
+        starts  = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+        total   = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        # Positions of every neighbour of every frontier node, without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        parents = np.repeat(frontier, lengths)
+        neighbours = indices[offsets]
+        if mask is not None:
+            keep = mask[etypes[offsets]]
+            neighbours, parents = neighbours[keep], parents[keep]
+        return neighbours, parents
+
+    def _bfs(self, sources, max_depth=None, edge_types=None, reverse=False, parents=False):
+        if reverse:
+            indptr, indices, etypes = self._rindptr, self._rindices, self._retypes
+        else:
+            indptr, indices, etypes = self._indptr, self._indices, self._etypes
+        mask  = self._edge_mask(edge_types)
+        n     = len(self._keys)
+        depth = np.full(n, -1, dtype=np.int32)
+        parent = np.full(n, -1, dtype=np.int32) if parents else None
+
+        frontier = np.unique(np.asarray(sources, dtype=np.int32))
+        depth[frontier] = 0
+        level = 0
+        while len(frontier) and (max_depth is None or level < max_depth):
+            neighbours, from_nodes = self._expand(frontier, indptr, indices, etypes, mask)
+            fresh = depth[neighbours] < 0
+            neighbours, from_nodes = neighbours[fresh], from_nodes[fresh]
+            neighbours, first = np.unique(neighbours, return_index=True)
+            level += 1
+            depth[neighbours] = level
+            if parents:
+                parent[neighbours] = from_nodes[first]
+            frontier = neighbours
+        return depth, parent
+
+    def reachable(self, source, max_depth=None, edge_types=None):
+        depth, _ = self._bfs(self.resolve(source), max_depth, edge_types)
+        return [self._keys[idx] for idx in np.nonzero(depth > 0)[0]]
+
+    def reaching(self, target, max_depth=None, edge_types=None, node_type='sp'):
+        # Every node of node_type that can reach the target
+        depth, _ = self._bfs(self.resolve(target), max_depth, edge_types, reverse=True)
+        hits = (depth > 0)
+        if node_type:
+            hits &= self._types == NODE_TYPES.index(node_type)
+        return [self._keys[idx] for idx in np.nonzero(hits)[0]]
+
+    def distance_to(self, target, edge_types=None):
+        # Hop counts from every node to the target, cached per target
+        cache_key = (target.lower(), tuple(edge_types) if edge_types else None)
+        with self._lock:
+            depth = self._reverse_cache.get(cache_key)
+            if depth is None:
+                depth, _ = self._bfs(self.resolve(target), None, edge_types, reverse=True)
+                self._reverse_cache[cache_key] = depth
+        return depth
+
+    def can_reach(self, source, target, edge_types=None):
+        return self.distance(source, target, edge_types) is not None
+
+    def distance(self, source, target, edge_types=None):
+        depth = self.distance_to(target, edge_types)
+        hops = [int(depth[idx]) for idx in self.resolve(source) if depth[idx] >= 0]
+        return min(hops) if hops else None
+
+    def shortest_path(self, source, target, edge_types=None):
+        targets = set(self.resolve(target))
+        if not targets:
+            return None
+        depth, parent = self._bfs(self.resolve(source), None, edge_types, parents=True)
+        reached = [idx for idx in targets if depth[idx] >= 0]
+        if not reached:
+            return None
+        idx = min(reached, key=lambda i: depth[i])
+        path = [idx]
+        while parent[idx] >= 0:
+            idx = int(parent[idx])
+            path.append(idx)
+        return [self._keys[i] for i in reversed(path)]
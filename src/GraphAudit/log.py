@@ -1,28 +1,100 @@
-import logging
 import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
 
 class InfoOnlyFilter(logging.Filter):
     def filter(self, record):
         return record.levelno == logging.INFO
 
-def log_init(name, level=logging.INFO, filename="errors.log"):
-    logger = logging.getLogger(name)
-    if logger.hasHandlers():
-        logger.handlers.clear()
-    
-    handler   = logging.FileHandler(filename, mode='a')
-    formatter = logging.Formatter('{module} - {asctime} - {levelname} - {message}', style='{')
-    handler.setFormatter(formatter)
-    handler.setLevel(level)
-    logger.addHandler(handler)
-
-    handler = logging.StreamHandler(sys.stderr)
-    handler.setLevel(logging.INFO)
-    handler.addFilter(InfoOnlyFilter())
-    formatter = logging.Formatter('{message}', style='{')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
 
+class RateLimitFilter(logging.Filter):
+    # Lets through at most `burst` warnings/errors per call site every
+    # `interval` seconds. The first record after a quiet window reports how
+    # many were dropped. Call sites are (file, line), so f-string messages
+    # with varying ids still share one budget.
+    def __init__(self, burst=10, interval=60.0):
+        super().__init__()
+        self._burst    = burst
+        self._interval = interval
+        self._sites    = {}
+        self._lock     = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            start, count, dropped = self._sites.get(key, (now, 0, 0))
+            if now - start >= self._interval:
+                start, count = now, 0
+            if count >= self._burst:
+                self._sites[key] = (start, count, dropped + 1)
+                return False
+            self._sites[key] = (start, count + 1, 0)
+        if dropped:
+            record.msg = f"{record.msg} [{dropped} similar messages suppressed]"
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # The record is queued as-is: message formatting and exc_info
+    # tracebacks are rendered by the listener thread, not the caller
+    def prepare(self, record):
+        return record
+
+
+_lock     = threading.Lock()
+_handler  = None
+_listener = None
+
+
+def _start(filename):
+    global _handler, _listener
+    file_handler = logging.FileHandler(filename, mode='a')
+    file_handler.setFormatter(logging.Formatter('{module} - {asctime} - {levelname} - {message}', style='{'))
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.addFilter(InfoOnlyFilter())
+    stream_handler.setFormatter(logging.Formatter('{message}', style='{'))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(log_shutdown)
+
+    _handler = _QueueHandler(log_queue)
+    _handler.addFilter(RateLimitFilter())
+
+
+def log_shutdown():
+    # Drains the queue and closes errors.log; safe to call more than once
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def log_init(name, level=logging.INFO, filename="errors.log"):
+    # Handlers are created once per process. Every logger only enqueues
+    # records; a single listener thread writes errors.log and stderr.
+    with _lock:
+        if _listener is None:
+            _start(filename)
+        logger = logging.getLogger(name)
+        if _handler not in logger.handlers:
+            logger.handlers.clear()
+            logger.addHandler(_handler)
     logger.setLevel(level)
     logger.propagate = False
-    return logger 
\ No newline at end of file
+    return logger
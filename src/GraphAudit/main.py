@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import sys
 import argparse
 import asyncio
+from pathlib import Path
 from .graphdata import GraphData
-from .graphcrawl import GraphCrawler
 from .graphdiff import GraphDiff
 from .detections import DetectionFactory
+from .profiler import Profiler
+from .report import REPORT_FORMATS, open_report
+from .export import FindingsWriter
+
+# GraphCrawler (msgraph, azure-identity, httpx) and TripwireDaemon are
+# imported by the modes that talk to Graph. Detection runs over a cached
+# database do not load the Graph SDK; they still load numpy and pandas
+# through DuckDB once the graph_* functions are used.
+# benchmarks/bench_startup.py guards this.
 
 
 def main():
@@ -16,6 +26,13 @@ def main():
         default="graph_data.db",
         help="Path to database"                        
     )
+    parser.add_argument(
+        "--tenants",
+        type=str,
+        nargs="+",
+        metavar="[NAME=]PATH",
+        help="Run detections across several tenant databases, attached read-only. NAME defaults to the file name"
+    )
     parser.add_argument(
         "--dt-path", 
         type=str,
@@ -39,6 +56,54 @@ def main():
         default=False,
         help="Peform diff"
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Keep running and poll Graph for changed applications and Service Principals every --interval seconds"
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=300,
+        help="Seconds between --daemon polls"
+    )
+    parser.add_argument(
+        "--alert-file",
+        type=str,
+        default="alerts.ndjson",
+        help="Newline-delimited JSON events written by --daemon"
+    )
+    parser.add_argument(
+        "--archive",
+        type=str,
+        metavar="DIR",
+        help="Also write every Graph page fetched by --collect or --diff to an append-only NDJSON archive in DIR"
+    )
+    parser.add_argument(
+        "--archive-compression",
+        choices=["none", "gzip", "zstd"],
+        default="gzip",
+        help="Compression of --archive files (default: gzip; zstd requires zstandard)"
+    )
+    parser.add_argument(
+        "--ingest-archive",
+        type=str,
+        metavar="PATH",
+        help="Rebuild every table from an --archive directory (its latest run) or run directory, without network access"
+    )
+    parser.add_argument(
+        "--fingerprints",
+        action="store_true",
+        default=False,
+        help="With --collect or --ingest-archive, also save the row hashes of the --diff-config tables for the next --diff"
+    )
+    parser.add_argument(
+        "--diff-config",
+        type=str,
+        default="config/diff_config.yaml",
+        help="Tables, key columns and fields compared by --diff"
+    )
     parser.add_argument(
         "--debug-count",
         type=int,
@@ -48,49 +113,288 @@ def main():
     parser.add_argument(
         "--output-file", 
         type=str,
-        help="Log all object output to the specified file"                        
+        help="Write every finding to the specified file as newline-delimited JSON"                        
+    )
+    parser.add_argument(
+        "--output-compression",
+        choices=["none", "gzip", "zstd"],
+        help="Compress --output-file. Defaults to gzip for .gz and zstd for .zst file names"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["table"] + list(REPORT_FORMATS),
+        default="table",
+        help="Output format. json, csv and html are streamed without building Rich tables"
+    )
+    parser.add_argument(
+        "--report-file",
+        type=str,
+        help="Write the --format json/csv/html report to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        default=False,
+        help="Print one row per finding. Full detail is only built for --detail IDs or with --pager"
+    )
+    parser.add_argument(
+        "--detail",
+        type=str,
+        nargs="+",
+        metavar="SP_ID",
+        help="Render full detail for these Service Principal IDs (implies --summary)"
+    )
+    parser.add_argument(
+        "--pager",
+        action="store_true",
+        default=False,
+        help="Page the full detail of every finding after the summary (implies --summary)"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=str,
+        help="DuckDB memory limit, e.g. 4GB. Larger operations spill to --temp-dir"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Number of DuckDB worker threads"
+    )
+    parser.add_argument(
+        "--temp-dir",
+        type=str,
+        help="Directory DuckDB uses to spill data that exceeds --memory-limit"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of detections to run concurrently"
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        nargs="?",
+        const="127.0.0.1:8765",
+        metavar="ADDRESS",
+        help="Keep the database loaded and serve detection runs, Service Principal lookups and read-only SQL over HTTP on HOST:PORT or unix:PATH (default: 127.0.0.1:8765)"
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=1,
+        help="List service principals and applications as this many concurrent displayName ranges"
+    )
+    parser.add_argument(
+        "--crawl-workers",
+        type=int,
+        help="Threads converting fetched pages to rows during collection (default: up to 4), or processes parsing --ingest-archive files (default: CPU count)"
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        default=False,
+        help="Evaluate all detection queries in one pass and enrich matched Service Principals once"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only re-evaluate Service Principals changed since the last run and report new and resolved findings"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="profile.json",
+        help="Record per-detection phase timings, SQL statement counts and EXPLAIN ANALYZE plans to a JSON report (default: profile.json)"
+    )
+    parser.add_argument(
+        "--template-cache",
+        type=str,
+        default=".template_cache",
+        help="Path to compiled detection template cache"
     )
 
     try:
         args = parser.parse_args()
+        tenants = parse_tenants(parser, args)
+        if args.archive and not (args.collect or args.diff):
+            parser.error("--archive requires --collect or --diff")
+        if args.ingest_archive:
+            for option in ("archive", "daemon", "serve"):
+                if getattr(args, option):
+                    parser.error(f"--{option} cannot be used with --ingest-archive")
+        if args.serve:
+            for option in ("collect", "diff", "daemon", "incremental"):
+                if getattr(args, option):
+                    parser.error(f"--{option} cannot be used with --serve")
        
+        # --fingerprints makes a plain collection save row hashes for the
+        # next --diff; otherwise only --diff and --daemon pay for them
+        graph_diff = None
+        if args.diff or args.daemon or (args.fingerprints and (args.collect or args.ingest_archive)):
+            graph_diff = GraphDiff()
+            graph_diff.load_config(args.diff_config)
+
+        if args.daemon:
+            graph_data = GraphData(
+                args.db_path, 
+                graph_diff,
+                memory_limit=args.memory_limit,
+                threads=args.threads,
+                temp_directory=args.temp_dir
+            )
+            asyncio.run(tripwire(graph_data, graph_diff, args))
+            return
+
         # Currently experimental
         if args.diff:
-            graph_diff = GraphDiff()
-            graph_diff.make_hash('service_principals', ["passwordCredentials", "keyCredentials"])
-            graph_data = GraphData(args.db_path, graph_diff)
-            asyncio.run(refresh(graph_data, args.debug_count, args.auth_cache))
+            graph_data = GraphData(
+                args.db_path, 
+                graph_diff,
+                memory_limit=args.memory_limit,
+                threads=args.threads,
+                temp_directory=args.temp_dir
+            )
+            collect(graph_data, args)
             graph_diff.log_results()
             return
         
-        graph_data = GraphData(args.db_path)
+        profiler = Profiler() if args.profile else None
+        graph_data = GraphData(
+            args.db_path,
+            graph_diff,
+            memory_limit=args.memory_limit,
+            threads=args.threads,
+            temp_directory=args.temp_dir,
+            profiler=profiler,
+            tenants=tenants
+        )
 
-        if args.collect:
-             asyncio.run(refresh(graph_data, args.debug_count, args.auth_cache))
+        if args.serve:
+            serve(graph_data, args)
+            return
+        elif args.collect or args.ingest_archive:
+             collect(graph_data, args)
              return
-        elif graph_data.fresh() == False:
-            prompt = input(f"Cache database missing or older than 7 days. Perform refresh (y/n): ").strip().lower()
-            if prompt == 'y':
-                 asyncio.run(refresh(graph_data, args.debug_count, args.auth_cache))
+        # Federated tenant databases are attached read-only and never refreshed.
+        # Scheduled runs do not prompt; they analyse the last published
+        # database while a separate --collect builds the next one.
+        elif not tenants and graph_data.fresh() == False:
+            if not sys.stdin.isatty():
+                print("[*] Cache database missing or older than 7 days, run --collect to refresh it")
+            elif input(f"Cache database missing or older than 7 days. Perform refresh (y/n): ").strip().lower() == 'y':
+                 asyncio.run(refresh(graph_data, args.debug_count, args.auth_cache, args.crawl_workers, args.partitions))
                  return
 
-        detections = DetectionFactory(
+        report = open_report(args.format, args.report_file) if args.format != "table" else None
+        with DetectionFactory(
             graph_data, 
             args.dt_path,
-            args.output_file
-        )
+            args.output_file,
+            args.template_cache,
+            args.output_compression,
+            report,
+            summary=args.summary,
+            detail_ids=args.detail,
+            pager=args.pager
+        ) as detections:
+            if args.incremental:
+                detections.run_incremental()
+            elif args.fused:
+                detections.run_fused()
+            else:
+                detections.run(workers=args.workers)
 
-        for dectection in detections:
-            dectection.run()
-            dectection.print()
+        if profiler:
+            profiler.write_report(args.profile)
 
     except Exception as e:
         print(f"[-] Fatal Error (see errors.log): {str(e)}")
                 
 
-async def refresh(graph_data, debug=0, use_cache=False):
-    async with GraphCrawler(graph_data, debug=debug, use_cache=use_cache) as crawler:
-        await crawler.fetch()
+def serve(graph_data, args):
+    from .service import QueryService
+    from .templates import TemplateCompiler
+    from .detections import Detection
+
+    # Templates are compiled once; requests share the compiled detections
+    templates  = TemplateCompiler(graph_data, cache_path=args.template_cache).load(args.dt_path)
+    detections = [Detection(template, graph_data) for template in templates]
+    service    = QueryService(graph_data, detections, workers=args.workers)
+    try:
+        service.serve(args.serve)
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_tenants(parser, args):
+    # --tenants a.db contoso=b.db -> {"a": "a.db", "contoso": "b.db"}
+    if not args.tenants:
+        return None
+    for option in ("collect", "diff", "daemon", "incremental", "ingest_archive"):
+        if getattr(args, option):
+            parser.error(f"--{option.replace('_', '-')} cannot be used with --tenants")
+    tenants = {}
+    for entry in args.tenants:
+        name, sep, path = entry.partition("=")
+        if not sep:
+            name, path = Path(entry).stem, entry
+        if name in tenants:
+            parser.error(f"Duplicate tenant name '{name}', use NAME=PATH")
+        tenants[name] = path
+    return tenants
+
+
+async def tripwire(graph_data, graph_diff, args):
+    from .graphcrawl import GraphCrawler
+    from .daemon import TripwireDaemon
+
+    # Detections run against each change set; no templates means diff only
+    detections = DetectionFactory(graph_data, args.dt_path, template_cache=args.template_cache)
+    with FindingsWriter(args.alert_file, args.output_compression) as writer:
+        daemon = TripwireDaemon(graph_data, graph_diff, writer, detections, args.interval)
+        async with GraphCrawler(graph_data, use_cache=args.auth_cache, workers=args.crawl_workers) as crawler:
+            await daemon.run(crawler)
+
+
+def collect(graph_data, args):
+    # --ingest-archive rebuilds the tables from archived pages instead of Graph
+    if args.ingest_archive:
+        from .archive import ingest_archive
+        ingest_archive(graph_data, args.ingest_archive, args.crawl_workers)
+        return
+    asyncio.run(refresh(
+        graph_data,
+        args.debug_count,
+        args.auth_cache,
+        args.crawl_workers,
+        args.partitions,
+        args.archive,
+        args.archive_compression
+    ))
+
+
+async def refresh(graph_data, debug=0, use_cache=False, workers=None, partitions=1, archive=None, archive_compression="gzip"):
+    from .graphcrawl import GraphCrawler
+
+    if archive:
+        from .archive import ResponseArchive
+        archive = ResponseArchive(archive, archive_compression)
+    try:
+        async with GraphCrawler(
+            graph_data,
+            debug=debug,
+            use_cache=use_cache,
+            workers=workers,
+            partitions=partitions,
+            archive=archive
+        ) as crawler:
+            await crawler.fetch()
+    finally:
+        if archive:
+            archive.close()
 
 
 if __name__ == "__main__":
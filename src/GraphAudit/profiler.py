@@ -0,0 +1,105 @@
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from .log import log_init
+
+
+GLOBAL = "(global)"
+
+
+class Profiler():
+    # Per-detection wall time by phase. Phases nest exclusively: time spent in
+    # "decode" while inside "enrichment" is only counted under "decode".
+    def __init__(self):
+        self._logger  = log_init(__name__)
+        self._lock    = threading.Lock()
+        self._local   = threading.local()
+        self._records = {}
+        self._start   = time.perf_counter()
+
+    def _current(self):
+        return getattr(self._local, 'detection', None) or GLOBAL
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        return stack
+
+    def _record(self, name):
+        record = self._records.get(name)
+        if record is None:
+            record = {'phases': {}, 'sql_statements': 0}
+            self._records[name] = record
+        return record
+
+    def _add_time(self, phase, seconds):
+        with self._lock:
+            phases = self._record(self._current())['phases']
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def detection(self, name):
+        previous = getattr(self._local, 'detection', None)
+        self._local.detection = name
+        try:
+            yield
+        finally:
+            self._local.detection = previous
+
+    @contextmanager
+    def phase(self, phase):
+        stack = self._stack()
+        now = time.perf_counter()
+        if stack:
+            parent = stack[-1]
+            self._add_time(parent[0], now - parent[1])
+        entry = [phase, now]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            stack.pop()
+            self._add_time(phase, now - entry[1])
+            if stack:
+                stack[-1][1] = now
+
+    def count_statement(self):
+        with self._lock:
+            self._record(self._current())['sql_statements'] += 1
+
+    def set(self, name, key, value):
+        with self._lock:
+            self._record(name)[key] = value
+
+    def report(self):
+        detections = []
+        for name, record in self._records.items():
+            entry = {'name': name}
+            entry.update(record)
+            entry['phases'] = {k: round(v, 6) for k, v in record['phases'].items()}
+            entry['total_seconds'] = round(sum(record['phases'].values()), 6)
+            detections.append(entry)
+        detections.sort(key=lambda entry: entry['total_seconds'], reverse=True)
+        return {
+            'generated': datetime.now(timezone.utc).isoformat(),
+            'wall_seconds': round(time.perf_counter() - self._start, 6),
+            'detections': detections
+        }
+
+    def write_report(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.report(), fp, indent=2, default=str)
+        self._logger.info(f"[+] Profile written to {path}")
+
+
+def profile_phase(profiler, phase):
+    return profiler.phase(phase) if profiler else nullcontext()
+
+
+def profile_detection(profiler, name):
+    return profiler.detection(name) if profiler else nullcontext()
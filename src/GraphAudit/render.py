@@ -1,42 +1,269 @@
-from rich.console import Console
-from rich.text import Text
-from rich.table import Table
-from rich.panel import Panel
-from rich.align import Align
-from rich import print_json
 from .config import ConfigOptions
 from .log import log_init
 import jmespath
 import json
+import re
 
 
-class ScreenRender:
-    def __init__(self):
-        self.console = Console()
-        self.config  = ConfigOptions('config/render_config.yaml')
-        self._logger = log_init(__name__)
-
-    def _render_data_view(self, path, parent_obj):
-        prop_map = self.config.get_path(path)
-        if not isinstance(prop_map, dict):
-            self._logger.error(f"[-] Invalid config map for path: {path}")
-            return
+INDENT_UNIT = "  "
+EMPTY_VALUES = (None, "", [], {})
+# A prop map key or data_view segment naming a single field ("keyId", "appRoles[]")
+FIELD_PATTERN = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)(\[\])?$')
+
+# (GraphData.iter_sp_summary column, heading) for summary output
+SUMMARY_COLUMNS = [
+    ('#', "#"),
+    ('displayName', "Display Name"),
+    ('id', "Service Principal ID"),
+    ('servicePrincipalType', "Type"),
+    ('accountEnabled', "Enabled"),
+    ('spCredentials', "SP Credentials"),
+    ('appCredentials', "App Credentials"),
+    ('appRoles', "App Roles"),
+    ('directoryRoles', "Directory Roles")
+]
+# Inserted after '#' when the data is federated over several tenants
+TENANT_COLUMN = ('tenant', "Tenant")
+
+
+def _field_name(key):
+    match = FIELD_PATTERN.match(key)
+    return match.group(1) if match else None
+
+
+def _project(projection, level, name):
+    # name None (not a plain field) selects every field of the level
+    if level in projection and projection[level] is None:
+        return
+    if name is None:
+        projection[level] = None
+    else:
+        projection.setdefault(level, set()).add(name)
+
+
+def merge_projections(projections):
+    # Union of several RenderPlan projections; None in the list means full objects
+    merged = {}
+    for projection in projections:
+        if projection is None:
+            return None
+        for level, fields in projection.items():
+            for name in [None] if fields is None else fields:
+                _project(merged, level, name)
+    return merged
+
 
+def _compile(path, expressions):
+    expression = expressions.get(path)
+    if expression is None:
+        try:
+            expression = jmespath.compile(path)
+        except jmespath.exceptions.JMESPathError as e:
+            raise ValueError(f"[-] JMESPath error for path '{path}': {e}")
+        expressions[path] = expression
+    return expression
+
+
+class PropPlan():
+    # A prop map from render_config.yaml resolved into an ordered field list.
+    # Fields are ('prop', name, description) or ('expand', name, expression, PropPlan).
+    def __init__(self, prop_map, expressions, depth=0):
+        if depth > 10:
+            raise ValueError(f"Max recursion depth exceeded in render config")
+        self.title  = prop_map.get("TITLE")
+        self.fields = []
+        # (key, nested PropPlan or None) for every entry, used to decide
+        # whether an embedded object has anything to show
+        self.checks = []
+        for prop_name, prop_desc in prop_map.items():
+            if isinstance(prop_desc, dict):
+                nested = PropPlan(prop_desc, expressions, depth + 1)
+                self.checks.append((prop_name, nested))
+                if prop_desc.get("EXPAND"):
+                    self.fields.append(('expand', prop_name, _compile(prop_name, expressions), nested))
+            else:
+                self.checks.append((prop_name, None))
+                self.fields.append(('prop', prop_name, prop_desc))
+
+    def has_data(self, obj):
+        if not obj:
+            return False
+        if isinstance(obj, dict):
+            for key, nested in self.checks:
+                if nested is not None:
+                    if nested.has_data(obj.get(key)):
+                        return True
+                elif obj.get(key) not in EMPTY_VALUES:
+                    return True
+        elif isinstance(obj, list):
+            for item in obj:
+                if self.has_data(item):
+                    return True
+        return False
+
+    def project(self, obj):
+        # Plain data for the fields this map displays, for non-Rich output
+        if isinstance(obj, list):
+            return [record for record in (self.project(item) for item in obj) if record]
+        if not isinstance(obj, dict):
+            return {}
+        record = {}
+        for field in self.fields:
+            if field[0] == 'expand':
+                _, prop_name, expression, nested = field
+                try:
+                    embedded_obj = expression.search(obj)
+                except jmespath.exceptions.JMESPathError:
+                    continue
+                if nested.has_data(embedded_obj):
+                    record[prop_name] = nested.project(embedded_obj)
+            else:
+                prop_value = obj.get(field[1])
+                if prop_value not in EMPTY_VALUES:
+                    record[field[1]] = prop_value
+        return record
+
+    def flatten(self, obj, prefix=""):
+        # (field path, description, value) for every displayed value
+        items = obj if isinstance(obj, list) else [obj]
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            base = f"{prefix}[{i}]" if isinstance(obj, list) else prefix
+            for field in self.fields:
+                path = f"{base}.{field[1]}" if base else field[1]
+                if field[0] == 'expand':
+                    _, _, expression, nested = field
+                    try:
+                        embedded_obj = expression.search(item)
+                    except jmespath.exceptions.JMESPathError:
+                        continue
+                    if nested.has_data(embedded_obj):
+                        yield from nested.flatten(embedded_obj, path)
+                else:
+                    prop_value = item.get(field[1])
+                    if prop_value not in EMPTY_VALUES:
+                        yield path, field[2], prop_value
+
+
+class DataViewPlan():
+    def __init__(self, path, prop_map, expressions):
+        self.path  = path
+        self.valid = isinstance(prop_map, dict)
+        if not self.valid:
+            return
         obj_path = path.split('.', 1)[1] if '.' in path else ""
-        if obj_path:
-            try:
-                obj = self._get_obj_by_path(obj_path, parent_obj)
-            except ValueError as e:
-                return None
-        else:
-            obj = parent_obj
+        self.expression = _compile(obj_path, expressions) if obj_path else None
+        self.header  = prop_map.get('TITLE', "")
+        self.comment = prop_map.get('COMMENT', "")
+        self.props   = PropPlan(prop_map, expressions)
+
+    def search(self, parent_obj):
+        if self.expression is None:
+            return parent_obj
+        try:
+            return self.expression.search(parent_obj)
+        except jmespath.exceptions.JMESPathError:
+            return None
+
+
+class RenderPlan():
+    # Everything render_config.yaml and an output template contribute to
+    # rendering, resolved once and shared by every object and detection
+    def __init__(self, output_template, config, expressions=None, prop_maps=None):
+        expressions = expressions if expressions is not None else {}
+        prop_maps   = prop_maps or {}
+        self.tables = []
+        for entry in output_template or []:
+            if entry.get('type') != 'table':
+                continue
+            columns = []
+            for column in entry.get("columns") or []:
+                cells = []
+                for cell in column or []:
+                    if cell and cell.get('data_view'):
+                        path = cell.get('data_view')
+                        prop_map = prop_maps.get(path)
+                        if prop_map is None:
+                            prop_map = config.get_path(path)
+                        cells.append(DataViewPlan(path, prop_map, expressions))
+                    else:
+                        cells.append(None)
+                columns.append(cells)
+            self.tables.append((entry.get('title'), columns))
+        self.projection = self._projection()
 
+    def _projection(self):
+        # Fields the data views read, two levels below the root object:
+        # {"": root fields, field: fields of that field}. Anything deeper is
+        # inside a stored JSON column. A level mapped to None needs every
+        # field. Prop map checks are included, so has_data() is unchanged.
+        projection = {"": set()}
+        for view in self.data_views:
+            segments = [_field_name(segment) for segment in view.path.split('.')[1:]]
+            if not segments:
+                self._project_props(projection, view.props, "", 0)
+                continue
+            _project(projection, "", segments[0])
+            if segments[0] is None:
+                continue
+            if len(segments) == 1:
+                self._project_props(projection, view.props, segments[0], 1)
+            else:
+                _project(projection, segments[0], segments[1])
+        return projection
+
+    def _project_props(self, projection, props, level, depth):
+        for prop_name, nested in props.checks:
+            name = _field_name(prop_name)
+            _project(projection, level, name)
+            if nested is not None and depth == 0 and name is not None:
+                self._project_props(projection, nested, name, 1)
+
+    @property
+    def data_views(self):
+        for _, columns in self.tables:
+            for column in columns:
+                for view in column:
+                    if view and view.valid:
+                        yield view
+
+
+class ScreenRender:
+    # Rich is imported by the methods that build renderables, so json, csv
+    # and html reports never load it
+    def __init__(self, output_template=None, render_plan=None, console=None, config=None):
+        self._console = console
+        self._logger  = log_init(__name__)
+        if render_plan is None:
+            config = config if config is not None else ConfigOptions('config/render_config.yaml')
+            render_plan = RenderPlan(output_template, config)
+        self._render_plan = render_plan
+
+    @property
+    def console(self):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+
+    @console.setter
+    def console(self, console):
+        self._console = console
+
+    def _render_data_view(self, view, parent_obj):
+        if not view.valid:
+            self._logger.error(f"[-] Invalid config map for path: {view.path}")
+            return
+
+        obj = view.search(parent_obj)
         if not obj:
             return None
 
+        from rich.table import Table
         outer_table = Table(show_header=False, padding=(0, 0), box=None)
-        header  = prop_map.get('TITLE', "")
-        comment = prop_map.get('COMMENT', "")
+        header  = view.header
+        comment = view.comment
         table = Table(
             show_header=True,
             title_justify="left",
@@ -46,7 +273,7 @@ class ScreenRender:
             padding=(0, 1)
         )
 
-        self._add_table_row(path, obj, prop_map, table)
+        self._add_table_row(obj, view.props, table)
 
         outer_table.add_row(table)
         if comment:
@@ -59,19 +286,13 @@ class ScreenRender:
     
     def _add_table_row(
         self,
-        path,
         obj_list,
-        prop_map,
+        props,
         table,
         embedded=0,
         depth=0
     ):
-        if depth > 10:
-            raise ValueError(f"Max recursion depth exceeded at {path}")
-
-        if not isinstance(prop_map, dict):
-            return
-
+        from rich.text import Text
         if isinstance(obj_list, dict):
             obj_list = [obj_list]
         elif not isinstance(obj_list, list):
@@ -83,33 +304,33 @@ class ScreenRender:
 
             embedded_title_added = False
 
-            for prop_name, prop_desc in prop_map.items():
-                # Check for nested prop map (dict) — possible recursion
-                if isinstance(prop_desc, dict):
-                    if prop_desc.get("EXPAND"):
-                        embedded_obj = self._get_obj_by_path(prop_name, obj)
-                        if self._has_embedded_data(embedded_obj, prop_desc):
-                            self._add_table_row(
-                                f"{path}.{prop_name}",
-                                embedded_obj,
-                                prop_desc,
-                                table,
-                                embedded=1,
-                                depth=depth + 1
-                            )
+            for field in props.fields:
+                if field[0] == 'expand':
+                    _, prop_name, expression, nested = field
+                    try:
+                        embedded_obj = expression.search(obj)
+                    except jmespath.exceptions.JMESPathError as e:
+                        raise ValueError(f"[-] JMESPath error for path '{prop_name}': {e}")
+                    if nested.has_data(embedded_obj):
+                        self._add_table_row(
+                            embedded_obj,
+                            nested,
+                            table,
+                            embedded=1,
+                            depth=depth + 1
+                        )
                     continue
 
+                _, prop_name, prop_desc = field
                 if embedded and not embedded_title_added:
-                    title = prop_map.get("TITLE")
-                    if title:
-                        INDENT_UNIT = "  "
+                    if props.title:
                         indent = INDENT_UNIT * (depth)
-                        table.add_row(f"{indent}[dim]{title}[/]", "")
+                        table.add_row(f"{indent}[dim]{props.title}[/]", "")
                         embedded_title_added = True
 
                 if prop_name in obj:
                     prop_value = obj[prop_name]
-                    if prop_value in [None, "", [], {}]:
+                    if prop_value in EMPTY_VALUES:
                         continue
 
                     if isinstance(prop_value, list):
@@ -128,62 +349,25 @@ class ScreenRender:
             table.add_row(Text("", style="dim"), Text("", style="dim"))
 
 
-    def _has_embedded_data(self, obj, prop_map):
+    def _render_table(self, obj, display):
         if not obj:
-            return False
-        if isinstance(obj, dict):
-            for key, desc in prop_map.items():
-                if isinstance(desc, dict):
-                    # Nested check
-                    if self._has_embedded_data(obj.get(key), desc):
-                        return True
-                else:
-                    val = obj.get(key)
-                    if val not in [None, "", [], {}]:
-                        return True
-        elif isinstance(obj, list):
-            for item in obj:
-                if self._has_embedded_data(item, prop_map):
-                    return True
-        return False
-
-
-    def _get_obj_by_path(self, path, obj):
-        try:
-            return jmespath.search(path, obj)
-        except jmespath.exceptions.JMESPathError as e:
-            raise ValueError(f"[-] JMESPath error for path '{path}': {e}")
-
-
-    def _write_manifest(self, obj, output_path):
-        if output_path:
-            with open(output_path, 'a') as fp:
-                output = json.dumps(obj, indent=3)
-                fp.write(output)
-                fp.write(output + "\n") 
-
-
-    def _render_table(self, obj, display, config):
-        for entry in config:
-            entry_type  = entry.get('type')
-            entry_title = entry.get('title')
-            if entry_type == 'table' and obj:
-                table = Table(title=entry_title, show_header=False, title_style="blue", title_justify="left")
-                columns = entry.get("columns")
-                max_rows = max(len(column) for column in columns)
+            return
+        from rich.table import Table
+        for entry_title, columns in self._render_plan.tables:
+            table = Table(title=entry_title, show_header=False, title_style="blue", title_justify="left")
+            max_rows = max(len(column) for column in columns)
+            for column in columns:
+                table.add_column(ratio=1)
+            for i in range(max_rows):
+                row = []
                 for column in columns:
-                    table.add_column(ratio=1)
-                for i in range(max_rows):
-                    row = []
-                    for column in columns:
-                        if i < len(column):
-                            if column[i] and column[i].get('data_view'):
-                                dv = self._render_data_view(column[i].get('data_view'), obj)
-                                row.append(dv)
-                            else:
-                                row.append("")
-                    table.add_row(*row)
-                display.add_row(table)
+                    if i < len(column):
+                        if column[i]:
+                            row.append(self._render_data_view(column[i], obj))
+                        else:
+                            row.append("")
+                table.add_row(*row)
+            display.add_row(table)
 
 
     def _render_header(self, name, description):
@@ -191,8 +375,46 @@ class ScreenRender:
         self.console.print(f"[white]{description}[/white]", justify="center")
 
 
-    def _render_results(self, obj, template):
+    def _render_summary(self, name, description, count, rows, columns=SUMMARY_COLUMNS):
+        # One flat table for the whole detection instead of nested tables per SP
+        from rich.table import Table
+        self._render_header(name, description)
+        table = Table(
+            title=f"{name}: {count} findings",
+            title_style="blue",
+            title_justify="left"
+        )
+        for column, label in columns:
+            table.add_column(label, no_wrap=(column == 'id'))
+        for i, row in enumerate(rows, 1):
+            values = [str(i)]
+            for column, _ in columns[1:]:
+                value = row.get(column)
+                values.append("" if value is None else str(value))
+            table.add_row(*values)
+        self.console.print(table)
+
+
+    def _render_resolved(self, name, rows, unchanged=0):
+        if rows:
+            from rich.table import Table
+            table = Table(
+                title=f"{name}: Resolved Findings",
+                title_style="green",
+                title_justify="left"
+            )
+            table.add_column("Service Principal ID")
+            table.add_column("Display Name")
+            for sp_id, display_name in rows:
+                table.add_row(str(sp_id), str(display_name or "(deleted)"))
+            self.console.print(table)
+        if unchanged:
+            self.console.print(f"[dim]{name}: {unchanged} existing findings unchanged[/dim]")
+
+
+    def _render_results(self, obj):
+        from rich.table import Table
         display = Table(show_header=False, box=None)
         if display:
-            self._render_table(obj, display, template)
+            self._render_table(obj, display)
             self.console.print(display)
\ No newline at end of file
@@ -0,0 +1,214 @@
+import csv
+import sys
+import abc
+import json
+import html
+from datetime import datetime, timezone
+from .export import ExportError
+from .log import log_init
+
+
+def _value_text(value):
+    if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+        return " ".join(str(v) for v in value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def finding_record(name, sp, render_plan):
+    # JSON form of one finding: the fields each data view displays
+    record = {
+        "type": "finding",
+        "detection": name,
+        "service_principal_id": sp.get('id'),
+        "display_name": sp.get('displayName'),
+        "data_views": {
+            view.path: view.props.project(view.search(sp))
+            for view in render_plan.data_views
+        }
+    }
+    # Federated snapshots label every service principal with its tenant
+    if 'tenant' in sp:
+        record["tenant"] = sp['tenant']
+    return record
+
+
+class ReportWriter(abc.ABC):
+    # Streams findings straight from the enriched objects and the output
+    # template's data views, one object at a time, without Rich renderables.
+    # Detections call start_detection / write / end_detection in order.
+    def __init__(self, output_path=None):
+        self._logger      = log_init(__name__)
+        self._output_path = output_path
+        self._count       = 0
+        try:
+            self._fp = open(output_path, 'w', newline='', encoding='utf-8') if output_path else sys.stdout
+        except Exception as e:
+            raise ExportError(f"Could not open report file {output_path}: {str(e)}") from e
+        self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def count(self):
+        return self._count
+
+    def _start(self):
+        pass
+
+    def _finish(self):
+        pass
+
+    def start_detection(self, name, description):
+        pass
+
+    def end_detection(self, name):
+        pass
+
+    @abc.abstractmethod
+    def write(self, name, sp, render_plan):
+        pass
+
+    def write_resolved(self, name, rows):
+        pass
+
+    def close(self):
+        if self._fp is None:
+            return
+        self._finish()
+        if self._fp is sys.stdout:
+            self._fp.flush()
+        else:
+            self._fp.close()
+            self._logger.info(f"[+] Wrote {self._count} findings to {self._output_path}")
+        self._fp = None
+
+
+class JsonReport(ReportWriter):
+    # A single JSON array, written record by record
+    def _start(self):
+        self._fp.write("[")
+        self._first = True
+
+    def _finish(self):
+        self._fp.write("\n]\n")
+
+    def _record(self, record):
+        self._fp.write("\n" if self._first else ",\n")
+        self._fp.write(json.dumps(record, default=str))
+        self._first = False
+
+    def write(self, name, sp, render_plan):
+        self._record(finding_record(name, sp, render_plan))
+        self._count += 1
+
+    def write_resolved(self, name, rows):
+        for sp_id, display_name in rows:
+            self._record({
+                "type": "resolved",
+                "detection": name,
+                "service_principal_id": sp_id,
+                "display_name": display_name
+            })
+
+
+class CsvReport(ReportWriter):
+    # Long format: one row per displayed value
+    COLUMNS = [
+        "detection", "service_principal_id", "display_name",
+        "data_view", "field", "label", "value"
+    ]
+
+    def _start(self):
+        self._csv = csv.writer(self._fp)
+        self._csv.writerow(self.COLUMNS)
+
+    def write(self, name, sp, render_plan):
+        sp_id, display_name = sp.get('id'), sp.get('displayName')
+        for view in render_plan.data_views:
+            for path, label, value in view.props.flatten(view.search(sp)):
+                self._csv.writerow([name, sp_id, display_name, view.path, path, label, _value_text(value)])
+        self._count += 1
+
+    def write_resolved(self, name, rows):
+        for sp_id, display_name in rows:
+            self._csv.writerow([name, sp_id, display_name, "resolved", "", "", ""])
+
+
+class HtmlReport(ReportWriter):
+    STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+h2 { color: #087; margin-top: 2em; }
+details { margin: 0.3em 0; }
+summary { cursor: pointer; font-weight: bold; }
+table { border-collapse: collapse; margin: 0.5em 0 0.5em 1.5em; }
+caption { text-align: left; font-weight: bold; color: #a0a; }
+th, td { border: 1px solid #ddd; padding: 2px 8px; text-align: left; vertical-align: top; }
+th { color: #555; font-weight: normal; }
+td.path { color: #999; font-size: 80%; }
+td.value { white-space: pre-wrap; font-family: monospace; }
+"""
+
+    def _start(self):
+        generated = datetime.now(timezone.utc).isoformat()
+        self._fp.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>GraphAudit Report</title><style>{self.STYLE}</style></head><body>\n"
+            f"<h1>GraphAudit Report</h1><p>Generated {html.escape(generated)}</p>\n"
+        )
+
+    def _finish(self):
+        self._fp.write("</body></html>\n")
+
+    def start_detection(self, name, description):
+        self._fp.write(
+            f"<section><h2>{html.escape(str(name))}</h2>"
+            f"<p>{html.escape(str(description or ''))}</p>\n"
+        )
+
+    def end_detection(self, name):
+        self._fp.write("</section>\n")
+
+    def write(self, name, sp, render_plan):
+        title = f"{sp.get('displayName')} ({sp.get('id')})"
+        self._fp.write(f"<details><summary>{html.escape(title)}</summary>\n")
+        for view in render_plan.data_views:
+            rows = [
+                f"<tr><th>{html.escape(str(label))}</th>"
+                f"<td class=\"value\">{html.escape(_value_text(value))}</td>"
+                f"<td class=\"path\">{html.escape(path)}</td></tr>"
+                for path, label, value in view.props.flatten(view.search(sp))
+            ]
+            if rows:
+                caption = html.escape(str(view.header or view.path))
+                self._fp.write(f"<table><caption>{caption}</caption>\n" + "\n".join(rows) + "\n</table>\n")
+        self._fp.write("</details>\n")
+        self._count += 1
+
+    def write_resolved(self, name, rows):
+        if not rows:
+            return
+        items = "".join(
+            f"<li>{html.escape(str(display_name or '(deleted)'))} ({html.escape(str(sp_id))})</li>"
+            for sp_id, display_name in rows
+        )
+        self._fp.write(f"<section><h2>{html.escape(str(name))}: Resolved Findings</h2><ul>{items}</ul></section>\n")
+
+
+REPORT_FORMATS = {
+    "json": JsonReport,
+    "csv": CsvReport,
+    "html": HtmlReport
+}
+
+
+def open_report(output_format, output_path=None):
+    report = REPORT_FORMATS.get(output_format)
+    if report is None:
+        raise ExportError(f"Unsupported report format: {output_format}")
+    return report(output_path)
@@ -0,0 +1,231 @@
+import os
+import json
+import socketserver
+import http.server
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+from .report import finding_record
+from .log import log_init
+
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# Rows are streamed as newline-delimited JSON
+NDJSON = "application/x-ndjson"
+_END = object()
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class _PooledServer():
+    # Requests run on a fixed set of threads: concurrency is bounded and each
+    # thread keeps its GraphData cursor from one request to the next
+    def __init__(self, address, service, workers):
+        self.service = service
+        self._pool = ThreadPoolExecutor(max(1, workers), thread_name_prefix='graphaudit-serve')
+        super().__init__(address, _Handler)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+
+
+class _TCPServer(_PooledServer, http.server.HTTPServer):
+    pass
+
+
+class _UnixServer(_PooledServer, socketserver.UnixStreamServer):
+    pass
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "GraphAudit"
+
+    def do_GET(self):
+        self.server.service.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.service.handle(self, 'POST')
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        self.server.service.logger.info("[*] %s %s", self.address_string(), format % args)
+
+
+class QueryService():
+    # Long-running local service over one loaded GraphData, so repeated
+    # lookups do not pay interpreter start-up, imports and the database load.
+    #
+    #   GET  /health                 snapshot and tables
+    #   GET  /detections             loaded detection templates
+    #   GET  /detections/<name>      findings as NDJSON (?summary=1: summary rows)
+    #   GET  /sp/<id>                enriched service principal
+    #   POST /query                  read-only SQL in the body, rows as NDJSON
+    #
+    # Listens on HOST:PORT or unix:PATH. SQL runs on the caller's thread
+    # cursor and must be a single SELECT; the database cannot read or
+    # write files once the service starts.
+    def __init__(self, graph_data, detections=(), workers=4):
+        self.logger      = log_init(__name__)
+        self._graph_data = graph_data
+        self._detections = {detection.name: detection for detection in detections}
+        self._workers    = workers
+        self._server     = None
+
+    def serve(self, address=DEFAULT_ADDRESS):
+        self._graph_data.disable_external_access()
+        self._server = self._bind(address)
+        self.logger.info(f"[+] Serving {len(self._detections)} detections on {address}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if address.startswith("unix:"):
+                self._remove_socket(address[len("unix:"):])
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
+
+    def _bind(self, address):
+        if address.startswith("unix:"):
+            path = address[len("unix:"):]
+            self._remove_socket(path)
+            server = _UnixServer(path, self, self._workers)
+            os.chmod(path, 0o600)
+            return server
+        host, _, port = address.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Invalid service address {address}, expected HOST:PORT or unix:PATH")
+        return _TCPServer((host, int(port)), self, self._workers)
+
+    @staticmethod
+    def _remove_socket(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def handle(self, request, method):
+        url = urlsplit(request.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        params = parse_qs(url.query)
+        try:
+            if method == 'GET' and parts == ["health"]:
+                self._send_json(request, self._health())
+            elif method == 'GET' and parts == ["detections"]:
+                self._send_json(request, self._detection_list())
+            elif method == 'GET' and len(parts) == 2 and parts[0] == "detections":
+                summary = params.get("summary", ["0"])[0] not in ("0", "false", "")
+                self._send_stream(request, self._run_detection(parts[1], summary))
+            elif method == 'GET' and len(parts) == 2 and parts[0] == "sp":
+                self._send_json(request, self._lookup(parts[1]))
+            elif method == 'POST' and parts == ["query"]:
+                length = int(request.headers.get("Content-Length") or 0)
+                sql = request.rfile.read(length).decode("utf-8")
+                self._send_stream(request, self._query(sql))
+            else:
+                raise ServiceError(404, f"No such endpoint: {method} {url.path}")
+        except ServiceError as e:
+            self._send_json(request, {"error": str(e)}, e.status)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        except Exception as e:
+            self.logger.error(f"[-] {method} {url.path} failed: {str(e)}")
+            self._send_json(request, {"error": str(e)}, 500)
+
+    def _health(self):
+        return {
+            "status": "ok",
+            "snapshot": self._graph_data.latest_snapshot(),
+            "tables": sorted(self._graph_data.table_names())
+        }
+
+    def _detection_list(self):
+        return [
+            {"name": detection.name, "description": detection.description}
+            for detection in self._detections.values()
+        ]
+
+    def _detection(self, name):
+        detection = self._detections.get(name)
+        if detection is None:
+            raise ServiceError(404, f"No such detection: {name}")
+        return detection
+
+    def _run_detection(self, name, summary=False):
+        # Detection objects are shared by request threads, so only their
+        # stateless parts (query, projection, render plan) are used
+        detection = self._detection(name)
+        ids = tuple(sorted(detection.evaluate_ids()))
+        if summary:
+            yield from self._graph_data.iter_sp_summary(ids)
+            return
+        for sp in self._graph_data.iter_sp_by_id(ids, projection=detection.projection):
+            yield finding_record(detection.name, sp, detection.render_plan)
+
+    def _lookup(self, sp_id):
+        if "'" in sp_id:
+            raise ServiceError(400, f"Invalid Service Principal ID: {sp_id}")
+        results = self._graph_data.get_sp_by_id((sp_id,))
+        if not results:
+            raise ServiceError(404, f"No such Service Principal: {sp_id}")
+        return results[0]
+
+    def _query(self, sql):
+        try:
+            types = self._graph_data.statement_types(sql)
+        except Exception as e:
+            raise ServiceError(400, str(e))
+        if types != ['SELECT']:
+            raise ServiceError(400, "Only a single SELECT statement is accepted")
+        try:
+            for rows in self._graph_data.query_stream(sql, tenant_views=True):
+                yield from rows
+        except Exception as e:
+            raise ServiceError(400, str(e)) from e
+
+    def _send_json(self, request, body, status=200):
+        data = json.dumps(body, default=str).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _send_stream(self, request, records):
+        # The first record is produced before the headers, so errors in
+        # the query are still reported with an error status
+        records = iter(records)
+        first = next(records, _END)
+        request.send_response(200)
+        request.send_header("Content-Type", NDJSON)
+        request.end_headers()
+        if first is _END:
+            return
+        request.wfile.write(json.dumps(first, default=str).encode("utf-8") + b"\n")
+        try:
+            for record in records:
+                request.wfile.write(json.dumps(record, default=str).encode("utf-8") + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception as e:
+            self.logger.error(f"[-] {request.path} failed while streaming: {str(e)}")
+            request.wfile.write(json.dumps({"error": str(e)}).encode("utf-8") + b"\n")
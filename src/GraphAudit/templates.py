@@ -0,0 +1,227 @@
+import json
+import hashlib
+import yaml
+from pathlib import Path
+from .config import ConfigOptions
+from .render import RenderPlan
+from .log import log_init
+
+
+CACHE_VERSION = 4
+
+
+class TemplateError(Exception):
+    pass
+
+
+class CompiledTemplate():
+    def __init__(self, template, source=None):
+        self.source      = str(source) if source else None
+        self.name        = template['name']
+        self.description = template['description']
+        self.query       = template['query']
+        self.output      = template['output']
+        # data_view path -> resolved prop map from render_config.yaml
+        self.prop_maps   = {}
+        # JMESPath expression string -> compiled expression
+        self.expressions = {}
+        # Resolved render layout shared by every object the detection prints
+        self.render_plan = None
+        self.validated   = False
+
+    @property
+    def data_views(self):
+        for entry in self.output or []:
+            for column in entry.get('columns') or []:
+                for cell in column or []:
+                    if cell and cell.get('data_view'):
+                        yield cell['data_view']
+
+
+class TemplateCompiler():
+    def __init__(
+        self,
+        graph_data=None,
+        render_config='config/render_config.yaml',
+        cache_path='.template_cache'):
+
+        self._logger        = log_init(__name__)
+        self._graph_data    = graph_data
+        self._render_config = render_config
+        self._cache_path    = Path(cache_path) if cache_path else None
+        self._config        = None
+        self._config_digest = None
+        self._cache         = self._load_cache()
+        # Cache key -> CompiledTemplate rebuilt from the cache in this process
+        self._compiled      = {}
+        self._dirty         = False
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = ConfigOptions(self._render_config)
+        return self._config
+
+    def load(self, template_path):
+        path = Path(template_path)
+        files = []
+        if path.is_file():
+            if path.suffix.lower() in (".yaml", ".yml"):
+                files.append(path)
+            else:
+                self._logger.warning(f"File {path} is not a YAML file, skipping")
+        elif path.is_dir():
+            files = [
+                file for file in sorted(path.iterdir())
+                if file.suffix.lower() in (".yaml", ".yml")
+            ]
+        else:
+            self._logger.error(f"Path {path} does not exist or is not a file/directory")
+
+        templates = []
+        for file in files:
+            self._logger.info(f"Loading detection: {file}")
+            try:
+                templates.append(self.compile_file(file))
+            except TemplateError as e:
+                self._logger.error(f"[-] Skipping detection {file}: {str(e)}")
+
+        self._save_cache()
+        return templates
+
+    def compile_file(self, file):
+        file = Path(file)
+        stat = file.stat()
+        key  = str(file.resolve())
+
+        entry = self._cache.get(key)
+        if entry and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return self._revalidate(self._from_cache(key, entry, file))
+
+        data   = file.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry and entry['digest'] == digest:
+            entry['mtime'] = stat.st_mtime_ns
+            self._dirty = True
+            return self._revalidate(self._from_cache(key, entry, file))
+
+        try:
+            template = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            raise TemplateError(f"Invalid yaml: {str(e)}") from e
+
+        compiled = self.compile(template, source=file)
+        self._cache[key] = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'digest': digest,
+            'template': template,
+            'validated': compiled.validated
+        }
+        self._compiled[key] = compiled
+        self._dirty = True
+        return compiled
+
+    def _from_cache(self, key, entry, source):
+        # The cache holds the parsed template only; prop maps, JMESPath
+        # expressions and the render plan are rebuilt, skipping the SQL
+        # check if it already passed
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self.compile(entry['template'], source, validate=not entry['validated'])
+            compiled.validated = compiled.validated or entry['validated']
+            self._compiled[key] = compiled
+        return compiled
+
+    def compile(self, template, source=None, validate=True):
+        if not isinstance(template, dict):
+            raise TemplateError("Template is not a mapping")
+        missing = [key for key in ('name', 'description', 'query', 'output') if key not in template]
+        if missing:
+            raise TemplateError(f"Template missing keys: {', '.join(missing)}")
+
+        compiled = CompiledTemplate(template, source)
+        if validate:
+            self._validate_sql(compiled)
+
+        for path in compiled.data_views:
+            prop_map = self.config.get_path(path)
+            if not isinstance(prop_map, dict):
+                raise TemplateError(f"No render config map for data_view: {path}")
+            compiled.prop_maps[path] = prop_map
+
+        try:
+            compiled.render_plan = RenderPlan(
+                compiled.output,
+                self.config,
+                compiled.expressions,
+                compiled.prop_maps
+            )
+        except ValueError as e:
+            raise TemplateError(str(e)) from e
+
+        return compiled
+
+    def _revalidate(self, compiled):
+        # Templates cached before a database existed still need their SQL checked
+        if not compiled.validated:
+            self._validate_sql(compiled)
+            if compiled.validated:
+                self._dirty = True
+        return compiled
+
+    def _validate_sql(self, compiled):
+        if not self._graph_data:
+            return
+        query = compiled.query.strip().rstrip(';')
+        try:
+            self._graph_data.explain(query)
+            compiled.validated = True
+        except Exception as e:
+            # XXX No schema until the first collection has been stored, and
+            # empty tables are never created. Keep the template, it will
+            # return no results.
+            if "does not exist" in str(e):
+                self._logger.warning(f"[-] Could not validate SQL for '{compiled.name}': {str(e)}")
+                return
+            raise TemplateError(f"Invalid SQL in '{compiled.name}': {str(e)}") from e
+
+    def _cache_key(self):
+        # Compiled prop maps depend on the render config as well as the template
+        if self._config_digest is None:
+            try:
+                data = Path(self._render_config).read_bytes()
+                self._config_digest = hashlib.sha256(data).hexdigest()
+            except OSError:
+                self._config_digest = ""
+        return (CACHE_VERSION, self._config_digest)
+
+    def _load_cache(self):
+        if not self._cache_path or not self._cache_path.exists():
+            return {}
+        # Plain JSON: {"key": [version, render config digest], "templates": {path: entry}}
+        try:
+            with open(self._cache_path, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            key, cache = data['key'], data['templates']
+            if key != list(self._cache_key()):
+                self._logger.info("[*] Render config changed, discarding template cache")
+                return {}
+            return cache
+        except Exception as e:
+            self._logger.warning(f"[-] Ignoring unreadable template cache {self._cache_path}: {str(e)}")
+            return {}
+
+    def _save_cache(self):
+        if not self._cache_path or not self._dirty:
+            return
+        for key, compiled in self._compiled.items():
+            if key in self._cache:
+                self._cache[key]['validated'] = compiled.validated
+        try:
+            data = json.dumps({'key': list(self._cache_key()), 'templates': self._cache})
+            with open(self._cache_path, 'w', encoding='utf-8') as fp:
+                fp.write(data)
+            self._dirty = False
+        except Exception as e:
+            self._logger.warning(f"[-] Could not write template cache {self._cache_path}: {str(e)}")
@@ -0,0 +1,82 @@
+import sys
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from GraphAudit import GraphData, TemplateCompiler, Detection
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def service_principals(**enabled):
+    # One SP per keyword, enabled or not, without credentials
+    return pd.DataFrame([
+        {
+            'id': sp_id,
+            'displayName': sp_id,
+            'accountEnabled': state,
+            'passwordCredentials': '[]',
+            'keyCredentials': '[]'
+        }
+        for sp_id, state in enabled.items()
+    ])
+
+
+@pytest.fixture
+def graph_data():
+    return GraphData(':memory:')
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'graph_data.db')
+
+
+@pytest.fixture
+def detection():
+    def make(graph_data, query, name='Test detection'):
+        compiler = TemplateCompiler(
+            graph_data,
+            render_config=str(ROOT / 'config' / 'render_config.yaml'),
+            cache_path=None
+        )
+        template = compiler.compile({
+            'name': name,
+            'description': name,
+            'query': query,
+            'output': []
+        })
+        return Detection(template, graph_data)
+    return make
+
+
+@pytest.fixture
+def lock_holder():
+    # Another process with the database open for writing, as a collection
+    # or an --incremental run would have it
+    processes = []
+
+    def hold(path, seconds=30):
+        process = subprocess.Popen(
+            [
+                sys.executable, '-c',
+                "import sys, time, duckdb\n"
+                "con = duckdb.connect(sys.argv[1])\n"
+                "print('locked', flush=True)\n"
+                "time.sleep(float(sys.argv[2]))\n",
+                path, str(seconds)
+            ],
+            stdout=subprocess.PIPE,
+            text=True
+        )
+        processes.append(process)
+        assert process.stdout.readline().strip() == 'locked'
+        return process
+
+    yield hold
+    for process in processes:
+        process.kill()
+        process.wait()
+        process.stdout.close()
@@ -0,0 +1,87 @@
+import json
+import asyncio
+
+import pandas as pd
+import pytest
+
+from GraphAudit import GraphData, GraphDiff, FindingsWriter
+from GraphAudit.daemon import TripwireDaemon, SUBRESOURCE_TABLES
+from GraphAudit.graphdata import GraphException
+
+from conftest import service_principals
+
+
+class FakeCrawler():
+    # Every SP on the first delta, then a new secret on s1
+    def __init__(self):
+        self.links = []
+
+    async def fetch_delta(self, resource, link=None):
+        self.links.append((resource, link))
+        if resource != 'service_principals':
+            return [], f'{resource}-1'
+        if link is None:
+            return service_principals(s1=True, s2=True).to_dict('records'), f'{resource}-1'
+        if link.endswith('-1'):
+            changed = service_principals(s1=True)
+            changed['passwordCredentials'] = '[{"keyId": "k1"}]'
+            return changed.to_dict('records'), f'{resource}-2'
+        return [], link
+
+    async def fetch_sp_subresources(self, ids):
+        return tuple(pd.DataFrame() for _ in SUBRESOURCE_TABLES)
+
+
+@pytest.fixture
+def daemon(db_path, tmp_path):
+    graph_diff = GraphDiff()
+    graph_diff.make_hash('service_principals', ['passwordCredentials', 'keyCredentials'])
+    writer = FindingsWriter(str(tmp_path / 'alerts.ndjson'))
+    yield TripwireDaemon(GraphData(db_path, graph_diff), graph_diff, writer, interval=0)
+    writer.close()
+
+
+def alerts(tmp_path):
+    with open(tmp_path / 'alerts.ndjson') as fp:
+        return [json.loads(line) for line in fp]
+
+
+def sp_links(crawler):
+    return [link for resource, link in crawler.links if resource == 'service_principals']
+
+
+def test_failed_publish_keeps_delta_links_and_alerts(daemon, db_path, tmp_path, monkeypatch):
+    def fail(path, written):
+        raise GraphException("publish failed")
+
+    crawler = FakeCrawler()
+    asyncio.run(daemon.poll(crawler))
+    baseline = len(alerts(tmp_path))
+
+    monkeypatch.setattr(daemon._graph_data, '_publish', fail)
+    with pytest.raises(GraphException):
+        asyncio.run(daemon.poll(crawler))
+    assert daemon._delta_links['service_principals'] == 'service_principals-1'
+    assert len(alerts(tmp_path)) == baseline
+
+    monkeypatch.undo()
+    events = asyncio.run(daemon.poll(crawler))
+    # The retried poll fetches the same delta and its change is written once
+    assert sp_links(crawler) == [None, 'service_principals-1', 'service_principals-1']
+    changes = [alert for alert in alerts(tmp_path)[baseline:] if alert['event'] == 'change']
+    assert events == len(changes) == 1
+    assert changes[0]['key'] == {'id': 's1'}
+    assert changes[0]['changed_fields'] == ['passwordCredentials']
+    assert daemon._delta_links['service_principals'] == 'service_principals-2'
+
+
+def test_delta_links_are_published(daemon, db_path):
+    asyncio.run(daemon.poll(FakeCrawler()))
+    rows = GraphData(db_path).query(
+        "SELECT resource, delta_link FROM delta_links ORDER BY resource",
+        output_format='list'
+    )
+    assert [tuple(row) for row in rows] == [
+        ('applications', 'applications-1'),
+        ('service_principals', 'service_principals-1')
+    ]
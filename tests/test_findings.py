@@ -0,0 +1,75 @@
+import pytest
+
+from GraphAudit.findings import FindingsStore, FindingsError
+from GraphAudit import GraphData
+
+from conftest import service_principals
+
+ENABLED = "SELECT id AS sp_id FROM service_principals WHERE accountEnabled"
+
+
+def collect(graph_data, df):
+    graph_data.reset_snapshot()
+    graph_data.store_table('service_principals', df, persist=False)
+
+
+def test_first_evaluation_is_full(graph_data, detection):
+    collect(graph_data, service_principals(s1=True, s2=False, s3=True))
+    store = FindingsStore(graph_data, persist=False)
+    new, resolved, unchanged = store.evaluate(detection(graph_data, ENABLED))
+    assert (new, resolved, unchanged) == ({'s1', 's3'}, set(), set())
+
+
+def test_incremental_new_and_resolved(graph_data, detection):
+    enabled = detection(graph_data, ENABLED)
+    store = FindingsStore(graph_data, persist=False)
+    collect(graph_data, service_principals(s1=True, s2=False, s3=True))
+    store.evaluate(enabled)
+
+    collect(graph_data, service_principals(s1=False, s2=True, s3=True))
+    assert store.needs_full_evaluation(enabled.query) is False
+    new, resolved, unchanged = store.evaluate(enabled)
+    assert (new, resolved, unchanged) == ({'s2'}, {'s1'}, {'s3'})
+
+    rows = graph_data.query(
+        "SELECT sp_id, found_snapshot, resolved_snapshot FROM findings ORDER BY sp_id, found_snapshot",
+        output_format='list'
+    )
+    assert [tuple(row) for row in rows] == [('s1', 1, 2), ('s2', 2, None), ('s3', 1, None)]
+
+
+def test_no_new_snapshot_keeps_findings(graph_data, detection):
+    enabled = detection(graph_data, ENABLED)
+    store = FindingsStore(graph_data, persist=False)
+    collect(graph_data, service_principals(s1=True))
+    store.evaluate(enabled)
+    assert store.evaluate(enabled) == (set(), set(), {'s1'})
+
+
+def test_removed_sp_is_resolved(graph_data, detection):
+    enabled = detection(graph_data, ENABLED)
+    store = FindingsStore(graph_data, persist=False)
+    collect(graph_data, service_principals(s1=True, s2=True))
+    store.evaluate(enabled)
+
+    collect(graph_data, service_principals(s2=True))
+    assert store.evaluate(enabled) == (set(), {'s1'}, {'s2'})
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT id AS sp_id FROM service_principals WHERE graph_can_reach(id, 'tenant')",
+    "SELECT sp.id AS sp_id FROM service_principals sp JOIN findings f ON f.sp_id = sp.id",
+])
+def test_needs_full_evaluation(graph_data, query):
+    # Graph walks and tables without an SP key depend on unchanged SPs too
+    assert FindingsStore(graph_data, persist=False).needs_full_evaluation(query)
+
+
+def test_federated_tenants_are_refused(tmp_path):
+    paths = {}
+    for tenant in ('t1', 't2'):
+        path = str(tmp_path / f'{tenant}.db')
+        GraphData(path).store_table('service_principals', service_principals(s1=True))
+        paths[tenant] = path
+    with pytest.raises(FindingsError):
+        FindingsStore(GraphData(tenants=paths))
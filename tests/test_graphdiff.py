@@ -0,0 +1,55 @@
+from GraphAudit import GraphData, GraphDiff
+
+from conftest import service_principals
+
+
+def collect(db_path, df, diff=True):
+    graph_diff = None
+    if diff:
+        graph_diff = GraphDiff()
+        graph_diff.make_hash('service_principals', ['passwordCredentials', 'keyCredentials'])
+    graph_data = GraphData(db_path, graph_diff)
+    graph_data.store_table('service_principals', df)
+    if graph_diff is None:
+        return None
+    try:
+        results = graph_diff.results('service_principals')
+    except KeyError:
+        # The first collection only saves fingerprints
+        return {}
+    return {change: len(rows) for change, rows in results.items()}
+
+
+def test_unchanged_collection_reports_nothing(db_path):
+    a = service_principals(s1=True, s2=True)
+    collect(db_path, a)
+    changes = collect(db_path, a)
+    assert sum(changes.values()) == 0
+
+
+def test_credential_change_is_reported(db_path):
+    a = service_principals(s1=True, s2=True)
+    b = a.copy()
+    b.loc[b.id == 's1', 'passwordCredentials'] = '[{"keyId": "k1"}]'
+    collect(db_path, a)
+    changes = collect(db_path, b)
+    assert changes.get('mod') == 1
+    assert sum(changes.values()) == 1
+
+
+def test_collection_without_diff_drops_fingerprints(db_path):
+    # diff(A), collect(B) without a diff, diff(A): the fingerprints of A
+    # are stale once B is stored, so going back to A is a modification
+    a = service_principals(s1=True)
+    b = a.assign(passwordCredentials='[{"keyId": "k1"}]')
+    collect(db_path, a)
+    collect(db_path, b, diff=False)
+    changes = collect(db_path, a)
+    assert changes.get('mod') == 1
+
+    graph_data = GraphData(db_path)
+    rows = graph_data.query(
+        "SELECT count(*) FROM row_fingerprints WHERE table_name = 'service_principals'",
+        output_format='list'
+    )
+    assert rows[0][0] == 1
@@ -0,0 +1,76 @@
+import glob
+import threading
+
+import pytest
+
+from GraphAudit import graphdata
+from GraphAudit.graphdata import GraphData, GraphException
+
+from conftest import service_principals
+
+
+def staging_files(db_path):
+    return sorted(glob.glob(f"{db_path}.*.staging*"))
+
+
+def count(db_path, table):
+    return GraphData(db_path).db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+
+@pytest.fixture
+def collected(db_path):
+    graph_data = GraphData(db_path)
+    with graph_data.staging():
+        graph_data.store_table('service_principals', service_principals(s1=True, s2=True))
+    return db_path
+
+
+def test_collection_is_published(collected):
+    assert count(collected, 'service_principals') == 2
+    assert staging_files(collected) == []
+
+
+def test_failed_collection_is_rolled_back(collected):
+    graph_data = GraphData(collected)
+    with pytest.raises(RuntimeError):
+        with graph_data.staging():
+            graph_data.store_table('service_principals', service_principals(s1=True, s2=True, s3=True))
+            raise RuntimeError("crawl failed")
+    assert staging_files(collected) == []
+    assert count(collected, 'service_principals') == 2
+    # The in-memory tables are reloaded from the published database
+    assert graph_data.db.execute("SELECT count(*) FROM service_principals").fetchone()[0] == 2
+
+
+def test_publish_under_held_lock_keeps_staging_file(collected, lock_holder, monkeypatch):
+    monkeypatch.setattr(graphdata, 'LOCK_RETRIES', 1)
+    graph_data = GraphData(collected)
+    lock_holder(collected)
+    with pytest.raises(GraphException, match="kept in"):
+        with graph_data.staging():
+            graph_data.store_table('service_principals', service_principals(s1=True, s2=True, s3=True))
+
+    kept = [path for path in staging_files(collected) if path.endswith('.staging')]
+    assert len(kept) == 1
+    # The reload failed on the same lock, so the tables in memory are still
+    # the collection that was not published
+    assert 'service_principals' in graph_data.tables
+    assert graph_data.db.execute("SELECT count(*) FROM service_principals").fetchone()[0] == 3
+
+
+def test_reader_waits_for_lock(collected, lock_holder):
+    holder = lock_holder(collected)
+    timer = threading.Timer(0.5, holder.kill)
+    timer.start()
+    try:
+        assert count(collected, 'service_principals') == 2
+    finally:
+        timer.cancel()
+
+
+def test_reader_gives_up_on_held_lock(collected, lock_holder, monkeypatch):
+    monkeypatch.setattr(graphdata, 'LOCK_RETRIES', 2)
+    monkeypatch.setattr(graphdata, 'LOCK_BACKOFF', 0.01)
+    lock_holder(collected)
+    with pytest.raises(GraphException, match="lock"):
+        GraphData(collected)